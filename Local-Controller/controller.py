@@ -4,6 +4,7 @@ from time import sleep
 import threading
 import multiprocessing
 import argparse
+import os
 
 sys.path.append("/opt/bf-sde-9.9.0/install/lib/python3.8/site-packages/tofino")
 sys.path.append("/opt/bf-sde-9.9.0/install/lib/python3.8/site-packages/tofino/bfrt_grpc")
@@ -16,17 +17,24 @@ from libs.Switch import Switch, TerminalColor
 import logging
 from scapy.all import *
 from libs import Helper
+from libs import TimeQuantization
 from libs.controller.StreamFilterController import StreamFilterController
 from libs.controller.StreamGateController import StreamGateController
 from libs.controller.FlowMeterController import FlowMeterController
 from simulation import Simulation
 from libs.configuration import Config
+from libs.Reconciler import Reconciler
+from libs.ScheduleAnalysis import ScheduleAnalysis
+from libs.MetricsExporter import MetricsExporter
+from libs.DigestLog import DigestRecorder
 
-from conn_mgr_pd_rpc.ttypes import *
-from ptf.thriftutils import *
-from res_pd_rpc.ttypes import *
-from pal_rpc.ttypes import *
-import bfrt_grpc.client as gc
+from libs.bfrt import gc, SDE_AVAILABLE
+
+if SDE_AVAILABLE:
+    from conn_mgr_pd_rpc.ttypes import *
+    from ptf.thriftutils import *
+    from res_pd_rpc.ttypes import *
+    from pal_rpc.ttypes import *
 
 
 logging.basicConfig(level=logging.INFO, datefmt='%d.%m.%Y %I:%M:%S', format='[%(levelname)s] %(asctime)s %(message)s')
@@ -35,85 +43,68 @@ def main():
 
     parser = argparse.ArgumentParser(description="Control plane")
     parser.add_argument('-c' , '--config', default="configuration.json", action='store', type=str, help="Config file to load.")
+    parser.add_argument('--mock', action='store_true', help="Run against the in-memory mock backend instead of a switch.")
+    parser.add_argument('--mock-latency', default=0.0, action='store', type=float, help="Injected latency per RPC of the mock backend in seconds.")
+    parser.add_argument('--mock-define', default=[], action='append', type=str, metavar="NAME=VALUE", help="Compile time option of the P4 program modeled by the mock backend, e.g. __SHARED_SCHEDULES__=1.")
+    parser.add_argument('--warm', action='store_true', help="Adopt the state of the running switch instead of reprovisioning it, e.g. after a controller restart.")
+    parser.add_argument('--reload', action='store_true', help="Apply changes of the config file while running, only differing table entries are written.")
+    parser.add_argument('--metrics-port', default=None, action='store', type=int, help="Serve PSFP counters and registers in the OpenMetrics format on this localhost port.")
+    parser.add_argument('--metrics-interval', default=1.0, action='store', type=float, help="Seconds between two renderings of the metrics served to scrapes.")
+    parser.add_argument('--metrics-poll-interval', default=0.25, action='store', type=float, help="Seconds between two polls of the counters by the metrics exporter, at most 0.344 so the byte counters wrap at most once in between at 100G.")
+    parser.add_argument('--print-digests', action='store_true', help="Print every block digest instead of only periodic summaries.")
+    parser.add_argument('--digest-window', default=10.0, action='store', type=float, help="Seconds per summary of the block digests.")
+    parser.add_argument('--analyze', action='store_true', help="Check the schedules and hyperperiods of the config file without contacting the switch and exit, see libs/ScheduleAnalysis.py.")
+    parser.add_argument('--record-digests', default=None, action='store', type=str, help="Record all received digests to this file, see libs/DigestLog.py.")
     args = parser.parse_args()
 
-    s1 = Switch(name="s1", ip="127.0.0.1", grpc_port=50052, thrift_port=9090, program="sdn-psfp", clear=False)
-    pm = PortManager(switch=s1)
-
-    # Reset table data
-    s1.delete_all_table_data()
+    if args.analyze:
+        sys.exit(analyze(args.config))
 
+    mock_defines = {name: int(value) for name, value in (d.split("=", 1) for d in args.mock_define)}
+    s1 = Switch(name="s1", ip="127.0.0.1", grpc_port=50052, thrift_port=9090, program="sdn-psfp", clear=False,
+                mock=args.mock, mock_latency=args.mock_latency, mock_defines=mock_defines)
+    pm = PortManager(switch=s1)
 
-    hosts = [{"name": "carrie-host", "auto_neg_in": 2, "port": 7, "internal_port": pm.get_port_id(7), "recirculation_port": 26, "ipv4_dst": "10.1.1.2", "mac_dst": "00:0f:53:73:e6:70", "egress_port": 7, "auto_neg_eg": 2, "internal_egress_port": pm.get_port_id(7)},
-             {"name": "p4tg-voip", "auto_neg_in": 0,"port": 8, "internal_port": pm.get_port_id(8), "recirculation_port": 25, "ipv4_dst": "1.2.3.5", "mac_dst": "de:ad:be:ef:de:ad", "egress_port": 8, "auto_neg_eg": 0, "internal_egress_port": pm.get_port_id(8)},
-             {"name": "p4tg-bulk", "auto_neg_in": 0,"port": 11, "internal_port": pm.get_port_id(11), "recirculation_port": 17, "ipv4_dst": "5.6.7.8", "mac_dst": "de:ad:be:ef:de:ad", "egress_port": 11, "auto_neg_eg": 0, "internal_egress_port": pm.get_port_id(11)},
-             {"name": "p4tg-bulk2", "auto_neg_in": 0,"port": 12, "internal_port": pm.get_port_id(12), "recirculation_port": 18, "ipv4_dst": "1.2.3.4", "mac_dst": "de:ad:be:ef:de:ad", "egress_port": 11, "auto_neg_eg": 0, "internal_egress_port": pm.get_port_id(11)}]
-
+    hosts = get_hosts(pm)
 
-    config = Config(args.config)
+    # The schedules are validated with the quantization of the loaded P4 program
+    config = Config(args.config, validate=False)
 
     if config.simulate:
         logging.basicConfig(level=logging.DEBUG, datefmt='%m/%d/%Y %I:%M:%S', format='[%(levelname)s] %(asctime)s %(message)s')
 
-    # Configure ports
-    for h in hosts:
-        ingress_port = h["port"]
-        internal_ingress_port = h["internal_port"]
-        recirc_port = h["recirculation_port"]
-        internal_egress_port = h["internal_egress_port"]
-        egress_port = h["egress_port"]
+    configure_time_quantization(s1, config)
+    config.validate_config()
 
-        # Configure ingress port
-        pm.add_port(port=ingress_port, channel=0, speed=7, fec=0, auto_neg=h["auto_neg_in"])
-        # Configure recirculation port
-        pm.add_port(port=recirc_port, channel=0, speed=7, fec=0, auto_neg=0, loopback=True) 
+    reconciler = warm_start(s1, config) if args.warm else None
 
-        # Configure egress port
-        pm.add_port(port=egress_port, channel=0, speed=7, fec=0, auto_neg=h["auto_neg_eg"]) 
+    if not reconciler:
+        if args.warm:
+            logging.warning(f"Warm start on Switch {s1.name} not possible, reprovisioning it.")
 
+        # Reset table data
+        s1.delete_all_table_data()
 
-        # Set recirculation port mapping
-        s1.write_table_entry(table="ingress.psfp_c.mapping_ingress_recirculation_port",
-                        match_fields={"ig_intr_md.ingress_port": internal_ingress_port},   
-                        action_name="ingress.psfp_c.set_recirculation_port",
-                        action_params={"recirc_port": pm.get_port_id(recirc_port)})
+        configure_hosts(s1, pm, hosts)
 
-        # Configure IPv4 Forwarding
-        s1.write_table_entry(table="ingress.ipv4_c.ipv4",
-                match_fields={"hdr.ipv4.dstAddr": (h["ipv4_dst"], 32, "lpm")},   
-                action_name="ingress.ipv4_c.ipv4_forward",
-                action_params={"eth_dst_addr": Helper.str_to_mac(h["mac_dst"]),       
-                "port": internal_egress_port})
-  
-    #pm.add_port(port=7, channel=0, speed=7, fec=0, auto_neg=2) # disable auto negotiation for this port
-
-    # ! P4TG Eval specific
-    #push_vlan_headers(s1, hosts[1]["internal_port"], 1337)
-    #push_vlan_headers(s1, hosts[2]["internal_port"], 1337)
-    #push_vlan_headers(s1, hosts[3]["internal_port"], 1337)
+        #pm.add_port(port=7, channel=0, speed=7, fec=0, auto_neg=2) # disable auto negotiation for this port
 
-            
-    # Creates table entries for Filter, Gate and Meters
-    s1.stream_filter_controller = StreamFilterController(s1, config.instances_streams, config.instances_filters)
-    s1.stream_filter_controller.create_table_entries()
+        # ! P4TG Eval specific
+        #push_vlan_headers(s1, hosts[1]["internal_port"], 1337)
+        #push_vlan_headers(s1, hosts[2]["internal_port"], 1337)
+        #push_vlan_headers(s1, hosts[3]["internal_port"], 1337)
 
-    s1.stream_gate_controller = StreamGateController(s1, config.instances_gates, config)
+        # Creates table entries for Filter, Gate and Meters
+        create_stream_filters(s1, config)
+        create_stream_gates(s1, config)
+        create_flow_meters(s1, config)
 
-    s1.flow_meter_controller = FlowMeterController(s1, config.instances_flow_meters)
-    s1.flow_meter_controller.write_meter_table()
+        # Initialize pkt generator for hyperperiods
+        configure_hyperperiods(s1, config)
 
-    # Initialize pkt generator for hyperperiods
-    s1.init_pktgen()
-
-    app_id=0
-    for p in config.schedule_port_mappings:
-        # There can be multiple schedules per port, as long as they share the same hyperperiod
-        # There can only be 8 different hyperperiods.
-        s1.pkt_gen.configure_pkt_gen(app_id=app_id, period=p["period"], port=p["port"])
-        app_id += 1
+        reconciler = Reconciler(s1, config)
 
-    s1.init_underflow_detection_table()
-    s1.pkt_gen.init_clock_drift_offset_detection_table()
+    config_mtime = os.path.getmtime(args.config)
 
     #s1.dump_table("ingress.ipv4_c.ipv4")
 
@@ -167,6 +158,11 @@ def main():
     #s1.dump_table("egress.underflow_detection")
     #s1.dump_table("egress.decide_shift_dir")
 
+    s1.print_digests = args.print_digests
+    if args.record_digests:
+        s1.digest_recorder = DigestRecorder(args.record_digests)
+    s1.digest_stats.window = args.digest_window
+
     # Threads for receiving digests
     t1 = threading.Thread(target=s1.listen_for_digests, args=(), daemon=True, name="Digest-Listener")
     t1.start()
@@ -174,6 +170,11 @@ def main():
     t2 = threading.Thread(target=delta_adjustment_thread, args=(s1,), daemon=True, name="Delta-Adjustment")
     t2.start()
 
+    if args.metrics_port is not None:
+        s1.metrics_exporter = MetricsExporter(s1, port=args.metrics_port, interval=args.metrics_interval,
+                                              poll_interval=args.metrics_poll_interval)
+        s1.metrics_exporter.start()
+
     logging.info(f"{TerminalColor.RED.value}----------------------------- WAIT FOR FIRST HYPERPERIOD TO FINISH ----------------------------{TerminalColor.DEFAULT.value}")
 
     if config.simulate:
@@ -184,7 +185,9 @@ def main():
                             csv_file=config.simulation_csv_file,
                             simulation_duration=config.simulation_duration, 
                             stream_gate_id=config.monitor_stream_gate_id,
-                            flow_meter_id=config.monitor_flow_meter_id)
+                            flow_meter_id=config.monitor_flow_meter_id,
+                            sampling_interval=config.sampling_interval,
+                            sampling_capacity=config.sampling_capacity)
         try:
             while not s1.sim.exit_flag:
                 sleep(1)
@@ -198,8 +201,13 @@ def main():
         try:
             while True:  
 
-                s1.dump_table("ingress.psfp_c.streamGate_c.stream_gate_instance")
-                print(s1.get_counter_at_index("ingress.psfp_c.streamGate_c.missed_interval_counter", 2))
+                if args.reload and os.path.getmtime(args.config) != config_mtime:
+                    config_mtime = os.path.getmtime(args.config)
+                    reconciler.reload(args.config)
+
+                # Counters and registers are exported with --metrics-port, reading them here would block this thread
+                #s1.dump_table("ingress.psfp_c.streamGate_c.stream_gate_instance")
+                #print(s1.get_counter_at_index("ingress.psfp_c.streamGate_c.missed_interval_counter", 2))
                 #print(s1.read_register(register_name="ingress.psfp_c.streamGate_c.reg_gate_blocked", register_index=2)[0])
                 #print(s1.get_counter_at_index("ingress.psfp_c.flowMeter_c.marked_red_counter", 100))
                 #print(s1.get_counter_at_index("ingress.psfp_c.flowMeter_c.marked_yellow_counter", 100))
@@ -225,6 +233,140 @@ def main():
     s1.shutdown()
 
 
+
+def get_hosts(pm):
+    """
+    Returns the hosts connected to the switch with their ingress, recirculation and egress ports.
+    """
+    return [{"name": "carrie-host", "auto_neg_in": 2, "port": 7, "internal_port": pm.get_port_id(7), "recirculation_port": 26, "ipv4_dst": "10.1.1.2", "mac_dst": "00:0f:53:73:e6:70", "egress_port": 7, "auto_neg_eg": 2, "internal_egress_port": pm.get_port_id(7)},
+            {"name": "p4tg-voip", "auto_neg_in": 0,"port": 8, "internal_port": pm.get_port_id(8), "recirculation_port": 25, "ipv4_dst": "1.2.3.5", "mac_dst": "de:ad:be:ef:de:ad", "egress_port": 8, "auto_neg_eg": 0, "internal_egress_port": pm.get_port_id(8)},
+            {"name": "p4tg-bulk", "auto_neg_in": 0,"port": 11, "internal_port": pm.get_port_id(11), "recirculation_port": 17, "ipv4_dst": "5.6.7.8", "mac_dst": "de:ad:be:ef:de:ad", "egress_port": 11, "auto_neg_eg": 0, "internal_egress_port": pm.get_port_id(11)},
+            {"name": "p4tg-bulk2", "auto_neg_in": 0,"port": 12, "internal_port": pm.get_port_id(12), "recirculation_port": 18, "ipv4_dst": "1.2.3.4", "mac_dst": "de:ad:be:ef:de:ad", "egress_port": 11, "auto_neg_eg": 0, "internal_egress_port": pm.get_port_id(11)}]
+
+
+def configure_hosts(switch, pm, hosts):
+    """
+    Configures ingress, recirculation and egress port of every host, the recirculation port mapping and IPv4 forwarding.
+    """
+    for h in hosts:
+        ingress_port = h["port"]
+        internal_ingress_port = h["internal_port"]
+        recirc_port = h["recirculation_port"]
+        internal_egress_port = h["internal_egress_port"]
+        egress_port = h["egress_port"]
+
+        # Configure ingress port
+        pm.add_port(port=ingress_port, channel=0, speed=7, fec=0, auto_neg=h["auto_neg_in"])
+        # Configure recirculation port
+        pm.add_port(port=recirc_port, channel=0, speed=7, fec=0, auto_neg=0, loopback=True) 
+
+        # Configure egress port
+        pm.add_port(port=egress_port, channel=0, speed=7, fec=0, auto_neg=h["auto_neg_eg"]) 
+
+
+        # Set recirculation port mapping
+        switch.write_table_entry(table="ingress.psfp_c.mapping_ingress_recirculation_port",
+                        match_fields={"ig_intr_md.ingress_port": internal_ingress_port},   
+                        action_name="ingress.psfp_c.set_recirculation_port",
+                        action_params={"recirc_port": pm.get_port_id(recirc_port)})
+
+        # Configure IPv4 Forwarding
+        switch.write_table_entry(table="ingress.ipv4_c.ipv4",
+                match_fields={"hdr.ipv4.dstAddr": (h["ipv4_dst"], 32, "lpm")},   
+                action_name="ingress.ipv4_c.ipv4_forward",
+                action_params={"eth_dst_addr": Helper.str_to_mac(h["mac_dst"]),       
+                "port": internal_egress_port})
+
+
+def analyze(config_file):
+    """
+    Checks the schedules and hyperperiods of a configuration without contacting the switch, see ScheduleAnalysis.
+    The timestamps are quantized with ts_shift and ts_width of the configuration.
+
+    :returns exit_code: 0 if the configuration is valid, 1 otherwise.
+    """
+    try:
+        config = Config(config_file, validate=False)
+    except AssertionError as e:
+        logging.error(f"Configuration {config_file} is invalid: {e}")
+        return 1
+    TimeQuantization.configure(config.ts_shift, TimeQuantization.TS_WIDTH if config.ts_width is None else config.ts_width)
+
+    errors = [i for i in ScheduleAnalysis(config).log_report() if i.severity == ScheduleAnalysis.ERROR]
+    try:
+        config.validate_config(schedules=False)
+    except AssertionError as e:
+        errors.append(e)
+        logging.error(f"Configuration {config_file} has duplicate or undefined IDs: {e!r}")
+
+    if errors:
+        logging.error(f"Configuration {config_file} is invalid.")
+        return 1
+    logging.info(f"Configuration {config_file} is valid.")
+    return 0
+
+
+def configure_time_quantization(switch, config):
+    """
+    Quantizes timestamps like the P4 program, see __TS_SHIFT__ and __TS_WIDTH__ in headers.p4.
+    The width is taken from the match_ts key of the program, the shift from the configuration.
+    """
+    width = switch.encoder(StreamGateController.GATE_TABLE).key_sizes[StreamGateController.TS_FIELD]
+    if config.ts_width is not None and width != config.ts_width:
+        logging.warning(f"Configuration sets ts_width={config.ts_width}, but the P4 program on Switch {switch.name} "
+                        f"matches on {width} bit timestamps, see __TS_WIDTH__. Following the P4 program.")
+    TimeQuantization.configure(config.ts_shift, width)
+
+
+def create_stream_filters(switch, config):
+    switch.stream_filter_controller = StreamFilterController(switch, config.instances_streams, config.instances_filters)
+    switch.stream_filter_controller.create_table_entries()
+
+
+def create_stream_gates(switch, config):
+    # Schedules are written once the first hyperperiod of their port is done, see Switch.handle_digest
+    switch.stream_gate_controller = StreamGateController(switch, config.instances_gates, config)
+
+
+def create_flow_meters(switch, config):
+    switch.flow_meter_controller = FlowMeterController(switch, config.instances_flow_meters)
+    switch.flow_meter_controller.write_meter_table()
+
+
+def configure_hyperperiods(switch, config):
+    """
+    Configures one packet generator application per port with a schedule and the detection tables for underflows and clock drift.
+    """
+    switch.init_pktgen()
+
+    app_id=0
+    for p in config.schedule_port_mappings:
+        # There can be multiple schedules per port, as long as they share the same hyperperiod
+        # There can only be 8 different hyperperiods.
+        switch.pkt_gen.configure_pkt_gen(app_id=app_id, period=p["period"], port=p["port"])
+        app_id += 1
+
+    switch.init_underflow_detection_table()
+    switch.pkt_gen.init_clock_drift_offset_detection_table()
+
+
+def warm_start(switch, config):
+    """
+    Adopts the tables, registers and hyperperiods of a switch that is already provisioned, see Reconciler.warm_start.
+    Ports are not reconfigured and traffic is not interrupted.
+
+    :returns reconciler: Reconciler of the switch or None if a cold start is required.
+    """
+    switch.stream_filter_controller = StreamFilterController(switch, config.instances_streams, config.instances_filters, reset_registers=False)
+    switch.stream_gate_controller = StreamGateController(switch, config.instances_gates, config, reset_registers=False)
+    switch.flow_meter_controller = FlowMeterController(switch, config.instances_flow_meters)
+
+    reconciler = Reconciler(switch, config)
+    if reconciler.warm_start():
+        return reconciler
+    return None
+
+
 def push_vlan_headers(switch, port, vid):
     switch.write_table_entry(table="ingress.push_802_1q_header",
                 match_fields={"ig_intr_md.ingress_port": port},   
@@ -248,4 +390,5 @@ def delta_adjustment_thread(switch):
         switch.pkt_gen.delta_adjustment()
         sleep(.1)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+class BandwidthPlotter:
+    """
+    Long-lived renderer of the flow meter rates into an image file.
+
+    New data points are handed over with add() without waiting for the renderer.
+    A single thread redraws at most max_fps times per second, the figure and its line artists are created once
+    and only extended by the points that arrived since the last frame.
+    If rendering takes longer than a frame, frames are dropped and the next one contains all pending points.
+    Only the last capacity points are kept and drawn, so memory and rendering time do not grow with the run time.
+    """
+
+    # Data point key, label, color
+    LINES = [("green_rate", "Green Rate", "green"),
+             ("yellow_rate", "Yellow Rate", "orange"),
+             ("red_rate", "Dropping Rate", "red"),
+             ("send_rate", "Sending Rate", "blue")]
+
+    def __init__(self, file: str = "bandwidth.png", max_fps: float = 2, cir: float = 700, eir: float = 100,
+                 capacity: int = 10000):
+        self.file = file
+        self.min_frame_time = 1 / max_fps
+        self.capacity = capacity
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.new_data = threading.Event()
+        self.exit_event = threading.Event()
+        self.thread = None
+
+        self.frames = 0
+        self.dropped = 0
+
+        self.fig = Figure(figsize=(1920/100, 1440/100))
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_xlabel("Time in s", fontsize=25)
+        self.ax.set_ylabel("Bandwidth in mbps", fontsize=25)
+        self.ax.tick_params(axis='x', labelsize=22)
+        self.ax.tick_params(axis='y', labelsize=22)
+
+        self.x = deque(maxlen=capacity)
+        self.y = {key: deque(maxlen=capacity) for key, _, _ in self.LINES}
+        self.artists = {key: self.ax.plot([], [], label=label, color=color, marker="o", linewidth=3)[0]
+                        for key, label, color in self.LINES}
+        self.ax.axhline(eir, label="Excess Information Rate (EIR)", color="orange", linestyle='dotted', linewidth=3)
+        self.ax.axhline(cir, label="Committed Information Rate (CIR)", color="green", linestyle='dotted', linewidth=3)
+        self.ax.legend(fontsize=24)
+
+    def add(self, data_points: list):
+        """
+        Queues new data points for the next frame, never blocks on rendering.
+
+        :param data_points: list of dicts with seconds and the rates of LINES.
+        """
+        with self.lock:
+            self.pending += data_points
+            # Points beyond the capacity would be dropped from the window before they are drawn
+            del self.pending[:-self.capacity]
+        self.new_data.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, args=(), daemon=True, name="Bandwidth-Plotter")
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the renderer after drawing the pending points.
+        """
+        self.exit_event.set()
+        self.new_data.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        last_frame = 0
+        while not self.exit_event.is_set():
+            self.new_data.wait()
+
+            # Rate limit, points that arrive in the meantime are drawn with the next frame
+            delay = last_frame + self.min_frame_time - time.monotonic()
+            if delay > 0 and self.exit_event.wait(delay):
+                break
+
+            self.new_data.clear()
+            last_frame = time.monotonic()
+            self.render()
+
+            missed = int((time.monotonic() - last_frame) / self.min_frame_time)
+            self.dropped += missed
+
+        self.render()
+        if self.dropped:
+            logging.debug(f"Bandwidth plot: {self.frames} frames drawn, {self.dropped} dropped.")
+
+    def render(self):
+        with self.lock:
+            points, self.pending = self.pending, []
+        if not points:
+            return
+
+        self.x.extend(d['seconds'] for d in points)
+        for key, artist in self.artists.items():
+            self.y[key].extend(d[key] for d in points)
+            artist.set_data(list(self.x), list(self.y[key]))
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.fig.savefig(self.file)
+        self.frames += 1
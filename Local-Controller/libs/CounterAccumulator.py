@@ -0,0 +1,131 @@
+import logging
+
+import numpy as np
+
+
+class CounterAccumulator:
+    """
+    Extends polled data plane counters of a limited width to monotonically increasing 64-bit totals.
+
+    The counters of the data plane are 32 bits wide and wrap, the byte counters within a fraction of a second at line rate.
+    Between two polls the difference of the raw values modulo 2^width is added to the total,
+    which is correct as long as a counter wraps at most once between two polls, see max_poll_interval.
+    Polls after a longer interval, e.g. after failed reads, can miss wraps. They are counted as suspect intervals,
+    the totals are still extended by the increment modulo 2^width.
+
+    All counters of a table are accumulated together as columns of numpy arrays.
+
+    :param num_counters: Number of counters, e.g. the polled indices of a table.
+    :param width: Bit width of the counters in the data plane.
+    :param max_rate: Highest expected increment per second, used to warn about poll intervals that can miss a wrap.
+    """
+
+    def __init__(self, num_counters: int, width: int = 32, max_rate: float = None):
+        self.modulus = 1 << width
+        self.max_rate = max_rate
+
+        self.last_raw = np.zeros(num_counters, dtype=np.uint64)
+        self.total = np.zeros(num_counters, dtype=np.uint64)
+        self.last_ts = None
+        self.wraps = 0
+        # Number of poll intervals above max_poll_interval, and if the last poll ended one of them
+        self.suspect_intervals = 0
+        self.suspect = False
+
+    def max_poll_interval(self):
+        """
+        Returns the longest poll interval in seconds in which a counter wraps at most once at max_rate.
+        """
+        return self.modulus / self.max_rate if self.max_rate else float("inf")
+
+    def update(self, ts: float, raw):
+        """
+        Adds a poll of the raw counter values.
+        The first poll is taken as the start value of the totals.
+
+        :param ts: Time of the poll in seconds.
+        :param raw: Raw counter values, one per counter.
+
+        :returns total: The 64-bit totals, one per counter.
+        """
+        raw = np.asarray(raw, dtype=np.uint64) % np.uint64(self.modulus)
+
+        if self.last_ts is None:
+            self.total = raw.copy()
+        else:
+            self.suspect = ts - self.last_ts > self.max_poll_interval()
+            if self.suspect:
+                if not self.suspect_intervals:
+                    logging.warning(f"Counters were polled after {ts - self.last_ts:.3f}s, wraps are missed above "
+                                    f"{self.max_poll_interval():.3f}s at {self.max_rate:.0f}/s.")
+                self.suspect_intervals += 1
+
+            wrapped = raw < self.last_raw
+            self.wraps += int(wrapped.sum())
+            # Unsigned subtraction wraps around, the modulo is the increment since the last poll
+            self.total += (raw - self.last_raw) % np.uint64(self.modulus)
+
+        self.last_raw = raw
+        self.last_ts = ts
+        return self.total.copy()
+
+    def rates(self, ts: float, raw):
+        """
+        Adds a poll like update() and returns the increments per second since the previous poll.
+
+        :returns total, rate: The 64-bit totals and the rates, all rates are 0 on the first poll.
+        """
+        last_total, last_ts = self.total.copy(), self.last_ts
+        total = self.update(ts, raw)
+        if last_ts is None or ts <= last_ts:
+            return total, np.zeros(len(total))
+        return total, (total - last_total) / (ts - last_ts)
+
+
+class CounterTableAccumulator:
+    """
+    Accumulates the packet and byte counters of many indices or entries of a counter table.
+    The accumulators start over if the set of polled indices changes, e.g. after a configuration reload.
+
+    :param max_bytes_rate: Highest expected bytes per second of a counter, defaults to 100G line rate.
+    """
+
+    def __init__(self, width: int = 32, max_bytes_rate: float = 100e9 / 8):
+        self.width = width
+        self.max_bytes_rate = max_bytes_rate
+        self.keys = None
+        self.pkts = None
+        self.bytes = None
+        # Poll intervals in which a packet or byte counter could have wrapped more than once, kept over restarts
+        self.suspect_intervals = 0
+
+    def max_poll_interval(self):
+        """
+        Returns the longest poll interval in seconds in which no counter wraps more than once,
+        the byte counters wrap first.
+        """
+        return (1 << self.width) / self.max_bytes_rate
+
+    def update(self, ts: float, keys: list, rows: list):
+        """
+        :param keys: Identifiers of the polled counters, e.g. the counter indices.
+        :param rows: Data dicts of the counters with $COUNTER_SPEC_PKTS and optionally $COUNTER_SPEC_BYTES.
+
+        :returns rows: dict of key to a copy of the row with the 64-bit totals.
+        """
+        if keys != self.keys:
+            self.keys = list(keys)
+            # The smallest frame is 64 bytes
+            self.pkts = CounterAccumulator(len(keys), self.width, self.max_bytes_rate / 64)
+            self.bytes = CounterAccumulator(len(keys), self.width, self.max_bytes_rate)
+
+        pkts = self.pkts.update(ts, [r["$COUNTER_SPEC_PKTS"] for r in rows])
+        pkt_bytes = self.bytes.update(ts, [r.get("$COUNTER_SPEC_BYTES", 0) for r in rows])
+        self.suspect_intervals += int(self.pkts.suspect or self.bytes.suspect)
+
+        totals = {}
+        for i, (k, r) in enumerate(zip(keys, rows)):
+            totals[k] = dict(r, **{"$COUNTER_SPEC_PKTS": int(pkts[i])})
+            if "$COUNTER_SPEC_BYTES" in r:
+                totals[k]["$COUNTER_SPEC_BYTES"] = int(pkt_bytes[i])
+        return totals
@@ -0,0 +1,156 @@
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+
+# A decoded digest, digest_type is None for digests without a reason, e.g. debug digests
+DigestRecord = namedtuple("DigestRecord", ["digest_type", "data", "received"])
+
+
+class DigestQueueStats:
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self.handled = 0
+        self.failed = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # Time from receiving a digest until its handler starts
+        self.wait_max = 0.0
+
+
+class DigestDispatcher:
+    """
+    Receives digests of a switch and dispatches them by digest type to handlers.
+
+    Every digest type has a bounded queue and a dedicated worker thread, so a storm of one type,
+    e.g. MARKEDRED, neither delays other types nor the receiving thread.
+    If the queue of a type is full, new digests of that type are dropped and counted.
+    Digests of priority types are never dropped, their queues are unbounded,
+    and they are dispatched before the other digests of the same batch.
+
+    Queue depth, drops and the handler latency of every type are available with stats().
+    """
+
+    def __init__(self, switch, queue_size: int = 1024, priority_types: tuple = ()):
+        self.s = switch
+        self.queue_size = queue_size
+        self.priority_types = set(priority_types)
+
+        self.handlers = {}
+        self.queues = {}
+        self.stats_by_type = {}
+        self.stats_lock = threading.Lock()
+        self.exit_event = threading.Event()
+        self.workers = []
+
+    def register(self, digest_type, handler):
+        """
+        Registers the handler of a digest type, handler is called with the DigestRecord.
+        Digests of types without a handler are dropped.
+
+        :param digest_type: DigestType or None for digests without a reason.
+        """
+        self.handlers[digest_type] = handler
+        self.queues[digest_type] = queue.Queue(maxsize=0 if digest_type in self.priority_types else self.queue_size)
+        self.stats_by_type[digest_type] = DigestQueueStats()
+
+    def _name(self, digest_type):
+        return digest_type.name if digest_type else "OTHER"
+
+    def start_workers(self):
+        for digest_type in self.handlers:
+            t = threading.Thread(target=self.work, args=(digest_type,), daemon=True,
+                                 name=f"Digest-{self._name(digest_type)}")
+            t.start()
+            self.workers.append(t)
+
+    def stop(self):
+        self.exit_event.set()
+        for q in self.queues.values():
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def drain(self, timeout: float = None):
+        """
+        Waits until every queued digest is handled.
+
+        :returns drained: False if the timeout expired.
+        """
+        end = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self.stats_lock:
+                pending = sum(s.received - s.dropped - s.handled for s in self.stats_by_type.values())
+            if not pending:
+                return True
+            if end is not None and time.monotonic() > end:
+                return False
+            time.sleep(0.001)
+
+    def dispatch(self, records: list):
+        """
+        Queues decoded digests for their workers, priority types first.
+        """
+        records = sorted(records, key=lambda r: r.digest_type not in self.priority_types)
+        for r in records:
+            q = self.queues.get(r.digest_type)
+            if q is None:
+                logging.error(f"No handler for digest {r.data}")
+                continue
+
+            stats = self.stats_by_type[r.digest_type]
+            with self.stats_lock:
+                stats.received += 1
+            try:
+                q.put_nowait(r)
+            except queue.Full:
+                with self.stats_lock:
+                    stats.dropped += 1
+                if stats.dropped == 1 or stats.dropped % self.queue_size == 0:
+                    logging.warning(f"Digest queue of {self._name(r.digest_type)} is full, {stats.dropped} digests dropped.")
+
+    def work(self, digest_type):
+        q = self.queues[digest_type]
+        handler = self.handlers[digest_type]
+        stats = self.stats_by_type[digest_type]
+
+        while not self.exit_event.is_set():
+            r = q.get()
+            if r is None:
+                break
+
+            start = time.monotonic()
+            try:
+                handler(r)
+                failed = 0
+            except Exception as e:
+                logging.exception(f"Handling digest {r.data} failed: {e}")
+                failed = 1
+            latency = time.monotonic() - start
+
+            with self.stats_lock:
+                stats.handled += 1
+                stats.failed += failed
+                stats.latency_sum += latency
+                stats.latency_max = max(stats.latency_max, latency)
+                stats.wait_max = max(stats.wait_max, start - r.received)
+
+    def stats(self):
+        """
+        :returns stats: dict of digest type name to a dict with queue_depth, received, dropped, handled, failed,
+                        latency_avg, latency_max and wait_max in seconds.
+        """
+        with self.stats_lock:
+            return {self._name(t): {"queue_depth": self.queues[t].qsize(),
+                                    "received": s.received,
+                                    "dropped": s.dropped,
+                                    "handled": s.handled,
+                                    "failed": s.failed,
+                                    "latency_avg": s.latency_sum / s.handled if s.handled else 0.0,
+                                    "latency_max": s.latency_max,
+                                    "wait_max": s.wait_max}
+                    for t, s in self.stats_by_type.items()}
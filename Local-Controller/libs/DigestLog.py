@@ -0,0 +1,152 @@
+"""
+Binary log of decoded digests.
+
+The log starts with MAGIC and consists of records that start with a record type byte:
+    SCHEMA: digest id (u16), name length (u16), name, field count (u16), per field: name length (u16), name
+    BATCH:  digest id (u16), seconds since the start of the recording (f64), entry count (u16), per entry one u64 per field
+The id of a digest is assigned by the recorder, the schema of a digest precedes its first batch.
+"""
+import logging
+import struct
+import threading
+import time
+
+MAGIC = b"PSFPDIG1"
+SCHEMA = 0
+BATCH = 1
+
+_U16 = struct.Struct("<H")
+_BATCH_HEADER = struct.Struct("<BHdH")
+
+
+def _pack_str(s: str):
+    b = s.encode()
+    return _U16.pack(len(b)) + b
+
+
+class DigestRecorder:
+    """
+    Writes every received digest batch with its receive time to a binary log, see read_digest_log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+        # Digest name to (id, fields)
+        self.schemas = {}
+        self.batches = 0
+
+    def record(self, name: str, entries: list, ts: float = None):
+        """
+        :param name: Name of the digest.
+        :param entries: Decoded entries of the digest, dicts of field name to integer value.
+        :param ts: Monotonic receive time, now if None.
+        """
+        if not entries:
+            return
+        ts = time.monotonic() if ts is None else ts
+
+        with self.lock:
+            if name not in self.schemas:
+                fields = list(entries[0].keys())
+                digest_id = len(self.schemas)
+                self.schemas[name] = (digest_id, fields)
+                self.file.write(bytes([SCHEMA]) + _U16.pack(digest_id) + _pack_str(name) + _U16.pack(len(fields)) +
+                                b"".join(_pack_str(f) for f in fields))
+
+            digest_id, fields = self.schemas[name]
+            values = [e[f] for e in entries for f in fields]
+            self.file.write(_BATCH_HEADER.pack(BATCH, digest_id, ts - self.start, len(entries)) +
+                            struct.pack(f"<{len(values)}Q", *values))
+            self.batches += 1
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+        logging.info(f"Recorded {self.batches} digests to {self.path}.")
+
+
+def read_digest_log(path: str):
+    """
+    Streams the batches of a digest log.
+
+    :returns batches: Generator of (seconds since the start of the recording, digest name, list of entry dicts).
+    """
+    schemas = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is no digest log!")
+
+        def read_str():
+            n, = _U16.unpack(f.read(2))
+            return f.read(n).decode()
+
+        while True:
+            record_type = f.read(1)
+            if not record_type:
+                return
+
+            if record_type[0] == SCHEMA:
+                digest_id, = _U16.unpack(f.read(2))
+                name = read_str()
+                n, = _U16.unpack(f.read(2))
+                schemas[digest_id] = (name, [read_str() for _ in range(n)])
+                continue
+
+            header = record_type + f.read(_BATCH_HEADER.size - 1)
+            if len(header) < _BATCH_HEADER.size:
+                # Incomplete batch at the end of an interrupted recording
+                return
+            _, digest_id, ts, count = _BATCH_HEADER.unpack(header)
+            name, fields = schemas[digest_id]
+            data = f.read(8 * count * len(fields))
+            if len(data) < 8 * count * len(fields):
+                return
+            values = struct.unpack(f"<{count * len(fields)}Q", data)
+            yield ts, name, [dict(zip(fields, values[i * len(fields):(i + 1) * len(fields)])) for i in range(count)]
+
+
+class DigestReplayer:
+    """
+    Feeds a digest log into the digest pipeline of a switch, i.e. its DigestDispatcher and handlers.
+
+    :param speed: Replay speed relative to the recording, 0 replays as fast as possible.
+    """
+
+    def __init__(self, switch, path: str, speed: float = 1.0):
+        self.s = switch
+        self.path = path
+        self.speed = speed
+
+    def run(self, timeout: float = 60):
+        """
+        Replays the log and waits until all digests are handled.
+
+        :returns result: dict with batches, entries, the replay duration and the handled entries per second.
+        """
+        dispatcher = self.s.digest_dispatcher
+        if not dispatcher.workers:
+            dispatcher.start_workers()
+
+        batches = entries = 0
+        start = time.monotonic()
+        for ts, _, data in read_digest_log(self.path):
+            if self.speed:
+                delay = start + ts / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            dispatcher.dispatch([self.s.digest_record(d) for d in data])
+            batches += 1
+            entries += len(data)
+
+        dispatcher.drain(timeout)
+        duration = time.monotonic() - start
+        return {"batches": batches, "entries": entries, "duration": duration,
+                "entries_per_s": entries / duration if duration else 0.0}
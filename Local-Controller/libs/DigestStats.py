@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+
+class DigestStats:
+    """
+    Aggregates block digests, i.e. oversize frames, invalid RX and marked red frames, instead of printing every event.
+
+    Events are counted per (reason, stream_handle, stream_gate_id, flow_meter_instance_id) in windows of window seconds.
+    At the end of every window with events a summary with the top_n offenders is logged.
+    The last complete window and the totals since the start are available with summary() and totals().
+    """
+
+    KEY_FIELDS = ("stream_handle", "stream_gate_id", "flow_meter_instance_id")
+
+    def __init__(self, window: float = 10.0, top_n: int = 5):
+        self.window = window
+        self.top_n = top_n
+
+        self.lock = threading.Lock()
+        self.exit_event = threading.Event()
+        self.thread = None
+
+        self.current = Counter()
+        self.current_start = time.time()
+        self.last = Counter()
+        self.last_start = self.last_end = None
+        self.total = Counter()
+
+    def add(self, record):
+        """
+        Counts a DigestRecord of a block digest.
+        """
+        key = (record.digest_type.name,) + tuple(record.data.get(f) for f in self.KEY_FIELDS)
+        with self.lock:
+            self.current[key] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, args=(), daemon=True, name="Digest-Stats")
+        self.thread.start()
+
+    def stop(self):
+        self.exit_event.set()
+
+    def run(self):
+        while not self.exit_event.wait(self.window):
+            self.roll()
+
+    def roll(self):
+        """
+        Ends the current window and logs its summary if it has events.
+        """
+        now = time.time()
+        with self.lock:
+            self.last, self.current = self.current, Counter()
+            self.last_start, self.last_end = self.current_start, now
+            self.current_start = now
+            self.total.update(self.last)
+
+        if self.last:
+            s = self.summary()
+            reasons = ", ".join(f"{r}={n}" for r, n in s["by_reason"].items())
+            top = "; ".join(f"{t['reason']} stream={t['stream_handle']} gate={t['stream_gate_id']} "
+                            f"meter={t['flow_meter_instance_id']}: {t['events']}" for t in s["top"])
+            logging.info(f"{s['events']} digests in the last {now - s['window_start']:.1f}s: {reasons}. Top: {top}")
+
+    @classmethod
+    def _top(cls, counts: Counter, n: int, reason: str = None):
+        items = [(k, c) for k, c in counts.items() if reason is None or k[0] == reason]
+        items.sort(key=lambda i: -i[1])
+        return [dict(zip(("reason",) + cls.KEY_FIELDS, k), events=c) for k, c in items[:n]]
+
+    @staticmethod
+    def _by_reason(counts: Counter):
+        by_reason = Counter()
+        for k, c in counts.items():
+            by_reason[k[0]] += c
+        return dict(by_reason)
+
+    def summary(self, n: int = None, reason: str = None):
+        """
+        Returns the summary of the last complete window.
+
+        :param n: Number of top offenders, top_n if None.
+        :param reason: Only offenders of this DigestType name.
+
+        :returns summary: dict with window_start, window_end, events, by_reason and top,
+                          a list of dicts with reason, stream_handle, stream_gate_id, flow_meter_instance_id and events.
+        """
+        with self.lock:
+            counts = Counter(self.last)
+            start, end = self.last_start, self.last_end
+        return {"window_start": start,
+                "window_end": end,
+                "events": sum(counts.values()),
+                "by_reason": self._by_reason(counts),
+                "top": self._top(counts, n or self.top_n, reason)}
+
+    def totals(self, n: int = None, reason: str = None):
+        """
+        Returns the events of all complete windows since the start, in the format of summary().
+        """
+        with self.lock:
+            counts = Counter(self.total)
+        return {"events": sum(counts.values()),
+                "by_reason": self._by_reason(counts),
+                "top": self._top(counts, n or self.top_n, reason)}
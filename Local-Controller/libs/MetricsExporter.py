@@ -0,0 +1,344 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libs.bfrt import gc
+from libs.CounterAccumulator import CounterTableAccumulator
+
+
+class MetricFamily:
+    """
+    A metric with its samples in the OpenMetrics text format.
+
+    :param metric_type: counter or gauge, the samples of counters get the suffix _total.
+    """
+
+    def __init__(self, name: str, metric_type: str, help_text: str):
+        self.name = name
+        self.metric_type = metric_type
+        self.help_text = help_text
+        self.samples = []
+
+    def add(self, labels: dict, value):
+        self.samples.append((labels, value))
+
+    def render(self):
+        suffix = "_total" if self.metric_type == "counter" else ""
+        lines = [f"# TYPE {self.name} {self.metric_type}", f"# HELP {self.name} {self.help_text}"]
+        for labels, value in self.samples:
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{self.name}{suffix}{{{label_str}}} {value}" if label_str else f"{self.name}{suffix} {value}")
+        return "\n".join(lines)
+
+
+class MetricsExporter:
+    """
+    Serves the PSFP counters, blocked states and Δ-adjustment values of a switch in the OpenMetrics text format.
+
+    A background thread polls all counters in bulk every poll_interval seconds, and every interval seconds
+    it reads the registers and renders all values once. Scrapes only return the cached text,
+    they never cause requests to the switch.
+    Counters are exported as 64-bit totals, wraps of the 32-bit data plane counters are accumulated.
+    The byte counters wrap every 0.344s at 100G, so poll_interval must not exceed max_poll_interval of
+    CounterTableAccumulator. Polls that still came too late are exported as psfp_counter_wraps_possibly_missed.
+    IDs beyond the size of a counter or register in the P4 program are not exported, see _indices.
+    The HTTP server only listens on localhost by default.
+    """
+
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    FLOW_METER_COUNTERS = {"green": "ingress.psfp_c.flowMeter_c.marked_green_counter",
+                           "yellow": "ingress.psfp_c.flowMeter_c.marked_yellow_counter",
+                           "red": "ingress.psfp_c.flowMeter_c.marked_red_counter"}
+    OVERALL_COUNTER = "ingress.psfp_c.streamFilter_c.overall_counter"
+    MAX_SDU_COUNTER = "ingress.psfp_c.streamFilter_c.missed_max_sdu_filter_counter"
+    GATE_COUNTERS = {"missed_interval": "ingress.psfp_c.streamGate_c.missed_interval_counter",
+                     "not_passed_gate": "ingress.psfp_c.streamGate_c.not_passed_gate_counter"}
+
+    STREAM_ID_TABLE = "ingress.psfp_c.streamFilter_c.stream_id"
+    STREAM_FILTER_TABLE = "ingress.psfp_c.streamFilter_c.stream_filter_instance"
+
+    BLOCKED_REGISTERS = {"stream_handle": "ingress.psfp_c.streamFilter_c.reg_filter_blocked",
+                         "stream_gate_id": "ingress.psfp_c.streamGate_c.reg_gate_blocked",
+                         "flow_meter_id": "ingress.psfp_c.flowMeter_c.reg_meter_blocked"}
+
+    def __init__(self, switch, port: int = 9100, interval: float = 1.0, host: str = "127.0.0.1",
+                 poll_interval: float = 0.25):
+        max_poll_interval = CounterTableAccumulator().max_poll_interval()
+        if not 0 < poll_interval <= max_poll_interval:
+            raise ValueError(f"Counter poll interval {poll_interval}s must be within (0, {max_poll_interval:.3f}]s, "
+                             f"the byte counters can wrap more than once in between.")
+
+        self.s = switch
+        self.port = port
+        self.interval = interval
+        self.poll_interval = min(poll_interval, interval)
+        self.host = host
+
+        self.body = b"# EOF\n"
+        self.lock = threading.Lock()
+        self.exit_event = threading.Event()
+        self.errors = 0
+        self.server = None
+        # Counters and registers whose skipped IDs were logged
+        self.skipped = set()
+
+        # Counter or table name to CounterTableAccumulator
+        self.accumulators = {}
+        # Counter or table name to the 64-bit totals of the last poll, a dict of index or stream handle to counter row
+        self.totals = {}
+
+    def start(self):
+        exporter = self
+
+        # Counters synced by other consumers within the last poll interval are not synced again
+        for table in list(self.FLOW_METER_COUNTERS.values()) + list(self.GATE_COUNTERS.values()) + \
+                [self.OVERALL_COUNTER, self.MAX_SDU_COUNTER, self.STREAM_ID_TABLE, self.STREAM_FILTER_TABLE]:
+            self.s.syncs.declare(table, self.poll_interval)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                with exporter.lock:
+                    body = exporter.body
+                self.send_response(200)
+                self.send_header("Content-Type", exporter.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics scrape from {self.client_address[0]}: {format % args}")
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+
+        threading.Thread(target=self.server.serve_forever, args=(), daemon=True, name="Metrics-Server").start()
+        threading.Thread(target=self.run, args=(), daemon=True, name="Metrics-Sampler").start()
+        logging.info(f"Metrics exporter listening on http://{self.host}:{self.server.server_port}/metrics")
+
+    def stop(self):
+        self.exit_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def run(self):
+        next_render = time.monotonic()
+        while not self.exit_event.is_set():
+            start = time.monotonic()
+            # A failed cycle keeps the last totals and rendered values, the next one starts over
+            try:
+                self.poll()
+                if start >= next_render:
+                    next_render = start + self.interval
+                    body = self.render(self.collect(), time.monotonic() - start)
+                    with self.lock:
+                        self.body = body
+            except Exception as e:
+                logging.exception(f"Metrics: collecting failed: {e}")
+                self.errors += 1
+            self.exit_event.wait(max(0.0, self.poll_interval - (time.monotonic() - start)))
+
+    def _read(self, what: str, func, *args, **kwargs):
+        """
+        Calls a read function of the switch, failed reads are counted and skipped.
+        """
+        try:
+            return func(*args, **kwargs)
+        except (gc.BfruntimeReadWriteRpcException, KeyError) as e:
+            if not self.errors:
+                logging.warning(f"Metrics: reading {what} failed: {e}")
+            self.errors += 1
+            return None
+
+    def _indices(self, tables: list, ids: list):
+        """
+        Returns the IDs that are within the size of all tables, i.e. the indices that exist in every counter or
+        register of tables. Skipped IDs are logged once per tables.
+        """
+        size = min(self.s.encoder(t).size for t in tables)
+        skipped = [i for i in ids if not 0 <= i < size]
+        if skipped and tuple(tables) not in self.skipped:
+            self.skipped.add(tuple(tables))
+            logging.warning(f"Metrics: {len(skipped)} IDs from {min(skipped)} to {max(skipped)} exceed the size {size} "
+                            f"of {[t.split('.')[-1] for t in tables]} and are not exported.")
+        return [i for i in ids if 0 <= i < size]
+
+    def _accumulate(self, table: str, counters: dict):
+        """
+        Returns the 64-bit totals of counters, a dict of index or stream handle to counter row.
+        Failed reads are skipped, so they do not reset the totals, the previous totals are returned instead.
+        """
+        if not counters:
+            return self.totals.get(table, {})
+        acc = self.accumulators.setdefault(table, CounterTableAccumulator())
+        return acc.update(time.monotonic(), list(counters.keys()), list(counters.values()))
+
+    def poll(self):
+        """
+        Reads all exported counters from the switch, every counter and table with a single request,
+        and accumulates their 64-bit totals. Counters of IDs that are no longer configured are dropped.
+        """
+        sfc = self.s.stream_filter_controller
+        sgc = self.s.stream_gate_controller
+        fmc = self.s.flow_meter_controller
+
+        stream_handles = sorted({f.stream_handle for f in sfc.stream_filters})
+        gate_ids = sorted({g.gate_id for g in sgc.gates})
+        meter_ids = sorted({m.flow_meter_id for m in fmc.flow_meters})
+
+        totals = {}
+
+        # Indirect counters
+        for what, tables, ids in (("flow meter counters", list(self.FLOW_METER_COUNTERS.values()) + [self.OVERALL_COUNTER], meter_ids),
+                                  ("stream gate counters", list(self.GATE_COUNTERS.values()), gate_ids),
+                                  ("max SDU counter", [self.MAX_SDU_COUNTER], stream_handles)):
+            ids = self._indices(tables, ids)
+            if not ids:
+                continue
+            counters = self._read(what, self.s.get_counters, tables, ids, max_staleness=self.poll_interval) or {}
+            for table in tables:
+                totals[table] = self._accumulate(table, counters.get(table, {}))
+
+        # Direct counters of the stream identification and stream filter tables
+        for table, entries in ((self.STREAM_ID_TABLE, sfc.stream_entries()),
+                               (self.STREAM_FILTER_TABLE, sfc.filter_entries())):
+            entries = [e for e in entries if e["table"] == table]
+            if not entries:
+                continue
+            rows = self._read(table, self.s.get_direct_counters, table, [e["match_fields"] for e in entries],
+                              max_staleness=self.poll_interval) or []
+            handles = [e["action_params"]["stream_handle"] if "stream_handle" in e["action_params"]
+                       else e["match_fields"]["ig_md.stream_filter.stream_handle"] for e in entries]
+            totals[table] = self._accumulate(table, dict(zip(handles, rows)))
+
+        self.totals = totals
+
+    def collect(self):
+        """
+        Returns all exported values, the counters from the totals of the last poll.
+        The registers are read from the switch with a single request each.
+
+        :returns families: list of MetricFamily
+        """
+        sfc = self.s.stream_filter_controller
+        sgc = self.s.stream_gate_controller
+        fmc = self.s.flow_meter_controller
+
+        stream_handles = sorted({f.stream_handle for f in sfc.stream_filters})
+        gate_ids = sorted({g.gate_id for g in sgc.gates})
+        meter_ids = sorted({m.flow_meter_id for m in fmc.flow_meters})
+
+        families = []
+
+        def counter_families(name, help_text, label, table):
+            pkts = MetricFamily(f"psfp_{name}_packets", "counter", f"Packets {help_text}")
+            pkt_bytes = MetricFamily(f"psfp_{name}_bytes", "counter", f"Bytes {help_text}")
+            for i, row in sorted(self.totals.get(table, {}).items()):
+                labels = {label: i}
+                pkts.add(labels, row["$COUNTER_SPEC_PKTS"])
+                if "$COUNTER_SPEC_BYTES" in row:
+                    pkt_bytes.add(labels, row["$COUNTER_SPEC_BYTES"])
+            return pkts, pkt_bytes
+
+        # Indirect counters
+        if self.OVERALL_COUNTER in self.totals:
+            pkts = MetricFamily("psfp_flow_meter_packets", "counter", "Packets marked by the flow meter, per color")
+            pkt_bytes = MetricFamily("psfp_flow_meter_bytes", "counter", "Bytes marked by the flow meter, per color")
+            for color, table in self.FLOW_METER_COUNTERS.items():
+                for m, row in sorted(self.totals[table].items()):
+                    pkts.add({"flow_meter_id": m, "color": color}, row["$COUNTER_SPEC_PKTS"])
+                    pkt_bytes.add({"flow_meter_id": m, "color": color}, row["$COUNTER_SPEC_BYTES"])
+            families += [pkts, pkt_bytes]
+            families += counter_families("overall", "that passed the stream filter, per flow meter",
+                                         "flow_meter_id", self.OVERALL_COUNTER)
+
+        for name, table in self.GATE_COUNTERS.items():
+            if table in self.totals:
+                families.append(counter_families(name, f"counted by {table.split('.')[-1]}, per stream gate",
+                                                 "stream_gate_id", table)[0])
+
+        if self.MAX_SDU_COUNTER in self.totals:
+            families.append(counter_families("missed_max_sdu", "that exceeded the max SDU, per stream",
+                                             "stream_handle", self.MAX_SDU_COUNTER)[0])
+
+        # Direct counters of the stream identification and stream filter tables
+        for name, table in (("stream_id", self.STREAM_ID_TABLE), ("stream_filter", self.STREAM_FILTER_TABLE)):
+            if table in self.totals:
+                families += counter_families(name, f"matched in {table.split('.')[-1]}, per stream",
+                                             "stream_handle", table)
+
+        wraps = MetricFamily("psfp_counter_wraps_possibly_missed", "counter",
+                             "Counter polls more than the max poll interval after the previous one, "
+                             "the totals can miss wraps of these intervals")
+        for table, acc in sorted(self.accumulators.items()):
+            wraps.add({"table": table}, acc.suspect_intervals)
+        families.append(wraps)
+
+        # Blocked states, a stream, gate or meter is blocked if it is blocked in any pipe
+        for (label, register), ids in zip(self.BLOCKED_REGISTERS.items(), (stream_handles, gate_ids, meter_ids)):
+            ids = self._indices([register], ids)
+            if not ids:
+                continue
+            values = self._read(register, self.s.read_registers, register, ids) or {}
+            blocked = MetricFamily(f"psfp_{label.rsplit('_', 1)[0]}_blocked", "gauge",
+                                   f"1 if blocked, {register.split('.')[-1]}")
+            for i, v in sorted(values.items()):
+                blocked.add({label: i}, int(any(v)))
+            families.append(blocked)
+
+        # Δ-adjustment values are kept by the controller, no request needed
+        delta = MetricFamily("psfp_delta_adjustment", "gauge", "Clock offset adjustment of the hyperperiod on a port")
+        for app_id, d in sorted(self.s.pkt_gen.app_id_mapping.items()):
+            if d["port"] is None:
+                continue
+            for term, v in d["Delta"].items():
+                delta.add({"port": d["port"], "app_id": app_id, "term": term}, v)
+        families.append(delta)
+
+        syncs = MetricFamily("psfp_counter_syncs", "counter", "Hardware syncs of a counter table by all consumers")
+        served = MetricFamily("psfp_counter_sync_reuses", "counter", "Reads of a counter table served by a previous sync")
+        for table, (n_syncs, n_served) in sorted(self.s.syncs.stats().items()):
+            syncs.add({"table": table}, n_syncs)
+            served.add({"table": table}, n_served)
+        families += [syncs, served]
+
+        # Digest dispatcher, per digest type
+        digest_families = {"queue_depth": MetricFamily("psfp_digest_queue_depth", "gauge", "Digests waiting for their handler"),
+                           "received": MetricFamily("psfp_digests_received", "counter", "Received digests"),
+                           "dropped": MetricFamily("psfp_digests_dropped", "counter", "Digests dropped because the queue was full"),
+                           "handled": MetricFamily("psfp_digests_handled", "counter", "Handled digests"),
+                           "failed": MetricFamily("psfp_digests_failed", "counter", "Digests whose handler raised an exception"),
+                           "latency_avg": MetricFamily("psfp_digest_handler_latency_avg_seconds", "gauge", "Average handler latency"),
+                           "latency_max": MetricFamily("psfp_digest_handler_latency_max_seconds", "gauge", "Highest handler latency"),
+                           "wait_max": MetricFamily("psfp_digest_wait_max_seconds", "gauge", "Longest time from receiving a digest until its handler started")}
+        for digest_type, stats in self.s.digest_dispatcher.stats().items():
+            for k, family in digest_families.items():
+                family.add({"type": digest_type}, stats[k])
+        families += list(digest_families.values())
+
+        # Block digests aggregated by DigestStats
+        events = MetricFamily("psfp_block_digests", "counter", "Block digests of all complete summary windows, per reason")
+        for reason, n in sorted(self.s.digest_stats.totals()["by_reason"].items()):
+            events.add({"reason": reason}, n)
+        top = MetricFamily("psfp_block_digest_top_offenders", "gauge", "Block digests of the top offenders in the last summary window")
+        for rank, t in enumerate(self.s.digest_stats.summary()["top"], start=1):
+            top.add({"rank": rank, "reason": t["reason"], "stream_handle": t["stream_handle"],
+                     "stream_gate_id": t["stream_gate_id"], "flow_meter_id": t["flow_meter_instance_id"]}, t["events"])
+        families += [events, top]
+
+        return families
+
+    def render(self, families: list, duration: float):
+        exporter = [MetricFamily("psfp_exporter_sample_timestamp_seconds", "gauge", "Time of the last sample"),
+                    MetricFamily("psfp_exporter_sample_duration_seconds", "gauge", "Duration of the last sample"),
+                    MetricFamily("psfp_exporter_read_errors", "counter", "Failed reads")]
+        exporter[0].add({}, round(time.time(), 3))
+        exporter[1].add({}, round(duration, 6))
+        exporter[2].add({}, self.errors)
+
+        return ("\n".join(f.render() for f in families + exporter) + "\n# EOF\n").encode()
@@ -1,8 +1,16 @@
 import logging
-import bfrt_grpc.client as gc
+from libs import TimeQuantization
+from libs.bfrt import gc
 from scapy.all import Ether
 
 class PktGen():
+
+    # Width of the timer of the packet generator and of the packet count of a hyperperiod, see set_pkt_count
+    MAX_TIMER = 2**32 - 1
+    MAX_PKT_COUNT = 2**16 - 1
+    # Pkt counts above the minimum that are tried if a period can not be divided exactly, see calc_period_packets
+    DRIFT_SEARCH = 64
+
     def __init__(self, switch):
         self.s = switch
         self.pipe_ids = [0, 1]
@@ -17,6 +25,7 @@ class PktGen():
             # Initialize app_id structure
             self.app_id_mapping[a] = {"pkt_count": None,              # Will be filled later
                                       "interval_length": None,
+                                      "period_drift": 0,            # Generated hyperperiod - period, see calc_period_packets
                                       "port": None,                 # Port where PSFP with this schedule will be applied
                                       "hyperperiod_done": False,    # Indicates if first hyperperiod is done
                                       "Delta": {"epsilon_1": 0, "epsilon_2": 0, "delta": 0, "sum": 0},
@@ -107,27 +116,73 @@ class PktGen():
 
         self.configured = True
 
-    def calc_period_packets(self, period):
+    @staticmethod
+    def calc_period_packets(period):
         """
         As the maximum pkt generation interval is 2^32 ~ 4s, we need to generate several packets for
         bigger periods. This function calculates the needed amount of pkts and the interval.
         I.e. a period of 10s results in a pkt count of 4 with an interval duration of 2.5s
 
+        The pkt count is the smallest divisor of the period with an interval that fits into the timer, see divisors.
+        If there is none, e.g. for a prime period, the interval is rounded. Of the pkt counts up to DRIFT_SEARCH above
+        the minimum, the one with the least drift is used. The generated hyperperiod pkt_count * interval_length then
+        differs from the period by at most pkt_count / 2 ns per hyperperiod, see period_drift.
+        The data plane restarts the schedule with every generated hyperperiod, so the drift does not accumulate,
+        it only lengthens or shortens the end of every hyperperiod.
+
         :param period: int of the period
 
         :returns pkt_count, interval_length:
         """
 
-        max_period = 2**32
-
-        if period < max_period:
+        if period <= PktGen.MAX_TIMER:
             return 1, period
 
-        for pkt_count in range(3, 100):
-            interval_length = int(period / pkt_count)
-            if (period % pkt_count == 0 and interval_length < max_period):
-                return pkt_count, interval_length
-        raise ValueError("Period requires more than 100 packets. Adjust?")
+        min_pkt_count = -(-period // PktGen.MAX_TIMER)
+        if min_pkt_count > PktGen.MAX_PKT_COUNT:
+            raise ValueError(f"Period of {period}ns requires more than {PktGen.MAX_PKT_COUNT} packets.")
+
+        exact = [d for d in PktGen.divisors(period, PktGen.MAX_PKT_COUNT) if d >= min_pkt_count]
+        if exact:
+            pkt_count = min(exact)
+            return pkt_count, period // pkt_count
+
+        best = None
+        for pkt_count in range(min_pkt_count, min(min_pkt_count + PktGen.DRIFT_SEARCH, PktGen.MAX_PKT_COUNT) + 1):
+            interval_length = (period + pkt_count // 2) // pkt_count
+            drift = pkt_count * interval_length - period
+            if interval_length <= PktGen.MAX_TIMER and (best is None or abs(drift) < abs(best[2])):
+                best = (pkt_count, interval_length, drift)
+        return best[0], best[1]
+
+    @staticmethod
+    def period_drift(period):
+        """
+        Difference in ns of the generated hyperperiod to the period, see calc_period_packets.
+        """
+        pkt_count, interval_length = PktGen.calc_period_packets(period)
+        return pkt_count * interval_length - period
+
+    @staticmethod
+    def divisors(n, limit):
+        """
+        Returns the sorted divisors of n up to limit, built from the prime factors of n up to limit.
+        """
+        factors = []
+        rest = n
+        p = 2
+        while p * p <= rest and p <= limit:
+            while rest % p == 0:
+                factors.append(p)
+                rest //= p
+            p += 1 if p == 2 else 2
+        if 1 < rest <= limit:
+            factors.append(rest)
+
+        divisors = {1}
+        for f in factors:
+            divisors |= {d * f for d in divisors if d * f <= limit}
+        return sorted(divisors)
 
     def configure_pkt_gen(self, app_id, period, port):
         """
@@ -150,8 +205,14 @@ class PktGen():
             period)
         self.app_id_mapping[app_id]["hyperperiod_duration"] = self.app_id_mapping[app_id]['pkt_count'] * \
             self.app_id_mapping[app_id]['interval_length']
+        self.app_id_mapping[app_id]["period_drift"] = self.app_id_mapping[app_id]["hyperperiod_duration"] - period
         self.app_id_mapping[app_id]["port"] = port
 
+        if self.app_id_mapping[app_id]["period_drift"]:
+            logging.warning(f"Period of {period}ns on {port=} can not be generated exactly, generating "
+                            f"{self.app_id_mapping[app_id]['pkt_count']} x {self.app_id_mapping[app_id]['interval_length']}ns "
+                            f"with a drift of {self.app_id_mapping[app_id]['period_drift']}ns per hyperperiod.")
+
         # Configure the packet generation timer application
         data = pktgen_app_cfg_table.make_data([gc.DataTuple('timer_nanosec', self.app_id_mapping[app_id]["interval_length"]),
                                                gc.DataTuple(
@@ -193,6 +254,63 @@ class PktGen():
         self.configure_timer_table(app_id)
         self.configure_app_id_to_port(app_id)
 
+    def restore_state(self, schedule_port_mappings: list):
+        """
+        Rebuilds app_id_mapping from the packet generator, hyperperiod registers and clock offset tables of the switch.
+        Used for warm starts, nothing is written. The app_ids are assigned in the order of schedule_port_mappings like on a cold start.
+
+        :param schedule_port_mappings: list of dicts with port and period, see Config.
+
+        :returns restored: True if the running packet generator applications match schedule_port_mappings.
+        """
+        pktgen_app_cfg_table = self.s.bfrt_info.table_get("app_cfg")
+        app_cfg = {k.to_dict()["app_id"]["value"]: d.to_dict()
+                   for d, k in pktgen_app_cfg_table.entry_get(self.s.target, None, {"from_hw": False})}
+        app_ports = {k.to_dict()["hdr.timer.app_id"]["value"]: d.to_dict()["port"]
+                     for d, k in self.s.get_table_entries("ingress.psfp_c.app_id_port", counters=False)}
+
+        enabled = {a for a, d in app_cfg.items() if d["app_enable"]}
+        if enabled != set(range(len(schedule_port_mappings))):
+            logging.error(f"Running packet generator applications {sorted(enabled)} do not match the {len(schedule_port_mappings)} configured hyperperiods.")
+            return False
+
+        for app_id, m in enumerate(schedule_port_mappings):
+            pkt_count, interval_length = self.calc_period_packets(m["period"])
+            if app_cfg[app_id]["timer_nanosec"] != interval_length or app_ports.get(app_id) != m["port"]:
+                logging.error(f"Hyperperiod of {app_id=} on port {app_ports.get(app_id)} does not match {m['period']}ns on port {m['port']}.")
+                return False
+
+        ports = [m["port"] for m in schedule_port_mappings]
+        hyperperiod_done = self.s.read_registers("ingress.psfp_c.hyperperiod_done", ports)
+        lower = self.s.read_registers("ingress.psfp_c.lower_last_ts", ports)
+        higher = self.s.read_registers("ingress.psfp_c.higher_last_ts", ports)
+
+        # Installed clock offsets, the direction table has an entry for ports that shift to the right
+        offsets_right = {k.to_dict()["hdr.bridge.ingress_port"]["value"]: d.to_dict()["offset"]
+                         for d, k in self.s.get_table_entries("egress.map_offset_shift_right", counters=False)}
+        offsets_left = {k.to_dict()["hdr.bridge.ingress_port"]["value"]: d.to_dict()["offset"]
+                        for d, k in self.s.get_table_entries("egress.map_offset_shift_left", counters=False)}
+        shift_right = {k.to_dict()["hdr.bridge.ingress_port"]["value"]
+                       for _, k in self.s.get_table_entries("egress.decide_shift_dir", counters=False)}
+
+        for app_id, m in enumerate(schedule_port_mappings):
+            port = m["port"]
+            app = self.app_id_mapping[app_id]
+            app["pkt_count"], app["interval_length"] = self.calc_period_packets(m["period"])
+            app["hyperperiod_duration"] = app["pkt_count"] * app["interval_length"]
+            app["period_drift"] = app["hyperperiod_duration"] - m["period"]
+            app["port"] = port
+            app["hyperperiod_done"] = any(hyperperiod_done[port])
+            app["hyperperiod_register_value"] = TimeQuantization.join_registers(higher[port][0], lower[port][0])
+
+            # The installed offset is kept until the Δ-adjustment calculates new ε values
+            Delta = offsets_right.get(port, 0) if port in shift_right else -offsets_left.get(port, 0)
+            app["Delta"] = {"epsilon_1": Delta - self.s.delta, "epsilon_2": 0, "delta": self.s.delta, "sum": Delta}
+
+        self.configured = True
+        logging.info(f"Restored {len(schedule_port_mappings)} hyperperiods from Switch {self.s.name}")
+        return True
+
     def disable_pkt_gen(self):
         """
         Disable the packet generator by setting the app_enable parameter to False
@@ -236,8 +354,8 @@ class PktGen():
         They are initialized with an offset of 0.
         """
 
-        # Mask to filter for large values (2^38, which is around 4.5 minutes)
-        mask_max_underflow = 0b111111111111111000000000000000000000000000000000
+        # Mask to filter for large values, i.e. above twice the longest hyperperiod, see Switch.init_underflow_detection_table
+        mask_max_underflow = TimeQuantization.underflow_mask()
 
         self.s.write_table_entry(table="egress.offset_detection_shift_right",
                           match_fields={"eg_md.new_rel_pos_with_offset": (
@@ -298,9 +416,8 @@ class PktGen():
         reg = self.s.read_register(
             register_name="ingress.psfp_c.higher_last_ts", register_index=port)
         higher = reg[0].to_dict()['ingress.psfp_c.higher_last_ts.f1'][0]
-        bitstring = bin(higher)[2:] + bin(lower)[2:].zfill(32)
 
-        return int(bitstring, 2)
+        return TimeQuantization.join_registers(higher, lower)
 
     def set_clock_offset(self, port, offset):
         """
@@ -323,7 +440,7 @@ class PktGen():
         # Get the current state: shifting left or shifting right by determining if an entry exists in the direction
         # table for this port
         try:
-            direction = self.s.get_table_entries(table="egress.decide_shift_dir", match_fields={
+            direction = self.s.get_table_entries(table="egress.decide_shift_dir", counters=False, match_fields={
                                         "hdr.bridge.ingress_port": port})
             direction = [k.to_dict() for k in list(direction)[0]]
             if len(direction) > 0:
@@ -474,7 +591,7 @@ class PktGen():
         # Get the current state: shifting left or shifting right by determining if an entry exists in the direction
         # table for this port
         try:
-            direction = self.s.get_table_entries(table="egress.decide_shift_dir", match_fields={
+            direction = self.s.get_table_entries(table="egress.decide_shift_dir", counters=False, match_fields={
                                         "hdr.bridge.ingress_port": port})
             direction = [k.to_dict() for k in list(direction)[0]]
             if len(direction) > 0:
@@ -483,28 +600,26 @@ class PktGen():
             current_shift_state_right = False
 
         # Hyperperiod done ts
-        waiting = int(bin(3100000 & 0b11111111111111111111000000000000)[
-                      2:].zfill(48), 2) >> 12
-        duration = int(bin(1600000 & 0b11111111111111111111000000000000)[
-                       2:].zfill(48), 2) >> 12
-        start_ts = int(bin(start_ts & 0b11111111111111111111000000000000)[
-                       2:].zfill(48), 2) >> 12
+        waiting = TimeQuantization.quantize(3100000)
+        duration = TimeQuantization.quantize(1600000)
+        start_ts = TimeQuantization.quantize(start_ts)
         start_ts = start_ts + waiting
         end_ts = start_ts + duration - 1
+        ts_field = f"hdr.bridge.ingress_timestamp[{TimeQuantization.key_slice()}]"
 
         # Write the new offset value
         if new_shift_state_right:
             # Shift right
             self.s.write_table_entry(table="egress.map_offset_shift_right",
                               match_fields={"hdr.bridge.ingress_port": port,
-                                            "hdr.bridge.ingress_timestamp[31:12]": (start_ts, end_ts, "r")},
+                                            ts_field: (start_ts, end_ts, "r")},
                               action_name="egress.add_rel_ts_and_offset",
                               action_params={"offset": offset,
                                              "hyperperiod_duration": hyperperiod_duration}
                               )
             self.s.write_table_entry(table="egress.map_offset_shift_right",
                               match_fields={"hdr.bridge.ingress_port": port,
-                                            "hdr.bridge.ingress_timestamp[31:12]": (end_ts + 1, 1048575, "r")},
+                                            ts_field: (end_ts + 1, TimeQuantization.TS_MAX, "r")},
                               action_name="egress.add_rel_ts_and_offset",
                               action_params={"offset": 0,
                                              "hyperperiod_duration": hyperperiod_duration}
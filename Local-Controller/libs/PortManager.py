@@ -1,5 +1,4 @@
 import logging
-from pal_rpc.ttypes import *
 
 class PortManager:
     def __init__(self, switch=None):
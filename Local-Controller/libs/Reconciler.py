@@ -0,0 +1,299 @@
+import logging
+
+from libs import TimeQuantization
+from libs.configuration import Config
+from libs.TableBatch import TableBatch
+from libs.TableEncoder import TableEncoder
+
+
+class Reconciler:
+    """
+    Brings the PSFP tables of a switch from the installed to the desired state of a configuration.
+    Both states are indexed by the canonical key of every entry, so only entries that differ are written.
+
+    Changes are applied make-before-break in dependency order: adds and modifications come first and start
+    with the referenced flow meters and gates, deletes follow and start with the stream identification.
+    Traffic of unchanged streams is never affected, changed streams always match either the old or the new entry.
+
+    Changed ranges, e.g. the intervals of a gate schedule or the max SDU of a stream, are the exception.
+    New range entries have the same priority as the old ones and may overlap them, which gives undefined matches
+    in the TCAM. Old range entries are therefore deleted before the new ones with the same other key fields,
+    e.g. the same gate, schedule ID or stream handle, are added. In between, these frames miss the table for the
+    duration of one write request, i.e. frames of a gate are handled like frames outside of all intervals.
+    """
+
+    # PSFP tables in dependency order, instances referenced by a table come before it
+    TABLES = ["ingress.psfp_c.flowMeter_c.flow_meter_config",
+              "ingress.psfp_c.flowMeter_c.flow_meter_instance",
+              "ingress.psfp_c.streamGate_c.stream_gate_instance",
+              "ingress.psfp_c.streamGate_c.stream_gate_slot",
+              "ingress.psfp_c.streamGate_c.stream_gate_schedule",
+              "ingress.psfp_c.streamFilter_c.stream_filter_instance",
+              "ingress.psfp_c.streamFilter_c.max_sdu_filter",
+              "ingress.psfp_c.streamFilter_c.stream_id_active",
+              "ingress.psfp_c.streamFilter_c.stream_id"]
+
+    GATE_TABLE = "ingress.psfp_c.streamGate_c.stream_gate_instance"
+    SCHEDULE_TABLE = "ingress.psfp_c.streamGate_c.stream_gate_schedule"
+
+    # Action parameters that are assigned by the controller when writing and are not compared
+    IGNORED_PARAMS = {GATE_TABLE: ("interval_identifier",)}
+
+    # Data fields of entries read from the switch that are no action parameters
+    STATE_FIELDS = ("action_name", "is_default_entry", "$COUNTER_SPEC_PKTS", "$COUNTER_SPEC_BYTES")
+
+    def __init__(self, switch, config: Config):
+        self.s = switch
+        self.config = config
+
+        # Tables of compile time options, e.g. the stream gate schedule table, only exist in some programs
+        self.tables = [t for t in self.TABLES if switch.has_table(t)]
+
+    def entries(self, gates: list):
+        """
+        Returns the entries of the PSFP tables that the controllers derive from their instances.
+
+        :param gates: Stream gates whose schedules are included.
+
+        :returns entries: dict, table name to dict of canonical key to entry.
+        """
+        entries = self.s.flow_meter_controller.meter_entries() + \
+            self.s.stream_gate_controller.schedule_entries(gates) + \
+            self.s.stream_filter_controller.stream_entries() + \
+            self.s.stream_filter_controller.filter_entries()
+
+        return self.index(entries)
+
+    def installed_entries(self):
+        """
+        Reads the entries of all PSFP tables from the switch, one request per table.
+
+        :returns entries: dict, table name to dict of canonical key to entry.
+        """
+        entries = []
+        for table in self.tables:
+            for data, key in self.s.get_table_entries(table, counters=False):
+                d = data.to_dict()
+                entries.append({"table": table,
+                                "match_fields": TableEncoder.key_from_dict(key.to_dict()),
+                                "action_name": d["action_name"],
+                                "action_params": {p: v for p, v in d.items() if p not in self.STATE_FIELDS}})
+
+        return self.index(entries)
+
+    def index(self, entries: list):
+        """
+        Groups entries by table and canonical key.
+
+        :param entries: list of dicts with the keys table, match_fields, action_name and action_params.
+        """
+        indexed = {t: {} for t in self.tables}
+        for e in entries:
+            key = self.s.encoder(e["table"]).canonical_key(e["match_fields"])
+            indexed.setdefault(e["table"], {})[key] = e
+        return indexed
+
+    def diff(self, installed: dict, desired: dict):
+        """
+        Computes the table operations that turn the installed into the desired entries.
+
+        :param installed: dict, table name to dict of canonical key to entry, see index().
+        :param desired: dict, table name to dict of canonical key to entry, see index().
+
+        :returns ops: list of (op, entry) tuples in the order they have to be applied.
+        """
+        deletes = []
+        writes = []
+
+        for table in self.tables:
+            old = installed.get(table, {})
+            new = desired.get(table, {})
+            ignore = self.IGNORED_PARAMS.get(table, ())
+
+            removed = [(TableBatch.DEL, old[k]) for k in old.keys() - new.keys()]
+            added = [(TableBatch.ADD, e) for k, e in new.items() if k not in old]
+
+            # Old ranges that are replaced by new ones go first, both may overlap
+            if "range" in self.s.encoder(table).key_match_types.values():
+                replaced = {self._range_owner(table, e) for _, e in added}
+                writes += [op for op in removed if self._range_owner(table, op[1]) in replaced]
+                removed = [op for op in removed if self._range_owner(table, op[1]) not in replaced]
+
+            deletes += removed
+            writes += added
+            writes += [(TableBatch.MOD, e) for k, e in new.items()
+                       if k in old and self._data(old[k], ignore) != self._data(e, ignore)]
+
+        # Deletes in reverse dependency order, e.g. streams before the gates they reference
+        deletes.sort(key=lambda op: -self.tables.index(op[1]["table"]))
+
+        return writes + deletes
+
+    def _range_owner(self, table: str, entry: dict):
+        """
+        Returns the canonical values of the key fields of an entry that are no range, e.g. the gate of an interval.
+        """
+        enc = self.s.encoder(table)
+        return tuple(c(entry["match_fields"].get(f)) for f, c in enc.key_canonicalizers.items()
+                     if enc.key_match_types[f] != "range")
+
+    def check_ops(self, ops: list):
+        """
+        Raises ValueError if the interval identifiers run out while applying ops in their order, see apply.
+        Nothing is written then.
+        """
+        available = self.s.stream_gate_controller.available_interval_identifiers()
+        for op, e in ops:
+            if e["table"] != self.GATE_TABLE or op == TableBatch.MOD:
+                continue
+            available += 1 if op == TableBatch.DEL else -1
+            if available < 0:
+                raise ValueError(f"The new intervals need more than the "
+                                 f"{self.s.stream_gate_controller.max_interval_identifier} interval identifiers.")
+
+    @staticmethod
+    def _data(entry: dict, ignore):
+        return TableEncoder.canonical_data(entry["action_name"], entry["action_params"], ignore)
+
+    def apply(self, ops: list):
+        """
+        Applies table operations within one batch.
+        New intervals of gate schedules get an interval_identifier, deleted ones free theirs, see check_ops.
+
+        :returns batch: TableBatch with the statistics and errors of the operations.
+        """
+        with self.s.batch() as batch:
+            for op, e in ops:
+                if op == TableBatch.DEL:
+                    if e["table"] == self.GATE_TABLE:
+                        self.s.stream_gate_controller.release_interval_identifier(e)
+                    self.s.remove_table_entry(table=e["table"], match_fields=e["match_fields"])
+                    continue
+
+                if e["table"] == self.GATE_TABLE:
+                    self.s.stream_gate_controller.assign_interval_identifier(e)
+
+                if op == TableBatch.ADD:
+                    self.s.write_table_entry(**e)
+                else:
+                    self.s.update_table_entry(**e)
+
+        return batch
+
+    def reload(self, config_file: str):
+        """
+        Parses config_file and applies the differences to the current configuration.
+        Schedules are only installed for ports that finished their first hyperperiod, all others are
+        written once their hyperperiod digest arrives.
+        Changes of the hyperperiods, i.e. the periods of the ports, need a restart and are not applied.
+
+        :param config_file: Path of the new configuration.
+
+        :returns success: True if the configuration was applied.
+        """
+        try:
+            config = Config(config_file)
+        except (AssertionError, KeyError, ValueError, OSError) as e:
+            logging.error(f"Configuration {config_file} is invalid, keeping the current configuration: {e!r}")
+            return False
+
+        old_periods = {m["port"]: m["period"] for m in self.config.schedule_port_mappings}
+        new_periods = {m["port"]: m["period"] for m in config.schedule_port_mappings}
+        if old_periods != new_periods:
+            logging.error(f"Hyperperiods changed from {old_periods} to {new_periods}, a restart is required. Configuration not applied.")
+            return False
+
+        if config.ts_shift != TimeQuantization.TS_SHIFT:
+            logging.error(f"Timestamp quantization changed to ts_shift={config.ts_shift}, the P4 program needs to be "
+                          f"recompiled with __TS_SHIFT__. Configuration not applied.")
+            return False
+
+        sfc = self.s.stream_filter_controller
+        sgc = self.s.stream_gate_controller
+        fmc = self.s.flow_meter_controller
+
+        with sgc.lock:
+            installed = self.entries([g for g in sgc.gates if g.schedule_written])
+            current = (sfc.streams, sfc.stream_filters, fmc.flow_meters, sgc.gates, sgc.config, dict(sgc.schedule_ids),
+                       sgc.slot_usage)
+
+            sfc.streams = config.instances_streams
+            sfc.stream_filters = config.instances_filters
+            fmc.flow_meters = config.instances_flow_meters
+            sgc.gates = config.instances_gates
+            sgc.config = config
+
+            ready = sgc.ready_schedules()
+            for g in sgc.gates:
+                g.schedule_written = g.schedule.name in ready
+
+            # The slot table is filled by the schedules of the new configuration only
+            sgc.slot_usage = {}
+            try:
+                ops = self.diff(installed, self.entries([g for g in sgc.gates if g.schedule_written]))
+                self.check_ops(ops)
+            except ValueError as e:
+                # E.g. no schedule ID or interval identifier left, nothing is written yet
+                sfc.streams, sfc.stream_filters, fmc.flow_meters, sgc.gates, sgc.config, sgc.schedule_ids, \
+                    sgc.slot_usage = current
+                logging.error(f"Configuration {config_file} can not be installed, keeping the current configuration: {e!r}")
+                return False
+
+            batch = self.apply(ops)
+
+        if fmc.flow_meters and not self.config.instances_flow_meters:
+            fmc.adjust_byte_count()
+
+        self.config = config
+
+        self._log_summary(f"Reloaded {config_file}", ops, batch)
+        return True
+
+    def warm_start(self):
+        """
+        Adopts the state of a switch that is already provisioned, e.g. after a restart of the controller.
+        Hyperperiods, Δ values and the installed PSFP entries are read in bulk, only the differences to the
+        configuration are written. Registers are not reset, so blocked streams and closed gates stay blocked.
+        The controllers must be created with reset_registers=False.
+
+        :returns success: False if the running hyperperiods do not match the configuration, a cold start is required then.
+        """
+        if not self.s.pkt_gen.restore_state(self.config.schedule_port_mappings):
+            return False
+
+        sgc = self.s.stream_gate_controller
+        fmc = self.s.flow_meter_controller
+
+        with sgc.lock:
+            installed = self.installed_entries()
+
+            # New intervals must not reuse identifiers of installed ones
+            sgc.restore_interval_identifiers(installed[self.GATE_TABLE])
+
+            # Shared schedules keep their installed IDs
+            sgc.restore_schedule_ids({e["match_fields"][sgc.GATE_ID_FIELD]: e["action_params"]["schedule_id"]
+                                      for e in installed.get(self.SCHEDULE_TABLE, {}).values()})
+
+            ready = sgc.ready_schedules()
+            for g in sgc.gates:
+                g.schedule_written = g.schedule.name in ready
+
+            ops = self.diff(installed, self.entries([g for g in sgc.gates if g.schedule_written]))
+            try:
+                self.check_ops(ops)
+            except ValueError as e:
+                logging.error(f"Warm start on Switch {self.s.name} not possible: {e}")
+                return False
+            batch = self.apply(ops)
+
+        if fmc.flow_meters:
+            fmc.adjust_byte_count()
+
+        self._log_summary(f"Warm start on Switch {self.s.name}", ops, batch)
+        return True
+
+    @staticmethod
+    def _log_summary(prefix: str, ops: list, batch: TableBatch):
+        counts = {op: sum(1 for o, _ in ops if o == op) for op in (TableBatch.ADD, TableBatch.MOD, TableBatch.DEL)}
+        logging.info(f"{prefix}: {counts[TableBatch.ADD]} added, {counts[TableBatch.MOD]} modified, "
+                     f"{counts[TableBatch.DEL]} deleted entries with {batch.rpc_count} requests, {len(batch.errors)} failed.")
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+
+
+class ResultWriter:
+    """
+    Append-only writer for simulation results in NDJSON format, one record per line.
+    Every record carries the number of its run, so appending a run costs O(run size) independent of the file size.
+
+    Writes are flushed and synced to disk in batches of fsync_every records and at the end of every run.
+    A process that is killed while writing leaves at most one incomplete line at the end of the file,
+    it is ignored by the readers and removed when the file is opened for writing again.
+
+    Files in the former JSON format, a list of runs, are converted once when they are opened.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 1000):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._convert_legacy()
+        self.run = self._last_run() + 1
+        self.file = open(path, "ab")
+
+    def _convert_legacy(self):
+        """
+        Rewrites a file in the former JSON format, a list of runs, as NDJSON.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(1) != b"[":
+                    return
+                f.seek(0)
+                runs = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.decoder.JSONDecodeError:
+            logging.warning(f"{self.path} is neither JSON nor NDJSON, starting a new file.")
+            runs = []
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            for run, records in enumerate(runs, start=1):
+                for r in records:
+                    f.write(self._encode(run, r))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        logging.info(f"Converted {len(runs)} runs of {self.path} to NDJSON.")
+
+    def _last_run(self):
+        """
+        Reads the run number of the last complete record from the end of the file.
+        An incomplete last line is truncated.
+        """
+        try:
+            f = open(self.path, "rb+")
+        except FileNotFoundError:
+            return 0
+
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            tail = b""
+            # Read backwards until the last complete line is found
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                tail = f.read(step) + tail
+                lines = tail.split(b"\n")
+                if len(lines) > 2 or (pos == 0 and len(lines) > 1):
+                    break
+
+            lines = tail.split(b"\n")
+            if lines[-1]:
+                # Incomplete record of an interrupted write
+                f.truncate(end - len(lines[-1]))
+                logging.warning(f"Removed an incomplete record at the end of {self.path}.")
+
+            complete = [l for l in lines[:-1] if l]
+            if not complete:
+                return 0
+            return json.loads(complete[-1])["run"]
+
+    @staticmethod
+    def _encode(run: int, record: dict):
+        return (json.dumps({"run": run, **record}) + "\n").encode()
+
+    def append(self, record: dict):
+        """
+        Appends one record to the current run.
+        """
+        self.file.write(self._encode(self.run, record))
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def write_run(self, records: list):
+        """
+        Appends all records of a run and starts the next run.
+
+        :returns run: Number of the written run.
+        """
+        for r in records:
+            self.append(r)
+        return self.end_run()
+
+    def end_run(self):
+        """
+        Syncs the records of the current run to disk and starts the next run.
+
+        :returns run: Number of the finished run.
+        """
+        self.sync()
+        self.run += 1
+        return self.run - 1
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_records(path: str):
+    """
+    Streams the records of a result file, the run number is part of every record.
+    Incomplete lines of interrupted writes are skipped.
+    Files in the former JSON format are read as well.
+    """
+    with open(path, "rb") as f:
+        if f.read(1) == b"[":
+            f.seek(0)
+            for run, records in enumerate(json.load(f), start=1):
+                for r in records:
+                    yield {"run": run, **r}
+            return
+
+        f.seek(0)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            yield json.loads(line)
+
+
+def read_runs(path: str):
+    """
+    Streams the runs of a result file.
+
+    :returns runs: Generator of lists of records in the format that was passed to ResultWriter.write_run.
+    """
+    run = None
+    records = []
+    for r in read_records(path):
+        if r["run"] != run and records:
+            yield records
+            records = []
+        run = r.pop("run")
+        records.append(r)
+    if records:
+        yield records
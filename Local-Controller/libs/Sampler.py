@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from libs.bfrt import gc
+from libs.CounterAccumulator import CounterAccumulator
+
+
+class RingBuffer:
+    """
+    Preallocated buffer for the latest samples of a counter table.
+    Every sample consists of a timestamp and one packet and one byte column per sampled index.
+    The memory usage is fixed, once the buffer is full the oldest samples are overwritten.
+
+    Samples have increasing sequence numbers, count is the sequence number of the next sample.
+    """
+
+    def __init__(self, capacity: int, num_indices: int):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.pkts = np.zeros((capacity, num_indices), dtype=np.uint64)
+        self.bytes = np.zeros((capacity, num_indices), dtype=np.uint64)
+        self.count = 0
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __iter__(self):
+        """
+        Iterates over (ts, pkts, bytes) of all buffered samples in chronological order.
+        """
+        ts, pkts, pkt_bytes, _ = self.snapshot()
+        return zip(ts, pkts, pkt_bytes)
+
+    def append(self, ts: float, pkts, pkt_bytes):
+        with self.cond:
+            pos = self.count % self.capacity
+            self.ts[pos] = ts
+            self.pkts[pos] = pkts
+            self.bytes[pos] = pkt_bytes
+            self.count += 1
+            self.cond.notify_all()
+
+    def snapshot(self, since: int = 0):
+        """
+        Returns copies of all buffered samples with a sequence number >= since in chronological order.
+
+        :param since: Sequence number of the first sample, samples that were overwritten already are skipped.
+
+        :returns ts, pkts, bytes, count: Timestamps, packet and byte columns and the sequence number of the next sample.
+        """
+        with self.cond:
+            idx = np.arange(max(since, self.count - self.capacity, 0), self.count) % self.capacity
+            return self.ts[idx], self.pkts[idx], self.bytes[idx], self.count
+
+    def latest(self, n: int = 1):
+        """
+        Returns the last n samples, see snapshot.
+        """
+        return self.snapshot(self.count - n)
+
+    def wait(self, since: int, timeout: float = None):
+        """
+        Blocks until the sample with sequence number since exists.
+
+        :returns available: False if the timeout expired.
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.count > since, timeout)
+
+
+class SampledTable:
+    """
+    A counter table that is sampled at a fixed interval.
+    The 32-bit counters are accumulated to 64-bit totals, so the buffers never contain wrapped values.
+    The interval must not exceed the max_poll_interval of the byte counters at MAX_BYTES_RATE, see CounterAccumulator.
+
+    :param table: The counter string or the name of a table with direct counters. A list of counter strings is
+                  read with a single request per tick, so all of their columns belong to the same tick.
+                  The columns are ordered by counter and then by index.
+    :param indices: Indices of an indirect counter or match fields of the entries of a table with direct counters.
+    """
+
+    # 100G line rate
+    MAX_BYTES_RATE = 100e9 / 8
+
+    def __init__(self, name: str, table: str, indices: list, interval: float, capacity: int):
+        self.name = name
+        self.table = table
+        self.indices = indices
+        self.interval = interval
+        self.tables = table if isinstance(table, list) else [table]
+        columns = len(self.tables) * len(indices)
+        self.buffer = RingBuffer(capacity, columns)
+
+        # The smallest frame is 64 bytes
+        self.pkts = CounterAccumulator(columns, max_rate=self.MAX_BYTES_RATE / 64)
+        self.bytes = CounterAccumulator(columns, max_rate=self.MAX_BYTES_RATE)
+        if interval > self.max_interval():
+            raise ValueError(f"Sampling interval {interval}s of {name} exceeds {self.max_interval():.3f}s, "
+                             f"the byte counters can wrap more than once between two samples.")
+
+        self.start = time.monotonic()
+        self.ticks = 0
+        self.next_due = self.start
+        # Number of ticks that were skipped because sampling took longer than the interval
+        self.missed = 0
+        self.failed = 0
+
+    @classmethod
+    def max_interval(cls):
+        """
+        Returns the longest sampling interval in seconds in which the byte counters wrap at most once.
+        """
+        return CounterAccumulator(0, max_rate=cls.MAX_BYTES_RATE).max_poll_interval()
+
+    @property
+    def suspect_intervals(self):
+        """
+        Number of samples taken after more than max_poll_interval, e.g. after skipped ticks or failed reads,
+        whose increments can miss wraps.
+        """
+        return max(self.pkts.suspect_intervals, self.bytes.suspect_intervals)
+
+    def sample(self, switch):
+        ts = time.time()
+        if self.indices and isinstance(self.indices[0], dict):
+            rows = switch.get_direct_counters(self.table, self.indices, max_staleness=self.interval / 2)
+        else:
+            counters = switch.get_counters(self.tables, self.indices, max_staleness=self.interval / 2)
+            rows = [counters[t][i] for t in self.tables for i in self.indices]
+
+        self.buffer.append(ts,
+                           self.pkts.update(ts, [r["$COUNTER_SPEC_PKTS"] for r in rows]),
+                           self.bytes.update(ts, [r.get("$COUNTER_SPEC_BYTES", 0) for r in rows]))
+
+    def schedule_next(self):
+        """
+        Schedules the next tick relative to the start time, so the jitter of single reads does not add up.
+        Ticks that are already over are skipped.
+        """
+        self.ticks += 1
+        self.next_due = self.start + self.ticks * self.interval
+
+        now = time.monotonic()
+        if self.next_due < now:
+            skipped = int((now - self.next_due) / self.interval) + 1
+            self.missed += skipped
+            self.ticks += skipped
+            self.next_due = self.start + self.ticks * self.interval
+
+
+class Sampler:
+    """
+    Samples counter tables of a switch at fixed intervals into ring buffers.
+    A single thread serves all tables and sleeps until the next table is due, so the CPU usage
+    only depends on the sampling rates and the memory usage is fixed by the buffer capacities.
+    """
+
+    def __init__(self, switch):
+        self.s = switch
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.exit_event = threading.Event()
+        self.thread = None
+
+    def add(self, name: str, table: str, indices: list, interval: float, capacity: int):
+        """
+        Registers a counter table for sampling, can be called while the sampler is running.
+
+        :param name: Name to look up the samples with buffer().
+        :param table: The counter string or the name of a table with direct counters, or a list of counter strings
+                      that are sampled together, see SampledTable.
+        :param indices: Indices of an indirect counter or match fields of the entries of a table with direct counters.
+        :param interval: Sampling interval in seconds, at most the max_poll_interval of the counters.
+        :param capacity: Number of samples that are kept.
+
+        :returns buffer: RingBuffer of the samples.
+        """
+        t = SampledTable(name, table, indices, interval, capacity)
+        # Other consumers of the table can reuse the syncs of the sampler
+        for counter in t.tables:
+            self.s.syncs.declare(counter, interval / 2)
+        with self.lock:
+            self.tables[name] = t
+        return t.buffer
+
+    def buffer(self, name: str):
+        return self.tables[name].buffer
+
+    def start(self):
+        self.exit_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(), daemon=True, name="Counter-Sampler")
+        self.thread.start()
+
+    def stop(self):
+        self.exit_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        while not self.exit_event.is_set():
+            with self.lock:
+                t = min(self.tables.values(), key=lambda t: t.next_due, default=None)
+
+            if not t:
+                self.exit_event.wait(0.1)
+                continue
+
+            delay = t.next_due - time.monotonic()
+            if delay > 0 and self.exit_event.wait(delay):
+                break
+
+            try:
+                t.sample(self.s)
+            except (gc.BfruntimeReadWriteRpcException, KeyError) as e:
+                if not t.failed:
+                    logging.warning(f"Sampling {t.name} from {t.table} failed: {e}")
+                t.failed += 1
+
+            t.schedule_next()
+
+        for t in self.tables.values():
+            if t.missed:
+                logging.warning(f"Sampler skipped {t.missed} of {t.ticks} ticks of {t.name}, interval {t.interval}s is too short.")
+            if t.suspect_intervals:
+                logging.warning(f"{t.suspect_intervals} samples of {t.name} can miss counter wraps, "
+                                f"they were taken more than {t.max_interval():.3f}s after the previous one.")
@@ -0,0 +1,258 @@
+import logging
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from libs import TimeQuantization
+from libs.PktGen import PktGen
+from libs.ScheduleCompiler import ScheduleCompiler
+
+AnalysisIssue = namedtuple("AnalysisIssue", ["severity", "subject", "message"])
+# Truncation errors in ns are the quantized minus the configured borders, i.e. negative if the interval starts or ends earlier
+ScheduleReport = namedtuple("ScheduleReport", ["name", "period", "intervals", "gaps", "low_errors", "high_errors",
+                                               "max_error"])
+# drift: generated minus configured hyperperiod in ns, see PktGen.calc_period_packets
+PortReport = namedtuple("PortReport", ["port", "schedules", "hyperperiod", "pkt_count", "interval_length", "drift"])
+
+
+class ScheduleAnalysis:
+    """
+    Checks the gate schedules and hyperperiods of a configuration without contacting the switch.
+
+    Schedules are checked for intervals outside of their period, overlapping and zero length intervals, and
+    intervals that vanish in the quantization of the timestamps. Gaps between intervals are allowed,
+    frames in a gap are handled as in a closed interval.
+    The hyperperiod of a port is the least common multiple of the periods of its schedules. It must fit into the
+    quantized timestamps and be generated by the packet generator, see PktGen.calc_period_packets.
+    Hyperperiods that can only be generated with a drift are reported as a warning.
+    The checks sort the intervals of every schedule once, i.e. they run in O(n log n).
+
+    The timestamps are quantized with ts_shift of the configuration and the width of TimeQuantization,
+    i.e. the width of the loaded P4 program once it is configured, see TimeQuantization.configure.
+
+    :param config: Parsed configuration, see Config.
+    """
+
+    ERROR = "error"
+    WARNING = "warning"
+
+    # Applications of the packet generator, i.e. ports with a hyperperiod
+    MAX_PORTS = 8
+    # Intervals reported per check and schedule
+    MAX_REPORTED = 10
+
+    def __init__(self, config):
+        self.config = config
+        self.ts_shift = config.ts_shift
+        self.ts_width = TimeQuantization.TS_WIDTH
+        self.max_period = 1 << (self.ts_shift + self.ts_width)
+
+    def check(self):
+        """
+        :returns issues: list of AnalysisIssue of all schedules and ports.
+        """
+        issues = []
+        for s in self.config.instances_schedules:
+            issues += self._check_schedule(s)
+        issues += self._check_ports()[1]
+        return issues
+
+    def _check_schedule(self, schedule):
+        issues = []
+        name = schedule.name
+
+        def issue(severity, message):
+            issues.append(AnalysisIssue(severity, name, message))
+
+        def interval_issues(severity, indices, message):
+            # Only the first MAX_REPORTED intervals of a check are reported one by one
+            for i in indices[:self.MAX_REPORTED]:
+                issue(severity, message(i))
+            if len(indices) > self.MAX_REPORTED:
+                issue(severity, f"{len(indices) - self.MAX_REPORTED} more intervals like this.")
+
+        if not 0 < schedule.period <= self.max_period:
+            issue(self.ERROR, f"Period {schedule.period} ns is not within 1 and {self.max_period} ns, "
+                              f"see ts_shift and ts_width.")
+
+        lows, highs = self._borders(schedule)
+        if not len(lows):
+            issue(self.WARNING, "Schedule has no intervals, its gates are always closed.")
+            return issues
+
+        interval_issues(self.ERROR, np.flatnonzero((lows < 0) | (highs > schedule.period)).tolist(),
+                        lambda i: f"Interval {i} [{lows[i]}, {highs[i]}) exceeds the period of {schedule.period} ns.")
+        interval_issues(self.ERROR, np.flatnonzero(highs < lows).tolist(),
+                        lambda i: f"Interval {i} [{lows[i]}, {highs[i]}) ends before it starts.")
+        interval_issues(self.WARNING, np.flatnonzero(highs == lows).tolist(),
+                        lambda i: f"Interval {i} [{lows[i]}, {highs[i]}) has length 0.")
+
+        order = np.argsort(lows, kind="stable")
+        if (order != np.arange(len(order))).any():
+            issue(self.WARNING, "Intervals are not sorted by their start, the quantization assumes they are.")
+
+        # An interval overlaps an earlier starting one if it starts before the latest end of all of them
+        sorted_lows, sorted_highs = lows[order], highs[order]
+        latest_end = np.maximum.accumulate(sorted_highs)
+        latest = np.maximum.accumulate(np.where(sorted_highs == latest_end, np.arange(len(order)), 0))
+        def overlap(k):
+            a, b = order[latest[k]], order[k + 1]
+            return f"Interval {b} [{lows[b]}, {highs[b]}) overlaps interval {a} [{lows[a]}, {highs[a]})."
+
+        interval_issues(self.ERROR, np.flatnonzero(sorted_lows[1:] < latest_end[:-1]).tolist(), overlap)
+
+        q_lows, q_highs = TimeQuantization.quantize_intervals(lows, highs, self.ts_shift, self.ts_width)
+        interval_issues(self.WARNING, np.flatnonzero((q_highs < q_lows) & (highs > lows)).tolist(),
+                        lambda i: f"Interval {i} [{lows[i]}, {highs[i]}) is shorter than the resolution of "
+                                  f"{1 << self.ts_shift} ns and is dropped.")
+        return issues
+
+    def _check_ports(self):
+        """
+        :returns (ports, issues): list of PortReport and list of AnalysisIssue.
+        """
+        issues = []
+        by_port = {}
+        for m in self.config.schedule_port_mappings:
+            by_port.setdefault(m["port"], []).append(m)
+
+        if len(by_port) > self.MAX_PORTS:
+            issues.append(AnalysisIssue(self.ERROR, "ports", f"{len(by_port)} ports with a hyperperiod, the packet "
+                                                             f"generator supports {self.MAX_PORTS}."))
+
+        ports = []
+        for port, mappings in sorted(by_port.items()):
+            names = [m["schedule"] for m in mappings]
+            periods = [m["period"] for m in mappings]
+            hyperperiod = math.lcm(*periods) if all(p > 0 for p in periods) else 0
+
+            if len(mappings) > 1:
+                issues.append(AnalysisIssue(self.ERROR, f"port {port}",
+                                            f"Schedules {names} with periods {periods} are mapped to the port, "
+                                            f"their hyperperiod is {hyperperiod} ns. Only one schedule per port is supported."))
+
+            pkt_count = interval_length = drift = None
+            if hyperperiod > self.max_period:
+                issues.append(AnalysisIssue(self.ERROR, f"port {port}", f"Hyperperiod of {hyperperiod} ns exceeds "
+                                                                        f"{self.max_period} ns of the quantized timestamps."))
+            elif hyperperiod:
+                try:
+                    pkt_count, interval_length = PktGen.calc_period_packets(hyperperiod)
+                    drift = pkt_count * interval_length - hyperperiod
+                except ValueError as e:
+                    issues.append(AnalysisIssue(self.ERROR, f"port {port}", f"Hyperperiod of {hyperperiod} ns can not "
+                                                                            f"be generated: {e}"))
+                if drift:
+                    issues.append(AnalysisIssue(self.WARNING, f"port {port}",
+                                                f"Hyperperiod of {hyperperiod} ns is generated as {pkt_count} x "
+                                                f"{interval_length} ns with a drift of {drift} ns per hyperperiod."))
+            ports.append(PortReport(port, names, hyperperiod, pkt_count, interval_length, drift))
+        return ports, issues
+
+    def _borders(self, schedule):
+        n = len(schedule.intervals)
+        return (np.fromiter((d["low"] for d in schedule.intervals), dtype=np.int64, count=n),
+                np.fromiter((d["high"] for d in schedule.intervals), dtype=np.int64, count=n))
+
+    def hyperperiods(self):
+        """
+        :returns ports: list of PortReport, the hyperperiod of every port and its packet generation.
+        """
+        return self._check_ports()[0]
+
+    def schedule_report(self, schedule):
+        """
+        Truncation error of every interval after the quantization of its borders, see Schedule.truncate_schedule,
+        and the gaps between the intervals.
+
+        :returns report: ScheduleReport
+        """
+        lows, highs = self._borders(schedule)
+        if not len(lows):
+            return ScheduleReport(schedule.name, schedule.period, 0, [(0, schedule.period)], lows, highs, 0)
+
+        q_lows, q_highs = TimeQuantization.quantize_intervals(lows, highs, self.ts_shift, self.ts_width)
+        low_errors = (q_lows << self.ts_shift) - lows
+        # The quantized upper border is inclusive, the interval ends with the start of the next slot.
+        # The upper border of the last interval is not shifted by quantize_intervals, it ends at its slot.
+        border = np.ones(len(highs), dtype=np.int64)
+        border[-1:] = 0
+        high_errors = ((q_highs + border) << self.ts_shift) - highs
+
+        order = np.argsort(lows, kind="stable")
+        starts = np.concatenate(([0], np.maximum.accumulate(highs[order])))
+        ends = np.concatenate((lows[order], [schedule.period]))
+        gaps = [(s, e) for s, e in zip(starts.tolist(), ends.tolist()) if e > s]
+
+        max_error = int(np.maximum(np.abs(low_errors), np.abs(high_errors)).max())
+        return ScheduleReport(schedule.name, schedule.period, len(lows), gaps, low_errors, high_errors, max_error)
+
+    def estimate_tcam(self):
+        """
+        Estimates the ternary entries of the stream gate instance table before and after the compilation
+        of the schedules, see ScheduleCompiler. Only gates with a schedule that is mapped to a port are installed,
+        gates that share a schedule count once with shared_schedules.
+        Uses the configured quantization, see TimeQuantization.configure.
+
+        :returns (before, after, per_schedule): Total entries and a dict of schedule name to (before, after)
+                                                of all installed copies of the schedule.
+        """
+        compiler = ScheduleCompiler()
+        # (schedule name, octets enforced) to (before, after)
+        stats = {}
+        # Installed copy of a schedule to (before, after), see StreamGateController.schedule_id
+        installed = {}
+        scheduled = {m["schedule"] for m in self.config.schedule_port_mappings}
+        for g in self.config.instances_gates:
+            if g.schedule.name not in scheduled:
+                continue
+            octets_enforced = g.gate_closed_due_to_octets_exceeded_enable
+            variant = (g.schedule.name, octets_enforced)
+            if variant not in stats:
+                _, s = compiler.compile(g.schedule.intervals, octets_enforced)
+                stats[variant] = (s.tcam_before, s.tcam_after)
+            shared = self.config.shared_schedules and not octets_enforced
+            installed[(g.schedule.name, None if shared else g.gate_id)] = stats[variant]
+
+        per_schedule = {}
+        for (name, _), (b, a) in installed.items():
+            before, after = per_schedule.get(name, (0, 0))
+            per_schedule[name] = (before + b, after + a)
+        return sum(b for b, _ in installed.values()), sum(a for _, a in installed.values()), per_schedule
+
+    def log_report(self):
+        """
+        Logs the issues, the hyperperiods of the ports and the truncation errors and TCAM entries of the schedules.
+
+        :returns issues: list of AnalysisIssue, see check.
+        """
+        issues = self.check()
+        tcam_before, tcam_after, tcam = self.estimate_tcam()
+
+        logging.info(f"Quantization: bits [{self.ts_shift + self.ts_width - 1}:{self.ts_shift}], "
+                     f"resolution {1 << self.ts_shift} ns, longest hyperperiod {self.max_period} ns.")
+        for p in self.hyperperiods():
+            generation = f"generated as {p.pkt_count} x {p.interval_length} ns, drift {p.drift} ns" if p.pkt_count \
+                else "not expressible"
+            logging.info(f"Port {p.port}: schedules {p.schedules}, hyperperiod {p.hyperperiod} ns, {generation}.")
+
+        scheduled = {m["schedule"] for m in self.config.schedule_port_mappings}
+        unscheduled = sorted({g.schedule.name for g in self.config.instances_gates} - scheduled)
+        if unscheduled:
+            logging.info(f"Schedules {unscheduled} are used by gates, but not mapped to a port. They are not installed.")
+
+        for s in self.config.instances_schedules:
+            r = self.schedule_report(s)
+            before, after = tcam.get(s.name, (0, 0))
+            logging.info(f"Schedule {s.name}: period {r.period} ns, {r.intervals} intervals, {len(r.gaps)} gaps, "
+                         f"max truncation error {r.max_error} ns, TCAM entries {before} -> {after} compiled.")
+            for i, (l, h) in enumerate(zip(r.low_errors.tolist(), r.high_errors.tolist())):
+                logging.debug(f"Schedule {s.name} interval {i}: truncation error low {l:+} ns, high {h:+} ns.")
+
+        logging.info(f"Stream gate instance table: {tcam_before} TCAM entries, {tcam_after} compiled.")
+
+        for i in issues:
+            log = logging.error if i.severity == self.ERROR else logging.warning
+            log(f"{i.subject}: {i.message}")
+        return issues
@@ -0,0 +1,230 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from libs import TimeQuantization
+
+ScheduleCompileStats = namedtuple("ScheduleCompileStats",
+                                  ["intervals", "entries", "zero_width", "merged", "moved_borders",
+                                   "tcam_before", "tcam_after"])
+
+
+def range_expansion(lows, highs, width: int = None):
+    """
+    Number of ternary entries of range matches, i.e. the size of the minimal prefix cover of [low, high].
+    Ranges with high < low are empty and cost nothing.
+
+    :param lows: Inclusive lower borders, int or numpy array.
+    :param highs: Inclusive upper borders, int or numpy array.
+    :param width: Width of the range key, TimeQuantization.TS_WIDTH if None.
+
+    :returns count: Number of ternary entries, int64 numpy array.
+    """
+    width = TimeQuantization.TS_WIDTH if width is None else width
+    lo = np.array(lows, dtype=np.int64, ndmin=1)
+    hi = np.array(highs, dtype=np.int64, ndmin=1)
+    count = np.zeros(np.broadcast(lo, hi).shape, dtype=np.int64)
+    lo, hi = np.broadcast_arrays(lo, hi)
+    lo = lo.copy()
+
+    active = lo <= hi
+    while active.any():
+        # Largest aligned block at lo that fits into the rest of the range
+        align = np.where(lo == 0, 1 << width, lo & -lo)
+        rest = np.maximum(hi - lo + 1, 1)
+        fit = np.left_shift(1, np.floor(np.log2(rest)).astype(np.int64))
+        block = np.minimum(align, fit)
+
+        count += active
+        lo = np.where(active, lo + block, lo)
+        active = lo <= hi
+    return count
+
+
+class ScheduleCompiler:
+    """
+    Compiles the intervals of a gate schedule to the range match entries of the stream gate instance table
+    with as few TCAM entries as possible.
+
+    The intervals are truncated to slots of 2^TS_SHIFT ns, see Schedule.truncate_schedule, and then
+        - intervals that collapse to zero slots are dropped,
+        - adjacent intervals with the same gate state and IPV are merged. The octet limits of a gate with
+          GateClosedDueToOctetsExceeded are per interval, so its intervals are only merged with equal limits.
+          Without it, frames in closed intervals are dropped independent of the IPV, so adjacent closed intervals
+          are merged in any case,
+        - the slot of an interval border that is not slot aligned is assigned to the interval before or after it,
+          whichever needs less ternary entries. Both are within the truncation error of one slot,
+          the octet limits of a gate with GateClosedDueToOctetsExceeded keep the borders of the truncation.
+
+    The ternary entries are counted by their prefix expansion, see range_expansion.
+
+    With a P4 program compiled with __GATE_SLOTS__, a compiled schedule can also be installed as one exact match entry
+    per time slot, see slot_schedule. choose_mode decides between both by the share of the resources of a stage
+    they need.
+    """
+
+    RANGE = "range"
+    SLOT = "slot"
+
+    # Resources of one stage of Tofino: 24 TCAM blocks of 512 44-bit words and 80 SRAM blocks of 1024 128-bit words.
+    # A ternary entry of the (gate, match_ts) key needs one TCAM word, an exact slot entry half an SRAM word.
+    TCAM_ENTRIES = 24 * 512
+    SRAM_ENTRIES = 80 * 1024 * 2
+
+    def compile(self, intervals: list, octets_enforced: bool = False):
+        """
+        :param intervals: Intervals of a schedule with low and high in ns, state, ipv and octets.
+        :param octets_enforced: The gate closes on exceeded octets, i.e. octet limits must be kept per interval.
+
+        :returns (schedule, stats): Compiled intervals in the format of Schedule.create_schedule
+                                    and ScheduleCompileStats.
+        """
+        n = len(intervals)
+        if not n:
+            return [], ScheduleCompileStats(0, 0, 0, 0, 0, 0, 0)
+
+        ns_lows = np.fromiter((d["low"] for d in intervals), dtype=np.int64, count=n)
+        ns_highs = np.fromiter((d["high"] for d in intervals), dtype=np.int64, count=n)
+        lows, highs = TimeQuantization.quantize_intervals(ns_lows, ns_highs)
+        tcam_before = int(range_expansion(lows, highs).sum())
+
+        # Zero width slots
+        keep = np.flatnonzero(highs >= lows)
+        zero_width = n - len(keep)
+
+        # Merge equivalent adjacent intervals, a group of merged intervals is represented by its first interval
+        groups = []
+        for i in keep.tolist():
+            d = intervals[i]
+            if groups:
+                g = groups[-1]
+                first = intervals[g[0]]
+                if lows[i] == g[2] + 1 and self._equivalent(first, d, octets_enforced):
+                    g[2] = highs[i]
+                    continue
+            groups.append([i, lows[i], highs[i]])
+
+        m = len(groups)
+        g_lows = np.array([g[1] for g in groups], dtype=np.int64)
+        g_highs = np.array([g[2] for g in groups], dtype=np.int64)
+
+        # Border b is between group b - 1 and b. It is flexible if the groups are adjacent and the border is unaligned.
+        flexible = np.zeros(m + 1, dtype=bool)
+        if m > 1 and not octets_enforced:
+            border_ns = ns_lows[[g[0] for g in groups[1:]]]
+            flexible[1:m] = (g_lows[1:] == g_highs[:-1] + 1) & (border_ns & ((1 << TimeQuantization.TS_SHIFT) - 1) != 0)
+
+        moves = self._assign_borders(g_lows, g_highs, flexible)
+        g_lows += moves[:-1]
+        g_highs += moves[1:]
+
+        schedule = []
+        for (i, _, _), l, h in zip(groups, g_lows.tolist(), g_highs.tolist()):
+            d = intervals[i]
+            schedule.append({"low": l, "high": h, "state": d["state"], "ipv": d["ipv"], "octets": d["octets"]})
+
+        stats = ScheduleCompileStats(intervals=n, entries=m, zero_width=zero_width, merged=len(keep) - m,
+                                     moved_borders=int(moves.sum()), tcam_before=tcam_before,
+                                     tcam_after=int(range_expansion(g_lows, g_highs).sum()))
+        return schedule, stats
+
+    @staticmethod
+    def slot_count(schedule: list, slot_shift: int):
+        """
+        Returns the number of slots of 2^slot_shift match_ts units of a compiled schedule,
+        or None if an interval border is not slot aligned, i.e. slots would change the schedule.
+        """
+        unit = 1 << slot_shift
+        count = 0
+        for s in schedule:
+            if s["low"] % unit or (s["high"] + 1) % unit:
+                return None
+            count += (s["high"] + 1 - s["low"]) >> slot_shift
+        return count
+
+    @staticmethod
+    def slot_schedule(schedule: list, slot_shift: int):
+        """
+        Quantizes a compiled schedule with slot aligned borders, see slot_count, to time slots of 2^slot_shift units.
+
+        :returns slots: list of (slot index, interval) tuples.
+        """
+        return [(i, s) for s in schedule for i in range(s["low"] >> slot_shift, (s["high"] + 1) >> slot_shift)]
+
+    def choose_mode(self, tcam_entries: int, slot_count: int = None, free_slots: int = None):
+        """
+        Returns SLOT if the slot entries of a schedule fit into the free entries of the slot table and need a smaller
+        share of the SRAM of a stage than its ternary entries of the TCAM, otherwise RANGE.
+
+        :param tcam_entries: Ternary entries of the compiled schedule, see ScheduleCompileStats.tcam_after.
+        :param slot_count: Slot entries of the schedule, None if it can not be installed in slots.
+        :param free_slots: Entries of the slot table that are not used by other schedules, None if unlimited.
+        """
+        if slot_count is None or (free_slots is not None and slot_count > free_slots):
+            return self.RANGE
+        return self.SLOT if slot_count / self.SRAM_ENTRIES < tcam_entries / self.TCAM_ENTRIES else self.RANGE
+
+    @staticmethod
+    def _equivalent(a: dict, b: dict, octets_enforced: bool):
+        """
+        Returns if the intervals a and b handle frames the same way, i.e. can be merged if they are adjacent.
+        """
+        if a["state"] != b["state"]:
+            return False
+        if octets_enforced:
+            return a["ipv"] == b["ipv"] and a["octets"] == b["octets"]
+        return a["state"] == 0 or a["ipv"] == b["ipv"]
+
+    @staticmethod
+    def _assign_borders(lows, highs, flexible):
+        """
+        Chooses for every flexible border if its slot moves to the interval before it,
+        minimizing the sum of the ternary entries of all intervals.
+
+        :returns moves: int64 array of 0 or 1 per border, border b shifts the high of interval b - 1
+                        and the low of interval b by moves[b].
+        """
+        m = len(lows)
+        moves = np.zeros(m + 1, dtype=np.int64)
+        if not flexible.any():
+            return moves
+
+        # cost[a][b][i]: entries of interval i if its low moves by a and its high by b
+        cost = [[None, None], [None, None]]
+        for a in (0, 1):
+            for b in (0, 1):
+                c = range_expansion(lows + a, highs + b).astype(np.float64)
+                # Unavailable moves and intervals that would become empty
+                invalid = lows + a > highs + b
+                if a:
+                    invalid |= ~flexible[:-1]
+                if b:
+                    invalid |= ~flexible[1:]
+                c[invalid] = np.inf
+                cost[a][b] = c.tolist()
+
+        # Dynamic programming over the borders, best0/best1: lowest cost of the intervals before border i
+        # if border i does not/does move, choice[i][b]: move of border i for the best cost with move b of border i + 1
+        best0, best1 = 0.0, float("inf")
+        choice = []
+        (c00, c01), (c10, c11) = cost
+        for i in range(m):
+            n0, n1 = best0 + c00[i], best1 + c10[i]
+            m0, m1 = best0 + c01[i], best1 + c11[i]
+            choice.append((0 if n0 <= n1 else 1, 0 if m0 <= m1 else 1))
+            best0, best1 = min(n0, n1), min(m0, m1)
+
+        for i in range(m - 1, -1, -1):
+            moves[i] = choice[i][moves[i + 1]]
+        return moves
+
+    def log_stats(self, name: str, stats: ScheduleCompileStats, slots: int = None):
+        """
+        :param slots: Number of slot entries if the schedule is installed in slots.
+        """
+        installed = f"installed in {slots} slot entries instead of {stats.tcam_after} TCAM entries" if slots is not None else \
+            f"TCAM entries {stats.tcam_before} -> {stats.tcam_after}, saved {stats.tcam_before - stats.tcam_after}"
+        logging.info(f"Schedule {name}: {stats.intervals} intervals compiled to {stats.entries} entries "
+                     f"({stats.zero_width} zero width, {stats.merged} merged, {stats.moved_borders} borders moved), "
+                     f"{installed}.")
@@ -1,15 +1,23 @@
-from bfrt_grpc.client import ClientInterface
-import bfrt_grpc.client as gc
+from libs.bfrt import gc, SDE_AVAILABLE
 from . import Helper
-import re
 from prettytable import PrettyTable
 from enum import Enum
 from typing import Optional
+from contextlib import contextmanager
+import threading
+import time
 
-from libs.ThriftConnection import ThriftConnection
-from thrift.protocol import TBinaryProtocol, TMultiplexedProtocol
+if SDE_AVAILABLE:
+    from libs.ThriftConnection import ThriftConnection
+    from thrift.protocol import TBinaryProtocol, TMultiplexedProtocol
 
 from libs.PktGen import PktGen
+from libs.TableBatch import TableBatch
+from libs.TableEncoder import TableEncoder
+from libs.SyncCoordinator import SyncCoordinator
+from libs.DigestDispatcher import DigestDispatcher, DigestRecord
+from libs.DigestStats import DigestStats
+from libs import TimeQuantization
 
 import logging
 import importlib
@@ -39,12 +47,17 @@ COLORS = [TerminalColor.GREEN.value, TerminalColor.YELLOW.value,
 class Switch:
     """
     This class represents a PSFP enabled switch object.
+
+    With mock=True no switch is contacted. The in-memory backend of libs.mock models the
+    tables of the sdn-psfp program instead and delays every RPC by mock_latency seconds.
+    mock_defines selects the compile time options of the modeled program, e.g. {"__SHARED_SCHEDULES__": 1}.
     """
 
-    def __init__(self, name: str = "", ip: str = "127.0.0.1", grpc_port: int = 50052, thrift_port: int = 9090, clear: bool = True, program: str = ""):
+    def __init__(self, name: str = "", ip: str = "127.0.0.1", grpc_port: int = 50052, thrift_port: int = 9090, clear: bool = True, program: str = "",
+                 mock: bool = False, mock_latency: float = 0.0, mock_defines: Optional[dict] = None):
         self.name = name
         self.grpc_addr = ip + ":" + str(grpc_port)
-        self.thrift = ThriftConnection(ip=ip, port=thrift_port)
+        self.mock = mock
         self.pkt_gen = PktGen(self)
         self.stream_filter_controller = None
         self.stream_gate_controller = None
@@ -56,19 +69,53 @@ class Switch:
         # Simulation monitoring session
         self.sim = None
 
-        # ! Hardcoded Digest IDs
-        self.digests = {"2397224885": "digest_pktgen",
-                        "2387156053": "digest_hyperperiod",
-                        "2386104925": "digest_debug_gate"}
-
-        self.c = ClientInterface(self.grpc_addr, 1, 0)
-        self.c.bind_pipeline_config(program)
-
-        # pal
-        self.pal_client_module = importlib.import_module(
-            ".".join(["pal_rpc", "pal"]))
-        self.pal = self.pal_client_module.Client(
-            TMultiplexedProtocol.TMultiplexedProtocol(self.thrift.protocol, "pal"))
+        # Hyperperiod digests have their own unbounded queue and are never delayed by other digests
+        self.digest_dispatcher = DigestDispatcher(self, priority_types=(DigestType.HYPERPERIOD,))
+        self.digest_dispatcher.register(DigestType.HYPERPERIOD, lambda r: self.handle_digest(r.data))
+        for digest_type in (DigestType.MAXSDUEXCEEDED, DigestType.INVALIDRX, DigestType.MARKEDRED):
+            self.digest_dispatcher.register(digest_type, self.handle_block_digest)
+        self.digest_dispatcher.register(None, self.print_digest)
+
+        # Records every received digest if set, see libs.DigestLog
+        self.digest_recorder = None
+
+        # Block digests are counted, every single one is only printed with print_digests
+        self.digest_stats = DigestStats()
+        self.print_digests = False
+
+        # Maximum number of entries per write request in batches
+        self.batch_chunk_size = 1000
+        # Active batch per thread, see batch()
+        self._batch_local = threading.local()
+        # Compiled key/data encoders per table name, see encoder()
+        self._encoders = {}
+        # Hardware syncs of counters shared by all consumers
+        self.syncs = SyncCoordinator(self)
+
+        # Digest ID to the name and the learn object of the digest, resolved from bfrt_info, see resolve_digests()
+        self.digests = {}
+        self.learn_filters = {}
+
+        if mock:
+            from libs.mock import client as mock_client
+            from libs.mock.pal import MockPal, MockThriftConnection
+
+            self.c = mock_client.ClientInterface(self.grpc_addr, 1, 0, latency=mock_latency, defines=mock_defines)
+            self.c.bind_pipeline_config(program)
+            self.thrift = MockThriftConnection()
+            self.pal = MockPal(self.c.device)
+        else:
+            if not SDE_AVAILABLE:
+                raise RuntimeError("SDE python packages not found, only Switch(mock=True) is available!")
+            self.thrift = ThriftConnection(ip=ip, port=thrift_port)
+            self.c = gc.ClientInterface(self.grpc_addr, 1, 0)
+            self.c.bind_pipeline_config(program)
+
+            # pal
+            self.pal_client_module = importlib.import_module(
+                ".".join(["pal_rpc", "pal"]))
+            self.pal = self.pal_client_module.Client(
+                TMultiplexedProtocol.TMultiplexedProtocol(self.thrift.protocol, "pal"))
 
         if clear:
             self.c.clear_all_tables()
@@ -76,68 +123,104 @@ class Switch:
         self.bfrt_info = self.c.bfrt_info_get()
         self.target = gc.Target(device_id=0, pipe_id=0xffff)
 
+        self.resolve_digests()
+
+    def resolve_digests(self):
+        """
+        Resolves the IDs of all digests of the P4 program from bfrt_info, they change when the program is recompiled.
+        The learn object of every digest is looked up once and used to decode all digests with its ID.
+        """
+        for name in self.bfrt_info.learn_name_list_get():
+            learn_filter = self.bfrt_info.learn_get(name)
+            self.learn_filters[learn_filter.id] = learn_filter
+            self.digests[str(learn_filter.id)] = name.split(".")[-1]
+        logging.debug(f"Digests of {self.name}: {self.digests}")
+
     def init_pktgen(self):
         """
         Configure the packet generator.
         """
         self.pkt_gen.set_up_pkt_gen()
 
-    def write_table_entry(self, table: str = "", match_fields: Optional[dict] = None, action_name: str = "", action_params: Optional[dict] = None):
+    def has_table(self, table: str):
         """
-        Creates a table entry in the data plane.
+        Returns if the P4 program has a table, e.g. one that depends on a compile time option.
+
+        :param table: str, Name of the table, with or without the pipe prefix.
+        """
+        return any(t == table or t.endswith("." + table) for t in self.bfrt_info.table_name_list_get())
+
+    def encoder(self, table: str):
+        """
+        Returns the cached encoder of a table, it is built from the bfrt_info schema on first use.
 
         :param table: str, Name of the table.
-        :param match_fields: dict, pairs of key:value in MAT.
-        :param action_name: str, name of the action to apply.
-        :param action_params: dict, pairs of key:value in action definition.
         """
-        bfrt_table = self.bfrt_info.table_get(table)
+        try:
+            return self._encoders[table]
+        except KeyError:
+            enc = TableEncoder(table, self.bfrt_info.table_get(table))
+            self._encoders[table] = enc
+            return enc
 
-        keys = []
+    @contextmanager
+    def batch(self, chunk_size: Optional[int] = None):
+        """
+        Defers all write_table_entry, update_table_entry and remove_table_entry calls of the current thread.
+        The operations are sent grouped per table once the context is left.
+        Nested batches are sent by the outermost context.
 
-        for m in match_fields:
-            if type(match_fields.get(m)) is tuple:
-                if re.match(r"(\b25[0-5]|\b2[0-4][0-9]|\b[01]?[0-9][0-9]?)(\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3}", str(match_fields.get(m)[0])):
-                    # Do IPv4 LPM if first argument of tuple is a IPv4 address
-                    bfrt_table.info.key_field_annotation_add(m, "ipv4")
+        :param chunk_size: Maximum number of entries per write request, defaults to batch_chunk_size.
 
-                if re.match(r"^[a-fA-F0-9]{2}(:[a-fA-F0-9]{2}){5}$", str(match_fields.get(m)[0])):
-                    v = Helper.str_to_mac(match_fields.get(m)[0])
-                    k = match_fields.get(m)[1]
-                else:
-                    v = match_fields.get(m)[0]
-                    k = match_fields.get(m)[1]
-
-                try:
-                    if match_fields.get(m)[2] == "lpm":
-                        keys.append(gc.KeyTuple(m, value=v, prefix_len=k))
-                    elif match_fields.get(m)[2] == "t":
-                        keys.append(gc.KeyTuple(m, value=v, mask=k))
-                    elif match_fields.get(m)[2] == "r":
-                        keys.append(gc.KeyTuple(m, low=v, high=k))
-                    else:
-                        raise KeyError
-                except (IndexError, KeyError):
-                    raise KeyError(
-                        "No or wrong matching type specified! Use either 'lpm', 'r' or 't' as third element in tuple m.")
+        :returns batch: TableBatch, holds the entries that failed in batch.errors after the context is left.
+        """
+        current = getattr(self._batch_local, "batch", None)
+        if current:
+            yield current
+            return
 
-            else:
-                if re.match(r"^[a-fA-F0-9]{2}(:[a-fA-F0-9]{2}){5}$", str(match_fields.get(m))):
-                    keys.append(gc.KeyTuple(
-                        m, Helper.str_to_mac(match_fields.get(m))))
+        batch = TableBatch(self, chunk_size or self.batch_chunk_size)
+        self._batch_local.batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch_local.batch = None
+        batch.flush()
 
-                keys.append(gc.KeyTuple(m, match_fields.get(m)))
+    def _queue_or_send(self, op: str, table: str, match_fields: Optional[dict], action_name: str = "", action_params: Optional[dict] = None):
+        """
+        Adds the operation to the active batch of this thread or sends it directly.
+        """
+        enc = self.encoder(table)
+        bfrt_table = enc.table
+        key = enc.make_key(match_fields) if match_fields else None
+        data = enc.make_data(action_name, action_params) if op != TableBatch.DEL else None
 
-        fields = bfrt_table.make_key(keys)
+        entry = {"op": op, "table": table, "match_fields": match_fields,
+                 "action_name": action_name, "action_params": action_params}
 
-        data = []
+        batch = getattr(self._batch_local, "batch", None)
+        if batch:
+            batch.add(op, table, key, data, entry)
+            return
 
-        for a in action_params:
-            data.append(gc.DataTuple(a, action_params.get(a)))
+        if op == TableBatch.ADD:
+            bfrt_table.entry_add(self.target, [key], [data])
+        elif op == TableBatch.MOD:
+            bfrt_table.entry_mod(self.target, [key], [data])
+        else:
+            bfrt_table.entry_del(self.target, [key] if key else None)
 
-        action = bfrt_table.make_data(data, action_name)
+    def write_table_entry(self, table: str = "", match_fields: Optional[dict] = None, action_name: str = "", action_params: Optional[dict] = None):
+        """
+        Creates a table entry in the data plane.
 
-        bfrt_table.entry_add(self.target, [fields], [action])
+        :param table: str, Name of the table.
+        :param match_fields: dict, pairs of key:value in MAT.
+        :param action_name: str, name of the action to apply.
+        :param action_params: dict, pairs of key:value in action definition.
+        """
+        self._queue_or_send(TableBatch.ADD, table, match_fields, action_name, action_params)
 
         logging.debug("Writing table entry on {} for {}: {} with action {} and params {}".format(self.name, table,
                                                                                                  str(
@@ -146,30 +229,38 @@ class Switch:
                                                                                                      action_name),
                                                                                                  str(action_params)))
 
-    def remove_table_entry(self, table: str = "", match_fields: Optional[dict] = None):
+    def write_table_entries(self, table: str, entries: list, chunk_size: Optional[int] = None):
         """
-        Removes an entry from a table in the data plane.
+        Creates many table entries in the data plane with one write request per chunk.
 
         :param table: str, Name of the table.
-        :param match_fields: dict, pairs of key:value in MAT.
+        :param entries: list of dicts with the keys match_fields, action_name and action_params.
+        :param chunk_size: Maximum number of entries per write request, defaults to batch_chunk_size.
+
+        :returns errors: list of (entry, error) tuples of entries that could not be written.
         """
-        bfrt_table = self.bfrt_info.table_get(table)
+        batch = TableBatch(self, chunk_size or self.batch_chunk_size)
+        enc = self.encoder(table)
 
-        keys = []
+        for e in entries:
+            batch.add(TableBatch.ADD, table,
+                      enc.make_key(e["match_fields"]),
+                      enc.make_data(e["action_name"], e.get("action_params")),
+                      {"op": TableBatch.ADD, "table": table, **e})
 
-        if match_fields:
-            for m in match_fields:
-                if type(match_fields.get(m)) is tuple:
-                    keys.append(gc.KeyTuple(m, low=match_fields.get(m)[
-                                0], high=match_fields.get(m)[1]))
-                else:
-                    keys.append(gc.KeyTuple(m, match_fields.get(m)))
+        errors = batch.flush()
+        logging.debug(f"Wrote {len(entries) - len(errors)}/{len(entries)} entries on {self.name} for {table} with {batch.rpc_count} requests.")
 
-            fields = [bfrt_table.make_key(keys)]
-        else:
-            fields = None
+        return errors
 
-        bfrt_table.entry_del(self.target, fields)
+    def remove_table_entry(self, table: str = "", match_fields: Optional[dict] = None):
+        """
+        Removes an entry from a table in the data plane.
+
+        :param table: str, Name of the table.
+        :param match_fields: dict, pairs of key:value in MAT.
+        """
+        self._queue_or_send(TableBatch.DEL, table, match_fields)
 
         logging.debug("Deleting table entry on {} for {}: {}".format(
             self.name, table, str(match_fields)))
@@ -183,40 +274,7 @@ class Switch:
         :param action_name: str, name of the action to apply.
         :param action_params: dict, pairs of key:value in action definition.
         """
-        bfrt_table = self.bfrt_info.table_get(table)
-
-        keys = []
-
-        for m in match_fields:
-            if type(match_fields.get(m)) is tuple:
-                v = match_fields.get(m)[0]
-                k = match_fields.get(m)[1]
-                try:
-                    if match_fields.get(m)[2] == "lpm":
-                        keys.append(gc.KeyTuple(m, value=v, prefix_len=k))
-                    elif match_fields.get(m)[2] == "t":
-                        keys.append(gc.KeyTuple(m, value=v, mask=k))
-                    elif match_fields.get(m)[2] == "r":
-                        keys.append(gc.KeyTuple(m, low=v, high=k))
-                    else:
-                        raise KeyError
-                except (IndexError, KeyError):
-                    raise KeyError(
-                        "No or wrong matching type specified! Use either 'lpm', 'r' or 't' as third element in tuple m.")
-
-            else:
-                keys.append(gc.KeyTuple(m, match_fields.get(m)))
-
-        fields = bfrt_table.make_key(keys)
-
-        data = []
-
-        for a in action_params:
-            data.append(gc.DataTuple(a, action_params.get(a)))
-
-        action = bfrt_table.make_data(data, action_name)
-
-        bfrt_table.entry_mod(self.target, [fields], [action])
+        self._queue_or_send(TableBatch.MOD, table, match_fields, action_name, action_params)
 
         logging.debug("Update table entry on {} for {}: {} with action {} and params {}".format(self.name, table,
                                                                                                 str(
@@ -225,79 +283,110 @@ class Switch:
                                                                                                     action_name),
                                                                                                 str(action_params)))
 
-    def get_table_entries(self, table: str = "", match_fields: Optional[dict] = None, data_fields: Optional[dict] = None):
+    def get_table_entries(self, table: str = "", match_fields: Optional[dict] = None, data_fields: Optional[dict] = None,
+                          counters: bool = True, max_staleness: Optional[float] = None):
         """
         Returns entries of a table.
         All entries if match_fields is None
+        Entries are read from the software state, direct counters of the table are synced before if counters is set.
 
         :param table: str, Name of the table.
         :param match_fields: dict, pairs of key:value in MAT.
+        :param counters: bool, False if the counter values are not needed, e.g. to compare entries.
+        :param max_staleness: Allowed age of the counter values in seconds, see SyncCoordinator.sync.
         """
-        bfrt_table = self.bfrt_info.table_get(table)
-
-        keys = []
-        data = []
-
-        if match_fields:
-            for m in match_fields:
-                if type(match_fields.get(m)) is tuple:
-                    v = match_fields.get(m)[0]
-                    k = match_fields.get(m)[1]
-                    if match_fields.get(m)[2] == "lpm":
-                        keys.append(gc.KeyTuple(m, value=v, prefix_len=k))
-                    elif match_fields.get(m)[2] == "t":
-                        keys.append(gc.KeyTuple(m, value=v, mask=k))
-                    elif match_fields.get(m)[2] == "r":
-                        keys.append(gc.KeyTuple(m, low=v, high=k))
-                else:
-                    keys.append(gc.KeyTuple(m, match_fields.get(m)))
-            fields = [bfrt_table.make_key(keys)]
-        else:
-            fields = None
+        enc = self.encoder(table)
+        bfrt_table = enc.table
+
+        fields = [enc.make_key(match_fields)] if match_fields else None
 
         if data_fields:
             for action, params in data_fields.items():
-                for p in params:
-                    data.append(gc.DataTuple(p))
-                fields_data = bfrt_table.make_data(data_field_list_in=data,
-                                                   action_name=action,
-                                                   get=True)
+                fields_data = enc.make_data(action, params, get=True)
         else:
             fields_data = None
 
-        # Needed to properly display counters in dump_table function
-        # False if simulation for better performance
-        from_hw_flag = False if self.sim else True
+        if counters and enc.counter_fields:
+            self.syncs.sync(table, max_staleness, bfrt_table)
 
         entries = bfrt_table.entry_get(self.target,
                                        key_list=fields,
-                                       flags={"from_hw": from_hw_flag},
+                                       flags={"from_hw": False},
                                        required_data=fields_data)
 
         return entries
 
-    def get_counter_at_index(self, table: str, index: int):
+    def get_counter_at_index(self, table: str, index: int, max_staleness: Optional[float] = None):
         """
         Returns the row of a indirect counter object at index i
 
         :param table: The table string, normally <control_block.counter_name>
         :param index: The index of the row to retrieve
+        :param max_staleness: Allowed age of the counter values in seconds, see SyncCoordinator.sync.
 
         :returns data_dict: A dict of the row with all of the counter fields.
         """
 
-        counter_table = self.bfrt_info.table_get(table)
+        enc = self.encoder(table)
+        counter_table = enc.table
 
-        #self.sync_counters(table, counter_table)
+        self.syncs.sync(table, max_staleness, counter_table)
 
         resp = counter_table.entry_get(self.target,
-                                       [counter_table.make_key(
-                                           [gc.KeyTuple('$COUNTER_INDEX', index)])],
-                                       {"from_hw": True},
+                                       [enc.make_key({'$COUNTER_INDEX': index})],
+                                       {"from_hw": False},
                                        None)
         data_dict = next(resp)[0].to_dict()
         return data_dict
 
+    def get_counters(self, tables, indices: list, max_staleness: Optional[float] = None):
+        """
+        Reads many indices of one or more indirect counters.
+        Every counter is synchronized once and all indices are read from the synchronized values with a single request,
+        instead of one from_hw read per index.
+
+        :param tables: The counter string or a list of them, normally <control_block.counter_name>
+        :param indices: The indices to read from every counter
+        :param max_staleness: Allowed age of the counter values in seconds, see SyncCoordinator.sync.
+
+        :returns counters: A dict of counter name to a dict of index to the row with all of the counter fields.
+        """
+        if isinstance(tables, str):
+            tables = [tables]
+
+        counters = {}
+        for table in tables:
+            enc = self.encoder(table)
+            self.syncs.sync(table, max_staleness, enc.table)
+
+            resp = enc.table.entry_get(self.target,
+                                       [enc.make_key({'$COUNTER_INDEX': i}) for i in indices],
+                                       {"from_hw": False},
+                                       None)
+            counters[table] = {k.to_dict()['$COUNTER_INDEX']['value']: d.to_dict() for d, k in resp}
+
+        return counters
+
+    def get_direct_counters(self, table: str, match_fields_list: list, max_staleness: Optional[float] = None):
+        """
+        Reads the direct counters of many entries of a match action table.
+        The table is synchronized once and all entries are read with a single request.
+
+        :param table: str, Name of the table.
+        :param match_fields_list: list of dicts, the match fields of the entries to read.
+        :param max_staleness: Allowed age of the counter values in seconds, see SyncCoordinator.sync.
+
+        :returns rows: A list with the data dict of every entry, in the order of match_fields_list.
+        """
+        enc = self.encoder(table)
+        self.syncs.sync(table, max_staleness, enc.table)
+
+        resp = enc.table.entry_get(self.target,
+                                   [enc.make_key(m) for m in match_fields_list],
+                                   {"from_hw": False},
+                                   None)
+        return [d.to_dict() for d, _ in resp]
+
     def delete_all_table_data(self):
         """ 
         Deletes all entries in egress and ingress tables
@@ -379,65 +468,111 @@ class Switch:
             logging.critical(f"Register {register_name} not found.")
 
     def read_register(self, register_name: str = "", register_index: int = 0):
-        reg_table = self.bfrt_info.table_get(register_name)
+        enc = self.encoder(register_name)
+        reg_table = enc.table
         resp = reg_table.entry_get(
             self.target,
-            [reg_table.make_key(
-                [gc.KeyTuple('$REGISTER_INDEX', register_index)])],
+            [enc.make_key({'$REGISTER_INDEX': register_index})],
             {"from_hw": True})
 
         return next(resp)
 
-    def get_digest(self):
+    def read_registers(self, register_name: str, register_indices: Optional[list] = None):
+        """
+        Reads many indices of a register with a single request.
+
+        :param register_name: The register string, normally <control_block.register_name>
+        :param register_indices: Indices to read, all indices of the register if None.
 
+        :returns values: dict of index to the list of values of all pipes.
+        """
+        enc = self.encoder(register_name)
+        keys = [enc.make_key({'$REGISTER_INDEX': i}) for i in register_indices] if register_indices is not None else None
+        resp = enc.table.entry_get(self.target, keys, {"from_hw": True})
+
+        field = f"{register_name}.f1"
+        return {k.to_dict()['$REGISTER_INDEX']['value']: d.to_dict()[field] for d, k in resp}
+
+    def get_digests(self):
+        """
+        Receives a digest and decodes all of its entries, the data plane batches learn data of the same digest.
+
+        :returns data: list of dicts, one per entry of the digest.
+        """
         digest = self.c.digest_get()
         try:
-            digest_name = self.digests[str(digest.digest_id)]
+            learn_filter = self.learn_filters[digest.digest_id]
         except KeyError:
-            raise ValueError("Digest ID is not known to SwitchController!")
-
-        # ! Names of Digest from data plane
-        # ! Will not work for different structs of digests!
-        learn_filter = self.bfrt_info.learn_get(digest_name)
-        data_list = learn_filter.make_data_list(digest)
-        data_dict = data_list[0].to_dict()
+            raise ValueError(f"Digest ID {digest.digest_id} is not known to SwitchController!")
 
-        return data_dict
+        entries = [d.to_dict() for d in learn_filter.make_data_list(digest)]
+        if self.digest_recorder:
+            self.digest_recorder.record(self.digests[str(digest.digest_id)], entries)
+        return entries
 
     def listen_for_digests(self):
         """
-        Continuously listens for digest messages and outputs them.
-        Triggers the handle_digest function, which permanently closes PSFP instances.
+        Continuously listens for digest messages and dispatches them to the workers of their digest type.
+        Hyperperiod digests are handled by handle_digest with priority, block digests are aggregated by digest_stats
+        and debug digests are output by print_digest.
         """
+        self.digest_dispatcher.start_workers()
+        self.digest_stats.start()
 
-        while True:
+        while not self.digest_dispatcher.exit_event.is_set():
             try:
-                digest = self.get_digest()
-
-                output = ""
-                for k, v in digest.items():
-                    if k == "PSFPGateEnabled":
-                        color = TerminalColor.GREEN.value if v == 1 else TerminalColor.RED.value
-                    elif k == "color":
-                        color = COLORS[digest['color']
-                                       ] if 'color' in digest else ""
-                    elif k == "drop_ctl":
-                        color = TerminalColor.RED.value if v == 1 else TerminalColor.GREEN.value
-                    else:
-                        color = TerminalColor.DEFAULT.value
-                    if k == "reason":
-                        v = DigestType(v).name
-                    output += f"{color}{k}: {v} {TerminalColor.DEFAULT.value}"
-
-                if "app_id" not in output:
-                    # Filters out hyperperiod packets from printing
-                    print(output)
-                    pass
-                logging.debug(output)
-                self.handle_digest(digest)
-            except RuntimeError as e:
-                # logging.error(e)
-                pass
+                digests = self.get_digests()
+            except RuntimeError:
+                # No digest within the timeout of digest_get
+                continue
+            except ValueError as e:
+                logging.error(e)
+                continue
+
+            self.digest_dispatcher.dispatch([self.digest_record(d) for d in digests])
+
+    def digest_record(self, digest_data: dict):
+        """
+        Returns the DigestRecord of a decoded digest, digests without a known reason get the digest type None.
+        """
+        try:
+            digest_type = DigestType(digest_data["reason"])
+        except (KeyError, ValueError):
+            digest_type = None
+        return DigestRecord(digest_type, digest_data, time.monotonic())
+
+    def handle_block_digest(self, record: DigestRecord):
+        """
+        Counts a digest of a blocked stream, gate or meter and prints it in debug mode.
+        """
+        self.digest_stats.add(record)
+        if self.print_digests:
+            self.print_digest(record)
+
+    def print_digest(self, record: DigestRecord):
+        """
+        Outputs a digest with colored fields.
+        """
+        digest = record.data
+        output = ""
+        for k, v in digest.items():
+            if k == "PSFPGateEnabled":
+                color = TerminalColor.GREEN.value if v == 1 else TerminalColor.RED.value
+            elif k == "color":
+                color = COLORS[digest['color']
+                               ] if 'color' in digest else ""
+            elif k == "drop_ctl":
+                color = TerminalColor.RED.value if v == 1 else TerminalColor.GREEN.value
+            else:
+                color = TerminalColor.DEFAULT.value
+            if k == "reason":
+                v = DigestType(v).name
+            output += f"{color}{k}: {v} {TerminalColor.DEFAULT.value}"
+
+        if "app_id" not in output:
+            # Filters out hyperperiod packets from printing
+            print(output)
+        logging.debug(output)
 
     def handle_digest(self, digest_data: dict):
         """
@@ -484,9 +619,8 @@ class Switch:
         Clock drift offset tables are initialized here as well. 
         """
 
-        # Mask to filter for large values (2^38, which is around 4.5 minutes)
-        #mask_max_underflow = 0b111111111100000000000000000000000000000000000000
-        mask_max_underflow = 0b111111111111111000000000000000000000000000000000
+        # Mask to filter for large values, i.e. above twice the longest hyperperiod (2^33 ns with the default quantization)
+        mask_max_underflow = TimeQuantization.underflow_mask()
         self.write_table_entry(table="egress.underflow_detection",
                                match_fields={"hdr.bridge.diff_ts": (0, mask_max_underflow, "t"),
                                              "$MATCH_PRIORITY": 0},
@@ -505,7 +639,8 @@ class Switch:
 
     def sync_counters(self, table_name: str, table_object: gc._Table = None):
         """
-        Perform a hardware sync operation on the switch table
+        Perform a hardware sync operation on the switch table.
+        Consumers of counters should use syncs.sync() instead, so syncs of the same table are coalesced.
 
         :param table_name: Name of the table to sync
         :param table_object: bfrt_info resolved table object with table_name (optional)
@@ -514,7 +649,12 @@ class Switch:
             tbl = self.bfrt_info.table_get(table_name)
         else:
             tbl = table_object
-        tbl.operations_execute(self.target, 'SyncCounters')
+
+        # Indirect counters are synced with Sync, direct counters of match action tables with SyncCounters
+        if '$COUNTER_INDEX' in self.encoder(table_name).key_match_types:
+            tbl.operations_execute(self.target, 'Sync')
+        else:
+            tbl.operations_execute(self.target, 'SyncCounters')
 
     def __del__(self):
         self.shutdown()
@@ -522,5 +662,7 @@ class Switch:
     def shutdown(self):
         logging.debug("Shutting down connection to {}".format(self.name))
         # self.pkt_gen.disable_pkt_gen()
+        if self.digest_recorder:
+            self.digest_recorder.close()
         self.thrift.end()
         self.c.channel.close()
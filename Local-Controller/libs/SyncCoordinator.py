@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class _SyncState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.synced_at = float("-inf")
+        self.window = None
+        self.syncs = 0
+        self.served = 0
+
+
+class SyncCoordinator:
+    """
+    Coalesces the hardware syncs of counter tables of all consumers of a switch.
+
+    Consumers declare how stale the counters of a table may be. A read first calls sync(), which only syncs the table
+    if the last sync is older than the allowed staleness, otherwise the read is served from the software shadow
+    of the last sync. A sync in progress is shared, consumers that arrive meanwhile wait for it instead of syncing again.
+    So there is at most one sync per table per window, independent of the number of consumers.
+    """
+
+    def __init__(self, switch):
+        self.s = switch
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def _state(self, table: str):
+        with self.lock:
+            return self.tables.setdefault(table, _SyncState())
+
+    def declare(self, table: str, max_staleness: float):
+        """
+        Declares that a consumer reads the counters of table and accepts values that are max_staleness seconds old.
+        The window of a table is the smallest staleness of all consumers, it is used by reads without a staleness.
+        """
+        state = self._state(table)
+        with state.lock:
+            state.window = max_staleness if state.window is None else min(state.window, max_staleness)
+
+    def sync(self, table: str, max_staleness: float = None, table_object=None):
+        """
+        Syncs the counters of table unless the last sync is at most max_staleness seconds old.
+
+        :param max_staleness: Allowed age of the synced values, the declared window of the table if None,
+                              tables without a declared window are always synced.
+        :param table_object: bfrt_info resolved table object of table (optional)
+
+        :returns synced_at: Monotonic time of the start of the sync the values are from.
+        """
+        state = self._state(table)
+        with state.lock:
+            if max_staleness is None:
+                max_staleness = state.window or 0
+
+            if time.monotonic() - state.synced_at <= max_staleness:
+                state.served += 1
+                return state.synced_at
+
+            # Values of the sync are at least as recent as its start
+            start = time.monotonic()
+            self.s.sync_counters(table, table_object)
+            state.synced_at = start
+            state.syncs += 1
+            return start
+
+    def stats(self):
+        """
+        :returns stats: dict of table name to (number of syncs, number of reads served without a sync)
+        """
+        with self.lock:
+            return {t: (s.syncs, s.served) for t, s in self.tables.items()}
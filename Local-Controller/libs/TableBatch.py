@@ -0,0 +1,126 @@
+import logging
+from libs.bfrt import gc
+
+
+class TableBatch:
+    """
+    Collects table operations and sends them with as few RPCs as possible.
+    Consecutive operations of the same type on the same table are grouped and
+    sent as one write request per chunk.
+    """
+
+    ADD = "add"
+    MOD = "mod"
+    DEL = "del"
+
+    # gRPC status code of an added entry that exists already
+    ALREADY_EXISTS = 6
+
+    def __init__(self, switch, chunk_size: int = 1000):
+        self.s = switch
+        self.chunk_size = chunk_size
+
+        # List of groups, each group is a dict with op, table, keys, data and entries
+        self.groups = []
+
+        # List of (entry, error) tuples of entries that could not be written
+        self.errors = []
+
+        self.rpc_count = 0
+        self.entry_count = 0
+
+    def add(self, op: str, table: str, key, data, entry: dict):
+        """
+        Queue an operation.
+
+        :param op: One of TableBatch.ADD, TableBatch.MOD, TableBatch.DEL
+        :param table: Name of the table
+        :param key: bfrt key object, None deletes all entries of the table
+        :param data: bfrt data object, None for deletes
+        :param entry: dict describing the entry, used for error reporting
+        """
+
+        # Only append to the latest group of this table, otherwise the order
+        # of operations on the same table would change
+        group = None
+        for g in reversed(self.groups):
+            if g["table"] == table:
+                group = g
+                break
+
+        if not group or group["op"] != op or key is None or group["keys"] is None:
+            group = {"op": op, "table": table, "keys": [], "data": [], "entries": []}
+            self.groups.append(group)
+
+        if key is None:
+            group["keys"] = None
+        else:
+            group["keys"].append(key)
+            group["data"].append(data)
+        group["entries"].append(entry)
+
+    @classmethod
+    def already_exists(cls, error):
+        """
+        Returns if the error of a failed add is caused by an entry that exists already, i.e. the entry is installed.
+        Errors of the SDE carry the gRPC status code, the mock backend only has the message.
+        """
+        return getattr(error, "canonical_code", None) == cls.ALREADY_EXISTS or "already exists" in str(error).lower()
+
+    def flush(self):
+        """
+        Send all queued operations.
+
+        :returns errors: list of (entry, error) tuples of entries that failed
+        """
+        groups = self.groups
+        self.groups = []
+        errors = []
+
+        for g in groups:
+            bfrt_table = self.s.bfrt_info.table_get(g["table"])
+
+            if g["keys"] is None:
+                errors += self._send(bfrt_table, g["op"], None, None, g["entries"])
+                continue
+
+            for i in range(0, len(g["keys"]), self.chunk_size):
+                errors += self._send(bfrt_table, g["op"],
+                                     g["keys"][i:i + self.chunk_size],
+                                     g["data"][i:i + self.chunk_size],
+                                     g["entries"][i:i + self.chunk_size])
+
+        if errors:
+            logging.warning(f"{len(errors)} of {sum(len(g['entries']) for g in groups)} batched table operations on {self.s.name} failed.")
+        for entry, e in errors:
+            logging.debug(f"Batch {entry['op']} on {entry['table']} failed for {entry['match_fields']}: {e}")
+
+        self.errors += errors
+        return errors
+
+    def _send(self, bfrt_table, op: str, keys, data, entries):
+        """
+        Sends one chunk of operations as a single write request.
+
+        :returns errors: list of (entry, error) tuples
+        """
+        self.rpc_count += 1
+        self.entry_count += len(entries)
+
+        try:
+            if op == self.ADD:
+                bfrt_table.entry_add(self.s.target, keys, data)
+            elif op == self.MOD:
+                bfrt_table.entry_mod(self.s.target, keys, data)
+            elif op == self.DEL:
+                bfrt_table.entry_del(self.s.target, keys)
+            else:
+                raise ValueError(f"Unknown batch operation {op}")
+        except gc.BfruntimeReadWriteRpcException as e:
+            sub_errors = e.sub_errors_get()
+            if not sub_errors:
+                # No details available, the whole chunk is considered as failed
+                return [(entry, e) for entry in entries]
+            return [(entries[idx], err) for idx, err in sub_errors if idx < len(entries)]
+
+        return []
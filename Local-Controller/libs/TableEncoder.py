@@ -0,0 +1,197 @@
+import socket
+from libs.bfrt import gc
+
+from libs import Helper
+
+
+def ipv4_to_int(value):
+    """
+    Converts an IPv4 address in dotted notation to an integer, integers are returned unchanged.
+    """
+    if isinstance(value, str):
+        return int.from_bytes(socket.inet_aton(value), "big")
+    return value
+
+
+def mac_to_int(value):
+    """
+    Converts a MAC address separated by : to an integer, integers are returned unchanged.
+    """
+    if isinstance(value, str):
+        return Helper.str_to_mac(value)
+    return value
+
+
+def no_conversion(value):
+    return value
+
+
+class TableEncoder:
+    """
+    Encodes match field and action parameter dicts of one table into bfrt key and data objects.
+    The builder of every key field is resolved once from the bfrt_info schema (match type and width),
+    so encoding an entry needs no table lookups, regular expressions or annotations.
+
+    Match field values are either scalars or tuples:
+        exact:   value
+        ternary: (value, mask[, "t"])
+        range:   (low, high[, "r"])
+        lpm:     (value, prefix_len[, "lpm"])
+    The optional third tuple element of the old interface is ignored, the match type is taken from the schema.
+    32 bit fields accept IPv4 strings and 48 bit fields accept MAC strings.
+    Fields with the value None are left out of the key, i.e. they are wildcarded.
+    """
+
+    def __init__(self, name: str, bfrt_table):
+        self.table = bfrt_table
+        self.name = name
+        # Number of entries, or indices of a counter or register
+        self.size = bfrt_table.info.size_get()
+
+        self.key_builders = {}
+        self.key_match_types = {}
+        self.key_sizes = {}
+        self.key_canonicalizers = {}
+        for field in bfrt_table.info.key_field_name_list_get():
+            match_type = bfrt_table.info.key_field_match_type_get(field).lower()
+            size = bfrt_table.info.key_field_size_get(field)
+            self.key_match_types[field] = match_type
+            self.key_sizes[field] = size
+            self.key_builders[field] = self._key_builder(field, match_type, size)
+            self.key_canonicalizers[field] = self._key_canonicalizer(match_type, size)
+
+        # Direct or indirect counter fields, independent of the action
+        try:
+            self.counter_fields = [f for f in bfrt_table.info.data_field_name_list_get() if f.startswith("$COUNTER_SPEC")]
+        except KeyError:
+            self.counter_fields = []
+
+    @staticmethod
+    def _converter(size):
+        if size == 32:
+            return ipv4_to_int
+        if size == 48:
+            return mac_to_int
+        return no_conversion
+
+    def _key_builder(self, field: str, match_type: str, size: int):
+        """
+        Returns a function that builds the KeyTuple of this field from a match value.
+        """
+        conv = self._converter(size)
+        full_mask = (1 << size) - 1 if size else 0
+
+        if match_type == "ternary":
+            def build(v):
+                if type(v) is tuple:
+                    return gc.KeyTuple(field, value=conv(v[0]), mask=conv(v[1]))
+                return gc.KeyTuple(field, value=conv(v), mask=full_mask)
+        elif match_type == "range":
+            def build(v):
+                if type(v) is tuple:
+                    return gc.KeyTuple(field, low=v[0], high=v[1])
+                return gc.KeyTuple(field, low=v, high=v)
+        elif match_type == "lpm":
+            def build(v):
+                if type(v) is tuple:
+                    return gc.KeyTuple(field, value=conv(v[0]), prefix_len=v[1])
+                return gc.KeyTuple(field, value=conv(v), prefix_len=size)
+        else:
+            def build(v):
+                return gc.KeyTuple(field, conv(v))
+
+        return build
+
+    def _key_canonicalizer(self, match_type: str, size: int):
+        """
+        Returns a function that normalizes a match value of this field to a hashable value.
+        Equal matches result in equal values, no matter if they were given as match value or read back from the switch.
+        """
+        conv = self._converter(size)
+        full_mask = (1 << size) - 1 if size else 0
+
+        if match_type == "ternary":
+            def canonical(v):
+                if v is None:
+                    return (0, 0)
+                value, mask = (conv(v[0]), conv(v[1])) if type(v) is tuple else (conv(v), full_mask)
+                return (value & mask, mask)
+        elif match_type == "range":
+            def canonical(v):
+                if v is None:
+                    return (0, full_mask)
+                return (v[0], v[1]) if type(v) is tuple else (v, v)
+        elif match_type == "lpm":
+            def canonical(v):
+                if v is None:
+                    return (0, 0)
+                value, prefix_len = (conv(v[0]), v[1]) if type(v) is tuple else (conv(v), size)
+                return (value >> (size - prefix_len) << (size - prefix_len), prefix_len)
+        else:
+            def canonical(v):
+                return 0 if v is None else int(conv(v))
+
+        return canonical
+
+    def canonical_key(self, match_fields: dict):
+        """
+        Returns a hashable representation of a key with one value per key field in schema order.
+        Fields missing in match_fields are treated like fields with the value None.
+
+        :param match_fields: dict, pairs of key:value in MAT.
+        """
+        return tuple(c(match_fields.get(f)) for f, c in self.key_canonicalizers.items())
+
+    @staticmethod
+    def key_from_dict(key_dict: dict):
+        """
+        Converts the dict of a key read from the switch (key.to_dict()) to match fields.
+
+        :param key_dict: dict, field name to dict with value/mask, low/high or value/prefix_len.
+        """
+        match_fields = {}
+        for f, v in key_dict.items():
+            if "mask" in v:
+                match_fields[f] = (v["value"], v["mask"])
+            elif "low" in v:
+                match_fields[f] = (v["low"], v["high"])
+            elif "prefix_len" in v:
+                match_fields[f] = (v["value"], v["prefix_len"])
+            else:
+                match_fields[f] = v["value"]
+        return match_fields
+
+    @staticmethod
+    def canonical_data(action_name: str, action_params: dict, ignore=()):
+        """
+        Returns a hashable representation of an action and its parameters.
+
+        :param action_name: str, name of the action.
+        :param action_params: dict, pairs of key:value in action definition.
+        :param ignore: Parameters that are not compared.
+        """
+        return (action_name, tuple(sorted((p, int(v) if isinstance(v, bool) else v)
+                                          for p, v in (action_params or {}).items() if p not in ignore)))
+
+    def make_key(self, match_fields: dict):
+        """
+        Builds a bfrt key object.
+
+        :param match_fields: dict, pairs of key:value in MAT.
+        """
+        try:
+            return self.table.make_key([self.key_builders[m](v) for m, v in match_fields.items() if v is not None])
+        except KeyError as e:
+            raise KeyError(f"Key field {e} does not exist in table {self.name}!")
+
+    def make_data(self, action_name: str = None, action_params: dict = None, get: bool = False):
+        """
+        Builds a bfrt data object.
+
+        :param action_name: str, name of the action to apply.
+        :param action_params: dict, pairs of key:value in action definition. Values are ignored if get is True.
+        :param get: True to build a data object that selects the fields to read.
+        """
+        if get:
+            return self.table.make_data([gc.DataTuple(p) for p in action_params or {}], action_name, get=True)
+        return self.table.make_data([gc.DataTuple(p, v) for p, v in (action_params or {}).items()], action_name)
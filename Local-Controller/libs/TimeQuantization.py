@@ -0,0 +1,133 @@
+"""
+Quantization of the 48-bit data plane timestamps to the keys of the time based range match tables.
+
+The tables match on bits [TS_SHIFT + TS_WIDTH - 1:TS_SHIFT] of a timestamp in ns. By default, these are bits [31:12],
+i.e. 20 bit with a resolution of 4096 ns and a longest hyperperiod of 2^32 ns.
+Both are compile time options of the P4 program, __TS_SHIFT__ and __TS_WIDTH__ in headers.p4,
+and are set for the loaded program with configure before any schedule is compiled.
+Every routine accepts Python integers as well as numpy integer arrays, e.g. all interval borders of a schedule.
+"""
+import logging
+
+import numpy as np
+
+TS_SHIFT = 12
+TS_WIDTH = 20
+TS_MASK = ((1 << TS_WIDTH) - 1) << TS_SHIFT
+# Highest quantized timestamp, the upper border of open ranges
+TS_MAX = (1 << TS_WIDTH) - 1
+
+TIMESTAMP_WIDTH = 48
+REGISTER_WIDTH = 32
+REGISTER_MASK = (1 << REGISTER_WIDTH) - 1
+
+
+def valid(shift: int, width: int):
+    """
+    Returns if the P4 program compiles with this quantization, see __TS_SHIFT__ and __TS_WIDTH__ in headers.p4.
+    The width is at most 31 as match_ts is padded to 32 bit, and the matched bits are copied from the lower 32 bit
+    of the relative position in the hyperperiod, so shift + width is at most 32.
+    """
+    return 0 < width < REGISTER_WIDTH and shift >= 0 and shift + width <= REGISTER_WIDTH
+
+
+def configure(shift: int, width: int):
+    """
+    Sets the quantization of the loaded P4 program, see __TS_SHIFT__ and __TS_WIDTH__ in headers.p4.
+
+    :param shift: Number of truncated lower bits, the resolution is 2^shift ns.
+    :param width: Width of the range match keys in bit, see valid.
+    """
+    global TS_SHIFT, TS_WIDTH, TS_MASK, TS_MAX
+
+    if not valid(shift, width):
+        raise ValueError(f"Invalid timestamp quantization {shift=}, {width=}, the width must be within 1 and 31 "
+                         f"and shift + width at most {REGISTER_WIDTH}!")
+
+    TS_SHIFT = shift
+    TS_WIDTH = width
+    TS_MASK = ((1 << TS_WIDTH) - 1) << TS_SHIFT
+    TS_MAX = (1 << TS_WIDTH) - 1
+    logging.info(f"Timestamps are quantized to bits [{key_slice()}], "
+                 f"a resolution of {resolution()} ns and hyperperiods of up to {max_duration()} ns.")
+
+
+def resolution():
+    """
+    Duration of one quantized timestamp unit in ns.
+    """
+    return 1 << TS_SHIFT
+
+
+def max_duration():
+    """
+    Longest duration in ns that can be quantized without wrapping around, i.e. the longest hyperperiod.
+    """
+    return 1 << (TS_SHIFT + TS_WIDTH)
+
+
+def key_slice():
+    """
+    Bit slice of a timestamp that is matched on, e.g. "31:12" for the field name of a sliced key.
+    """
+    return f"{TS_SHIFT + TS_WIDTH - 1}:{TS_SHIFT}"
+
+
+def underflow_mask():
+    """
+    Ternary mask of the bits of a 48-bit timestamp above twice the longest hyperperiod.
+    A relative position that matches 0 with this mask is valid, larger values result from an underflow.
+    """
+    return ((1 << TIMESTAMP_WIDTH) - 1) ^ ((max_duration() << 1) - 1)
+
+
+def _shift_and_mask(shift: int = None, width: int = None):
+    if shift is None and width is None:
+        return TS_SHIFT, TS_MASK
+    shift = TS_SHIFT if shift is None else shift
+    width = TS_WIDTH if width is None else width
+    return shift, ((1 << width) - 1) << shift
+
+
+def quantize(ts, shift: int = None, width: int = None):
+    """
+    Truncates a timestamp or duration in ns to the TS_WIDTH bit of a range match key.
+    shift and width override the configured quantization, e.g. to analyze a configuration offline.
+    """
+    shift, mask = _shift_and_mask(shift, width)
+    return (ts & mask) >> shift
+
+
+def quantize_upper(ts, border=1, shift: int = None, width: int = None):
+    """
+    Truncates the upper border of an interval to the TS_WIDTH bit of a range match key.
+    As the range match type is inclusive on both borders, the border is shifted by -border ns before the shift,
+    so that the interval does not overlap the next one that starts at ts.
+    """
+    shift, mask = _shift_and_mask(shift, width)
+    return ((ts & mask) - border) >> shift
+
+
+def quantize_intervals(lows, highs, shift: int = None, width: int = None):
+    """
+    Truncates the borders of consecutive intervals to range match keys.
+    The upper borders of all but the last interval are adjusted, see quantize_upper.
+
+    :param lows: Lower interval borders in ns.
+    :param highs: Upper interval borders in ns.
+
+    :returns (lows, highs): int64 numpy arrays of the range match keys.
+    """
+    lows = np.asarray(lows, dtype=np.int64)
+    highs = np.asarray(highs, dtype=np.int64)
+
+    border = np.ones(len(highs), dtype=np.int64)
+    border[-1:] = 0
+    return quantize(lows, shift, width), quantize_upper(highs, border, shift, width)
+
+
+def join_registers(higher, lower):
+    """
+    Composes a 48-bit timestamp from the 16-bit higher and 32-bit lower register that store it.
+    """
+    return (higher << REGISTER_WIDTH) | (lower & REGISTER_MASK)
@@ -0,0 +1,11 @@
+"""
+Resolves the bfrt_grpc client of the SDE.
+Without an SDE installation the API compatible client of the mock backend is used,
+which only allows hardware-free runs with Switch(mock=True).
+"""
+try:
+    import bfrt_grpc.client as gc
+    SDE_AVAILABLE = True
+except ImportError:
+    from libs.mock import client as gc
+    SDE_AVAILABLE = False
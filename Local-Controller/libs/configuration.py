@@ -1,10 +1,15 @@
 import json
+import logging
+
+from libs import TimeQuantization
+from libs.ScheduleAnalysis import ScheduleAnalysis
+from libs.Sampler import SampledTable
 from libs.instances.instances import FlowMeterInstance, StreamFilterInstance, StreamGateInstance, StreamID, Schedule
 
 
 class Config:
 
-    def __init__(self, config_file: str):
+    def __init__(self, config_file: str, validate: bool = True):
         self.config_file = config_file
         self.instances_streams = []
         self.instances_schedules = []
@@ -15,10 +20,21 @@ class Config:
 
         self.simulate = False
         self.simulation_duration = 4
-        self.simulation_json_file = "plots/data/data.json"
+        self.simulation_json_file = "plots/data/data.ndjson"
+
+        # Gates that use the same schedule share its intervals, requires the P4 program with __SHARED_SCHEDULES__
+        self.shared_schedules = False
+
+        # Quantization of the timestamps, see __TS_SHIFT__ and __TS_WIDTH__ in headers.p4 and TimeQuantization.
+        # The width is read from the P4 program if not set, the shift must match the program.
+        # The schedules are validated with the width of TimeQuantization, so a Config that is parsed before
+        # TimeQuantization is configured for the loaded program is validated afterwards, see validate_config.
+        self.ts_shift = TimeQuantization.TS_SHIFT
+        self.ts_width = None
 
         self.parse_config_params()
-        self.validate_config()
+        if validate:
+            self.validate_config()
 
     def parse_config_params(self):
         """
@@ -36,12 +52,25 @@ class Config:
         flow_meters = data["flow_meters"]
         schedule_port_mappings = data["schedule_to_port"]
 
+        self.shared_schedules = data.get("shared_schedules", False)
+        self.ts_shift = data.get("ts_shift", self.ts_shift)
+        self.ts_width = data.get("ts_width", self.ts_width)
+        # Without ts_width, the width of the P4 program is checked once it is read, see TimeQuantization.configure
+        assert TimeQuantization.valid(self.ts_shift, 1 if self.ts_width is None else self.ts_width), \
+            f"Invalid timestamp quantization ts_shift={self.ts_shift}, ts_width={self.ts_width}, the width must be " \
+            f"within 1 and 31 and ts_shift + ts_width at most {TimeQuantization.REGISTER_WIDTH}."
+
         self.simulate = simulation["enabled"]
         self.simulation_duration = simulation["duration"]
         self.simulation_json_file = simulation["json_file"]
         self.simulation_csv_file = simulation["csv_file"]
         self.monitor_flow_meter_id = simulation["monitor_flow_meter_id"]
         self.monitor_stream_gate_id = simulation["monitor_stream_gate_id"]
+        # Counters are sampled every sampling_interval seconds, at most sampling_capacity samples are kept
+        self.sampling_interval = simulation.get("sampling_interval", 0.05)
+        self.sampling_capacity = simulation.get("sampling_capacity", 10000)
+        assert 0 < self.sampling_interval <= SampledTable.max_interval(), \
+            f"sampling_interval must be within (0, {SampledTable.max_interval():.3f}]s, the byte counters wrap faster."
 
         for s in schedules:
             instance = Schedule(name=s["name"],
@@ -140,7 +169,10 @@ class Config:
             return result[0]
         raise AssertionError(f"Schedule {name=} is undefined!")
 
-    def validate_config(self):
+    def validate_config(self, schedules: bool = True):
+        """
+        :param schedules: Also check the schedules and hyperperiods, see ScheduleAnalysis.
+        """
         meter_ids = [m.flow_meter_id for m in self.instances_flow_meters]
         stream_handles = [s.stream_handle for s in self.instances_filters]
         gate_ids = [g.gate_id for g in self.instances_gates]
@@ -160,14 +192,20 @@ class Config:
         referenced_meters = [
             s.flow_meter.flow_meter_id for s in self.instances_filters]
 
-        # Assert that only one period is assigned to a port
-        ports = [p["port"] for p in self.schedule_port_mappings]
-
-        assert len(ports) == len(set(ports))
-
         for s in referenced_schedules:
             assert self.find_schedule_by_name(s) != None
         for g in referenced_gates:
             assert self.find_gate_instance_by_id(g) != None
         for m in referenced_meters:
             assert self.find_flow_meter_instance_by_id(m) != None
+
+        if not schedules:
+            return
+
+        # Assert that the schedules are valid and only one period is assigned to a port, see ScheduleAnalysis
+        issues = ScheduleAnalysis(self).check()
+        for i in issues:
+            if i.severity == ScheduleAnalysis.WARNING:
+                logging.warning(f"{i.subject}: {i.message}")
+        errors = [f"{i.subject}: {i.message}" for i in issues if i.severity == ScheduleAnalysis.ERROR]
+        assert not errors, " ".join(errors)
@@ -1,5 +1,6 @@
 import logging
 
+from libs import TimeQuantization
 from libs.Switch import Switch
 from typing import List
 from libs.instances.instances import FlowMeterInstance
@@ -15,44 +16,62 @@ class FlowMeterController(object):
         Configure flow meter instance and write the configured values for PIR, PBS, CIR and CBS into data plane.
         """
 
+        with self.s.batch():
+            for e in self.meter_entries():
+                self.s.write_table_entry(**e)
+
+        if not self.flow_meters:
+            return
+
+        self.adjust_byte_count()
+
+    def meter_entries(self):
+        """
+        Returns the entries of the flow meter config and the flow meter instance table.
+
+        :returns entries: list of dicts with the keys table, match_fields, action_name and action_params.
+        """
+        entries = []
         for f in self.flow_meters:
-            # Write flow meter config flags
-            self.s.write_table_entry(table="ingress.psfp_c.flowMeter_c.flow_meter_config",
-                              match_fields={
-                                  "ig_md.stream_filter.flow_meter_instance_id": f.flow_meter_id},
-                              action_name="ingress.psfp_c.flowMeter_c.set_flow_meter_config",
-                              action_params={"dropOnYellow": f.dropOnYellow,
-                                             "markAllFramesRedEnable": f.markAllFramesRedEnable,
-                                             "colorAware": f.colorAware}
-                              )
+            # Flow meter config flags
+            entries.append(dict(table="ingress.psfp_c.flowMeter_c.flow_meter_config",
+                                match_fields={
+                                    "ig_md.stream_filter.flow_meter_instance_id": f.flow_meter_id},
+                                action_name="ingress.psfp_c.flowMeter_c.set_flow_meter_config",
+                                action_params={"dropOnYellow": f.dropOnYellow,
+                                               "markAllFramesRedEnable": f.markAllFramesRedEnable,
+                                               "colorAware": f.colorAware}
+                                ))
 
-            # Write rates
-            self.s.write_table_entry(table="ingress.psfp_c.flowMeter_c.flow_meter_instance",
-                              match_fields={
-                                  "ig_md.stream_filter.flow_meter_instance_id": f.flow_meter_id},
-                              action_name=f"ingress.psfp_c.flowMeter_c.set_color_direct",
-                              action_params={"$METER_SPEC_CIR_KBPS": f.cir_kbps,
-                                             "$METER_SPEC_PIR_KBPS": f.pir_kbps,
-                                             "$METER_SPEC_CBS_KBITS": f.cbs,
-                                             "$METER_SPEC_PBS_KBITS": f.pbs}
-                              )
+            # Rates
+            entries.append(dict(table="ingress.psfp_c.flowMeter_c.flow_meter_instance",
+                                match_fields={
+                                    "ig_md.stream_filter.flow_meter_instance_id": f.flow_meter_id},
+                                action_name=f"ingress.psfp_c.flowMeter_c.set_color_direct",
+                                action_params={"$METER_SPEC_CIR_KBPS": f.cir_kbps,
+                                               "$METER_SPEC_PIR_KBPS": f.pir_kbps,
+                                               "$METER_SPEC_CBS_KBITS": f.cbs,
+                                               "$METER_SPEC_PBS_KBITS": f.pbs}
+                                ))
+        return entries
 
-            # Subtract recirculation header size from flow meter byte count
-            meter_table = self.s.bfrt_info.table_get(
-                "ingress.psfp_c.flowMeter_c.flow_meter_instance")
-            meter_table.attribute_meter_bytecount_adjust_set(
-                self.s.target, self.FLOW_METER_ADJUST_RECIRCULATION)
-            resp = meter_table.attribute_get(
-                self.s.target, "MeterByteCountAdjust")
-            for d in resp:
-                assert d["byte_count_adjust"] == self.FLOW_METER_ADJUST_RECIRCULATION
-            logging.info("FlowMeter Byte count adjusted.")
+    def adjust_byte_count(self):
+        """
+        Subtract recirculation header size from flow meter byte count
+        """
+        meter_table = self.s.bfrt_info.table_get(
+            "ingress.psfp_c.flowMeter_c.flow_meter_instance")
+        meter_table.attribute_meter_bytecount_adjust_set(
+            self.s.target, self.FLOW_METER_ADJUST_RECIRCULATION)
+        resp = meter_table.attribute_get(
+            self.s.target, "MeterByteCountAdjust")
+        for d in resp:
+            assert d["byte_count_adjust"] == self.FLOW_METER_ADJUST_RECIRCULATION
+        logging.info("FlowMeter Byte count adjusted.")
 
     def eval_p4tg_meter_config(self, start_ts):
-        duration = int(bin(2000000 & 0b11111111111111111111000000000000)[
-                       2:].zfill(48), 2) >> 12
-        start_ts = int(bin(start_ts & 0b11111111111111111111000000000000)[
-                       2:].zfill(48), 2) >> 12
+        duration = TimeQuantization.quantize(2000000)
+        start_ts = TimeQuantization.quantize(start_ts)
         start_drop_yellow = start_ts + duration
 
         self.start_red = start_drop_yellow + duration + 1
@@ -72,7 +91,7 @@ class FlowMeterController(object):
             # MarkRed
             self.s.write_table_entry(table="ingress.psfp_c.flowMeter_c.flow_meter_config",
                               match_fields={"ig_md.stream_filter.flow_meter_instance_id": 400,
-                                            "hdr.recirc_time.orig_ts": (self.start_red, 1048575, "r")},
+                                            "hdr.recirc_time.orig_ts": (self.start_red, TimeQuantization.TS_MAX, "r")},
                               action_name="ingress.psfp_c.flowMeter_c.set_flow_meter_config",
                               action_params={"dropOnYellow": True,
                                              "markAllFramesRed": True,
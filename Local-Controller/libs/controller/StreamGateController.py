@@ -1,66 +1,377 @@
-import bfrt_grpc.client as gc
+from libs.bfrt import gc
 import logging
+import threading
 
 from libs.configuration import Config
+from libs import TimeQuantization
+from libs.ScheduleCompiler import ScheduleCompiler
 from libs.Switch import Switch
+from libs.TableBatch import TableBatch
 from typing import List
 from libs.instances.instances import StreamGateInstance
 
 
 class StreamGateController(object):
 
-    def __init__(self, switch: Switch, gates: List[StreamGateInstance], config: Config):
+    GATE_TABLE = "ingress.psfp_c.streamGate_c.stream_gate_instance"
+    SLOT_TABLE = "ingress.psfp_c.streamGate_c.stream_gate_slot"
+    SCHEDULE_TABLE = "ingress.psfp_c.streamGate_c.stream_gate_schedule"
+    GATE_ID_FIELD = "ig_md.stream_filter.stream_gate_id"
+    SCHEDULE_ID_FIELD = "ig_md.stream_gate.schedule_id"
+    SLOT_FIELD = "ig_md.stream_gate.slot"
+    TS_FIELD = "hdr.recirc_time.match_ts"
+    # Register of the octets of an interval, indexed by the interval_identifier
+    OCTETS_REGISTER = "ingress.psfp_c.streamGate_c.octets_per_interval"
+
+    def __init__(self, switch: Switch, gates: List[StreamGateInstance], config: Config, reset_registers: bool = True):
         self.s = switch
         self.gates = gates
         self.config = config
 
-        self.s.reset_register(
-            register_name="ingress.psfp_c.streamGate_c.reg_gate_blocked")
+        # With a P4 program compiled with __SHARED_SCHEDULES__, gates are mapped to schedule IDs and the intervals
+        # of a schedule are shared by all its gates. The key of the stream gate instance table depends on it,
+        # so the mode of the program is used.
+        self.shared_schedules = self.s.has_table(self.SCHEDULE_TABLE)
+        if self.shared_schedules != config.shared_schedules:
+            logging.warning(f"Configuration sets shared_schedules={config.shared_schedules}, but the P4 program on "
+                            f"Switch {self.s.name} {'uses' if self.shared_schedules else 'does not support'} "
+                            f"shared schedules, see __SHARED_SCHEDULES__. Following the P4 program.")
+
+        # (schedule name, gate id of a private schedule or None) to schedule ID, see schedule_id
+        self.schedule_ids = {}
+        self.max_schedule_id = None
+        if self.shared_schedules:
+            self.max_schedule_id = (1 << self.s.encoder(self.GATE_TABLE).key_sizes[self.SCHEDULE_ID_FIELD]) - 1
+
+        # With a P4 program compiled with __GATE_SLOTS__, schedules can be installed as exact matches on time slots.
+        # The slot index are the upper bits of match_ts, its width gives the slot size.
+        # Gate id, or schedule ID with shared schedules, to the slot entries its schedule uses, see slots_in_use.
+        self.slot_shift = None
+        self.slot_capacity = None
+        self.slot_usage = {}
+        if self.s.has_table(self.SLOT_TABLE):
+            self.slot_shift = TimeQuantization.TS_WIDTH - self.s.encoder(self.SLOT_TABLE).key_sizes[self.SLOT_FIELD]
+            self.slot_capacity = self.s.encoder(self.SLOT_TABLE).size
+
+        # Closed gates stay closed on a warm start
+        if reset_registers:
+            self.s.reset_register(
+                register_name="ingress.psfp_c.streamGate_c.reg_gate_blocked")
 
         # Each interval has a unique identifier to filter for the OctetsExceeded parameter.
+        # Identifiers of deleted intervals are reused, the registers of the intervals limit them.
+        # Identifier 0 is the default of frames outside of all intervals.
         self.interval_count = 0
+        self.free_interval_identifiers = []
+        # Canonical key of an installed interval entry to its identifier
+        self.interval_identifiers = {}
+        self.max_interval_identifier = self.s.encoder(self.OCTETS_REGISTER).size - 1
+
+        # Schedules are written by the digest thread and changed by configuration reloads
+        self.lock = threading.RLock()
+
+        # Schedules are compiled to as few TCAM entries as possible, the stats of the last compilation per gate id
+        self.compiler = ScheduleCompiler()
+        self.compile_stats = {}
+        # Gate id to the mode its schedule is installed in, ScheduleCompiler.RANGE or SLOT, and the number of slots
+        self.schedule_modes = {}
 
     def write_schedule(self, app_id):
         """
-        Creates one table entry per interval from created schedule associated with its gate state.
+        Creates one table entry per interval of the compiled schedule associated with its gate state, see compile_schedule.
         An IPV value of 8 indicates that the frame's PCP will be kept!
         """
 
         pkt_gen_obj = self.s.pkt_gen.app_id_mapping[app_id]
         port = pkt_gen_obj["port"]
 
-        for m in self.config.schedule_port_mappings:
-            if m["port"] == port:
-                schedule_name = m["schedule"]
-                break
+        schedule_name = self.schedule_name_of_port(port)
 
         if not schedule_name:
             logging.critical(f"Schedule {app_id=} on {port=} not found in config!")
             return
 
-        for g in self.gates:
-            # Only write schedules that fit to this configured port
-            if g.schedule.name == schedule_name:
+        with self.lock:
+            gates = [g for g in self.gates if g.schedule.name == schedule_name and not g.schedule_written]
+            entries = self.schedule_entries(gates)
+
+            # Shared schedules of other ports, or of gates that were written before, are already installed
+            written = {self.schedule_id(g) for g in self.gates if g.schedule_written} if self.shared_schedules else set()
+            entries = [e for e in entries if e["match_fields"].get(self.SCHEDULE_ID_FIELD) not in written]
+
+            intervals = [e for e in entries if e["table"] == self.GATE_TABLE]
+            if len(intervals) > self.available_interval_identifiers():
+                logging.error(f"Schedule {schedule_name} on {port=} needs {len(intervals)} interval identifiers, "
+                              f"only {self.available_interval_identifiers()} are left. Schedule not written!")
+                return
+            for e in intervals:
+                self.assign_interval_identifier(e)
+
+            # All intervals of all gates on this port are written at once, the intervals before the gates that use them.
+            # (field, value) of the gate ids or schedule IDs with entries that could not be written, and these entries
+            failed = set()
+            unwritten = set()
+            for table in (self.GATE_TABLE, self.SLOT_TABLE, self.SCHEDULE_TABLE):
+                table_entries = [e for e in entries if e["table"] == table
+                                 and (self.SCHEDULE_ID_FIELD, e["action_params"].get("schedule_id")) not in failed]
+                if not table_entries:
+                    continue
+                errors = self.s.write_table_entries(table=table, entries=table_entries)
+                failures = [(e, err) for e, err in errors if not TableBatch.already_exists(err)]
+
+                for field, name in ((self.GATE_ID_FIELD, "gate_id"), (self.SCHEDULE_ID_FIELD, "schedule_id")):
+                    for i in sorted({e["match_fields"][field] for e, err in errors
+                                     if field in e["match_fields"] and TableBatch.already_exists(err)}):
+                        logging.warning(f"Schedule for {name}={i} already exists!")
+                    failed |= {(field, e["match_fields"][field]) for e, _ in failures if field in e["match_fields"]}
+                unwritten |= {id(e["match_fields"]) for e, _ in failures}
+
+                if failures:
+                    logging.error(f"{len(failures)} of {len(table_entries)} entries of {table} could not be written: "
+                                  f"{failures[0][1]}")
+
+            if failed:
+                self.remove_failed_schedules([e for e in entries if id(e["match_fields"]) not in unwritten], failed)
+                for e in intervals:
+                    if any((f, v) in failed for f, v in e["match_fields"].items()):
+                        self.release_interval_identifier(e)
+
+            for g in gates:
+                g.schedule_written = not self.schedule_failed(g, failed)
                 if not g.schedule_written:
-                    intervals = g.schedule.create_schedule()
+                    logging.error(f"Schedule {g.schedule.name} of gate_id={g.gate_id} could not be installed!")
 
-                    for s in intervals:
-                        try:
-                            self.interval_count += 1
-                            self.s.write_table_entry(table="ingress.psfp_c.streamGate_c.stream_gate_instance",
-                                            match_fields={"ig_md.stream_filter.stream_gate_id": g.gate_id,
-                                                            "hdr.recirc_time.match_ts": (s["low"], s["high"], "r")},
-                                            action_name="ingress.psfp_c.streamGate_c.set_gate_and_ipv",
-                                            action_params={"gate_state": s["state"],
-                                                            "ipv": s["ipv"],
-                                                            "interval_identifier": self.interval_count,
-                                                            "max_octects_interval": s["octets"]}
-                                            )
-                        except gc.BfruntimeReadWriteRpcException:
-                            logging.warn(
-                                f"Schedule for {g.gate_id=} already exists!")
-                        
-                    g.schedule_written = True
+            for name, (stats, slots) in self.compile_stats_of(gates).items():
+                self.compiler.log_stats(name, stats, slots)
+
+    def schedule_failed(self, gate: StreamGateInstance, failed: set):
+        """
+        Returns if the intervals of the gate, or the mapping of the gate to its schedule ID, could not be written.
+
+        :param failed: set of (field, value) of the gate ids or schedule IDs of entries that could not be written.
+        """
+        if (self.GATE_ID_FIELD, gate.gate_id) in failed:
+            return True
+        return self.shared_schedules and (self.SCHEDULE_ID_FIELD, self.schedule_id(gate)) in failed
+
+    def remove_failed_schedules(self, entries: list, failed: set):
+        """
+        Removes the written interval entries of schedules that could not be written completely,
+        so that no gate matches a part of its schedule.
+
+        :param entries: Written entries, see schedule_entries.
+        :param failed: set of (field, value) of the gate ids or schedule IDs of entries that could not be written.
+        """
+        with self.s.batch():
+            for e in entries:
+                if e["table"] == self.SCHEDULE_TABLE:
+                    continue
+                if any((f, v) in failed for f, v in e["match_fields"].items()):
+                    self.s.remove_table_entry(table=e["table"], match_fields=e["match_fields"])
+
+        owner_field = self.SCHEDULE_ID_FIELD if self.shared_schedules else self.GATE_ID_FIELD
+        for field, value in failed:
+            if field == owner_field:
+                self.slot_usage.pop(value, None)
+
+    def schedule_name_of_port(self, port):
+        """
+        Returns the name of the schedule that is configured for port or None.
+        """
+        for m in self.config.schedule_port_mappings:
+            if m["port"] == port:
+                return m["schedule"]
+        return None
+
+    def ready_schedules(self):
+        """
+        Returns the names of all schedules whose port finished its first hyperperiod.
+        Only schedules of those ports are installed in the data plane.
+        """
+        return {self.schedule_name_of_port(a["port"]) for a in self.s.pkt_gen.app_id_mapping.values()
+                if a["port"] is not None and a["hyperperiod_done"]} - {None}
+
+    def schedule_entries(self, gates: List[StreamGateInstance]):
+        """
+        Returns the interval entries of the stream gate instance table for the given gates.
+        With shared schedules, the intervals of every schedule ID are included once,
+        followed by the entries of the stream gate schedule table that map the gates to their schedule ID.
+        The interval_identifier is not set, see assign_interval_identifier.
+
+        :returns entries: list of dicts with the keys table, match_fields, action_name and action_params.
+        """
+        if not self.shared_schedules:
+            return [e for g in gates for e in self.gate_interval_entries(g)]
+
+        intervals = {}
+        mappings = []
+        for g in gates:
+            schedule_id = self.schedule_id(g)
+            if schedule_id not in intervals:
+                intervals[schedule_id] = self.gate_interval_entries(g)
+            mappings.append({"table": self.SCHEDULE_TABLE,
+                             "match_fields": {self.GATE_ID_FIELD: g.gate_id},
+                             "action_name": "ingress.psfp_c.streamGate_c.set_schedule_id",
+                             "action_params": {"schedule_id": schedule_id}})
+
+        return [e for entries in intervals.values() for e in entries] + mappings
+
+    def gate_interval_entries(self, gate: StreamGateInstance):
+        """
+        Returns the interval entries of the stream gate instance or slot table that frames of a gate match.
+        With shared schedules, they are shared with all gates of the same schedule ID.
+        """
+        if self.shared_schedules:
+            owner = self.schedule_id(gate)
+            key = {self.SCHEDULE_ID_FIELD: owner}
+        else:
+            owner = gate.gate_id
+            key = {self.GATE_ID_FIELD: owner}
+
+        schedule = self.compile_schedule(gate)
+
+        # The octets of GateClosedDueToOctetsExceeded are accounted per interval identifier, slots keep none
+        slot_count = None
+        if self.slot_shift is not None and not gate.gate_closed_due_to_octets_exceeded_enable:
+            slot_count = self.compiler.slot_count(schedule, self.slot_shift)
+        free_slots = self.slot_capacity - self.slots_in_use(exclude=owner) if slot_count is not None else None
+        mode = self.compiler.choose_mode(self.compile_stats[gate.gate_id].tcam_after, slot_count, free_slots)
+        self.schedule_modes[gate.gate_id] = (mode, slot_count)
+        if mode == ScheduleCompiler.SLOT:
+            self.slot_usage[owner] = slot_count
+        else:
+            self.slot_usage.pop(owner, None)
+
+        if mode == ScheduleCompiler.SLOT:
+            return [{"table": self.SLOT_TABLE,
+                     "match_fields": {**key, self.SLOT_FIELD: i},
+                     "action_name": "ingress.psfp_c.streamGate_c.set_gate_and_ipv_slot",
+                     "action_params": {"gate_state": s["state"],
+                                       "ipv": s["ipv"],
+                                       "interval_identifier": 0,
+                                       "max_octects_interval": s["octets"]}
+                     } for i, s in self.compiler.slot_schedule(schedule, self.slot_shift)]
+
+        return [{"table": self.GATE_TABLE,
+                 "match_fields": {**key, self.TS_FIELD: (s["low"], s["high"], "r")},
+                 "action_name": "ingress.psfp_c.streamGate_c.set_gate_and_ipv",
+                 "action_params": {"gate_state": s["state"],
+                                   "ipv": s["ipv"],
+                                   "max_octects_interval": s["octets"]}
+                 } for s in schedule]
+
+    def slots_in_use(self, exclude=None):
+        """
+        Returns the number of slot entries of all schedules in slot mode, see gate_interval_entries.
+
+        :param exclude: Gate id, or schedule ID with shared schedules, whose slots are not counted.
+        """
+        return sum(n for owner, n in self.slot_usage.items() if owner != exclude)
+
+    def schedule_id(self, gate: StreamGateInstance):
+        """
+        Returns the schedule ID of a gate, a new one is assigned to schedules without an ID.
+        The octets of GateClosedDueToOctetsExceeded are accounted per interval entry,
+        so gates with it get a schedule ID of their own.
+        Raises ValueError if all schedule IDs of the schedule_id key are assigned.
+        """
+        key = (gate.schedule.name, gate.gate_id if gate.gate_closed_due_to_octets_exceeded_enable else None)
+        schedule_id = self.schedule_ids.get(key)
+        if schedule_id is None:
+            # Schedule ID 0 is the default of gates without a schedule
+            used = set(self.schedule_ids.values())
+            schedule_id = next(i for i in range(1, len(used) + 2) if i not in used)
+            if schedule_id > self.max_schedule_id:
+                raise ValueError(f"No schedule ID left for schedule {gate.schedule.name} of gate {gate.gate_id}, "
+                                 f"all {self.max_schedule_id} IDs of {self.SCHEDULE_ID_FIELD} are assigned.")
+            self.schedule_ids[key] = schedule_id
+        return schedule_id
+
+    def restore_schedule_ids(self, gate_schedule_ids: dict):
+        """
+        Adopts the schedule IDs of the installed gates, e.g. on a warm start, so that unchanged schedules are kept.
+
+        :param gate_schedule_ids: dict, gate id to installed schedule ID.
+        """
+        for g in self.gates:
+            schedule_id = gate_schedule_ids.get(g.gate_id)
+            key = (g.schedule.name, g.gate_id if g.gate_closed_due_to_octets_exceeded_enable else None)
+            if schedule_id is not None and key not in self.schedule_ids and schedule_id not in self.schedule_ids.values():
+                self.schedule_ids[key] = schedule_id
+
+    def compile_schedule(self, gate: StreamGateInstance):
+        """
+        Compiles the schedule of a gate to its interval entries, see ScheduleCompiler.
+
+        :returns schedule: list of intervals in the format of Schedule.create_schedule
+        """
+        schedule, stats = self.compiler.compile(gate.schedule.intervals,
+                                                gate.gate_closed_due_to_octets_exceeded_enable)
+        self.compile_stats[gate.gate_id] = stats
+        return schedule
+
+    def compile_stats_of(self, gates: List[StreamGateInstance]):
+        """
+        Returns the stats of the last compilation of the schedules of gates, once per schedule ID with shared schedules.
+
+        :returns stats: dict, description of the schedule to (ScheduleCompileStats, number of slots or None in range mode).
+        """
+        by_id = {}
+        for g in gates:
+            by_id.setdefault(self.schedule_id(g) if self.shared_schedules else None, []).append(g)
+
+        stats = {}
+        for i, gs in by_id.items():
+            for g in (gs if i is None else gs[:1]):
+                name = f"{g.schedule.name} of gate {g.gate_id}" if i is None else \
+                    f"{g.schedule.name} with ID {i} of gates {[g.gate_id for g in gs]}"
+                mode, slot_count = self.schedule_modes[g.gate_id]
+                stats[name] = (self.compile_stats[g.gate_id], slot_count if mode == ScheduleCompiler.SLOT else None)
+        return stats
+
+    def assign_interval_identifier(self, entry: dict):
+        """
+        Sets a unique interval_identifier in the action parameters of an interval entry of the stream gate instance
+        table. A modified interval keeps its identifier, new intervals get the identifier of a deleted one or a new one.
+        Raises ValueError if all identifiers are in use, see available_interval_identifiers.
+        """
+        key = self.s.encoder(self.GATE_TABLE).canonical_key(entry["match_fields"])
+        identifier = self.interval_identifiers.get(key)
+        if identifier is None:
+            if self.free_interval_identifiers:
+                identifier = self.free_interval_identifiers.pop()
+            elif self.interval_count < self.max_interval_identifier:
+                self.interval_count += 1
+                identifier = self.interval_count
+            else:
+                raise ValueError(f"All {self.max_interval_identifier} interval identifiers are in use!")
+            self.interval_identifiers[key] = identifier
+        entry["action_params"]["interval_identifier"] = identifier
+
+    def release_interval_identifier(self, entry: dict):
+        """
+        Frees the interval_identifier of a deleted interval entry of the stream gate instance table.
+        """
+        identifier = self.interval_identifiers.pop(self.s.encoder(self.GATE_TABLE).canonical_key(entry["match_fields"]), None)
+        if identifier is not None:
+            self.free_interval_identifiers.append(identifier)
+
+    def available_interval_identifiers(self):
+        """
+        Returns the number of interval identifiers that are not used by an installed interval.
+        """
+        return self.max_interval_identifier - len(self.interval_identifiers)
+
+    def restore_interval_identifiers(self, installed: dict):
+        """
+        Adopts the interval identifiers of the installed intervals, e.g. on a warm start.
+
+        :param installed: dict, canonical key to interval entry of the stream gate instance table.
+        """
+        self.interval_identifiers = {k: e["action_params"].get("interval_identifier", 0) for k, e in installed.items()}
+        self.interval_count = max(self.interval_identifiers.values(), default=0)
+        used = set(self.interval_identifiers.values())
+        self.free_interval_identifiers = [i for i in range(self.interval_count, 0, -1) if i not in used]
 
     def eval_write_schedules(self, first_period_ts):
         # Only used for evaluation!
@@ -68,11 +379,9 @@ class StreamGateController(object):
 
         for g in self.gates:
             if g.gate_id == 4:
-                waiting = int(bin(800000000 & 0b11111111111111111111000000000000)[
-                              2:].zfill(48), 2) >> 12
+                waiting = TimeQuantization.quantize(800000000)
 
-                first_period_ts = int(bin(first_period_ts & 0b11111111111111111111000000000000)[
-                                      2:].zfill(48), 2) >> 12
+                first_period_ts = TimeQuantization.quantize(first_period_ts)
 
                 start = first_period_ts  # + waiting
 
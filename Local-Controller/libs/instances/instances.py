@@ -1,11 +1,13 @@
 from libs import Helper
+from libs import TimeQuantization
 import logging
 
+import numpy as np
+
 
 class Schedule(object):
 
     def __init__(self, name: str, intervals: list, period: int, time_shift: int):
-        self.truncation_mask = 0b11111111111111111111000000000000
         self.name = name
         self.intervals = intervals
         self.period = period
@@ -14,6 +16,13 @@ class Schedule(object):
         self.shifted_intervals = None
         self.truncated_schedule = None
 
+    @property
+    def truncation_mask(self):
+        """
+        Mask of the timestamp bits that are matched on, see TimeQuantization.configure.
+        """
+        return TimeQuantization.TS_MASK
+
     def shift_schedule(self):
         """
         Shifts a schedule by an offset. The schedule will be shifted to the left.
@@ -51,27 +60,18 @@ class Schedule(object):
 
     def truncate_schedule(self, intervals):
         """
-        Truncate the time slices (intervals) of this schedule to 20 bit.
+        Truncate the time slices (intervals) of this schedule to the TS_WIDTH bit of the range match keys.
         """
 
-        schedule = []
-
-        for idx, d in enumerate(intervals):
-
-            # As the range match type is inclusive on both interval borders,
-            # we shift the upper border by -1
-            # We do not need to shift if there is only a single interval or if it is the last one
-            interval_border = 0 if idx == len(intervals) - 1 else 1
-
-            # Apply 20 Bit mask to interval border.
-            # Fill to 48 Bit and shift 12 bit to have only the valid 20 bit, rest will be 0
-            s = {"low": int(bin(d["low"] & self.truncation_mask)[2:].zfill(48), 2) >> 12,
-                 "high": (int(bin(d["high"] & self.truncation_mask)[2:].zfill(48), 2) - interval_border) >> 12,
-                 "state": d["state"], "ipv": d["ipv"], "octets": d["octets"]}
-
-            schedule.append(s)
+        # Apply the truncation mask to the interval borders and shift by TS_SHIFT bit to have only the valid bits.
+        # As the range match type is inclusive on both interval borders, the upper border is shifted by -1,
+        # except for the last interval.
+        lows, highs = TimeQuantization.quantize_intervals(
+            np.fromiter((d["low"] for d in intervals), dtype=np.int64, count=len(intervals)),
+            np.fromiter((d["high"] for d in intervals), dtype=np.int64, count=len(intervals)))
 
-        return schedule
+        return [{"low": l, "high": h, "state": d["state"], "ipv": d["ipv"], "octets": d["octets"]}
+                for d, l, h in zip(intervals, lows.tolist(), highs.tolist())]
 
     def create_schedule(self):
         """
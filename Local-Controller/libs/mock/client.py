@@ -0,0 +1,608 @@
+"""
+In-memory stand-in for the bfrt_grpc client of the SDE.
+
+It mirrors the subset of the bfrt_grpc.client API used by the controller (KeyTuple, DataTuple, Target,
+ClientInterface, table objects with entry_add/mod/del/get, learn objects and digests) and models the tables,
+registers, counters, meters, digests and packet generator tables of the sdn-psfp program, see schema.py.
+Every call that would be an RPC on the real switch is counted and can be delayed by an injected latency.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from libs.mock import schema
+from libs.mock.pktgen import TimerApp
+
+try:
+    from bfrt_grpc.client import BfruntimeReadWriteRpcException as _RpcExceptionBase
+except ImportError:
+    _RpcExceptionBase = Exception
+
+
+KeyTuple = namedtuple("KeyTuple", ["name", "value", "mask", "prefix_len", "low", "high"],
+                      defaults=[None, None, None, None, None])
+
+DataTuple = namedtuple("DataTuple", ["name", "val", "float_val", "str_val", "int_arr_val", "bool_arr_val",
+                                     "bool_val", "str_arr_val", "container_arr_val"],
+                       defaults=[None, None, None, None, None, None, None, None])
+
+
+class Target:
+    def __init__(self, device_id: int = 0, pipe_id: int = 0xffff, direction: int = 0xff, prsr_id: int = 0xff):
+        self.device_id = device_id
+        self.pipe_id = pipe_id
+        self.direction = direction
+        self.prsr_id = prsr_id
+
+
+class BfruntimeReadWriteRpcException(_RpcExceptionBase):
+    """
+    Raised by table operations of the mock backend.
+    Derives from the SDE exception if it is installed, so existing except clauses keep working.
+    """
+
+    def __init__(self, message: str, sub_errors: list = None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.sub_errors = sub_errors or []
+
+    def sub_errors_get(self):
+        return self.sub_errors
+
+    def __str__(self):
+        return self.message
+
+
+def _to_int(v):
+    if isinstance(v, (bytes, bytearray)):
+        return int.from_bytes(v, "big")
+    if v is None:
+        return 0
+    return int(v)
+
+
+def _data_value(d):
+    for v in (d.val, d.bool_val, d.float_val, d.str_val, d.int_arr_val, d.bool_arr_val, d.str_arr_val):
+        if v is not None:
+            return v
+    return None
+
+
+class _Key:
+    def __init__(self, table, fields: dict):
+        self.table = table
+        self.fields = fields
+
+    def canonical(self):
+        """
+        Hashable representation of the key in schema order.
+        """
+        return tuple(self.table.canonical_field(name, match_type, size, self.fields.get(name))
+                     for name, match_type, size in self.table.keys)
+
+    def to_dict(self):
+        return self.table.key_dict(self.canonical())
+
+
+class _Data:
+    def __init__(self, action_name, fields: dict):
+        self.action_name = action_name
+        self.fields = fields
+
+    def to_dict(self):
+        d = dict(self.fields)
+        if self.action_name:
+            d["action_name"] = self.action_name
+        return d
+
+
+class _TableInfo:
+    def __init__(self, table):
+        self.table = table
+
+    def name_get(self):
+        return self.table.name
+
+    def size_get(self):
+        return self.table.size
+
+    def key_field_name_list_get(self):
+        return [k[0] for k in self.table.keys]
+
+    def key_field_match_type_get(self, field_name):
+        return self._key_field(field_name)[1]
+
+    def key_field_size_get(self, field_name):
+        return self._key_field(field_name)[2]
+
+    def key_field_annotation_add(self, field_name, annotation):
+        self._key_field(field_name)
+
+    def action_name_list_get(self):
+        return [a for a in self.table.actions if a]
+
+    def data_field_name_list_get(self, action_name=None):
+        if action_name is None:
+            # Data fields that do not belong to an action
+            fields = [p[0] for p in self.table.actions.get(None, [])]
+            if self.table.counter:
+                fields += ["$COUNTER_SPEC_BYTES", "$COUNTER_SPEC_PKTS"] if "BYTES" in self.table.counter else ["$COUNTER_SPEC_PKTS"]
+            return fields
+        return [p[0] for p in self.table.actions.get(action_name, [])]
+
+    def _key_field(self, field_name):
+        for k in self.table.keys:
+            if k[0] == field_name:
+                return k
+        raise KeyError(field_name)
+
+
+class _Table:
+    """
+    Table object of the mock backend. Depending on kind it behaves like a match action table,
+    a register or an indirect counter.
+    """
+    MATCH = "MatchAction_Direct"
+    REGISTER = "Register"
+    COUNTER = "Counter"
+
+    def __init__(self, device, name: str, kind: str, keys: list, actions: dict, size: int,
+                 counter: str = None, meter: bool = False, width: int = 0, fixed: bool = False):
+        self.device = device
+        self.name = name
+        self.kind = kind
+        self.keys = keys
+        self.actions = actions
+        self.size = size
+        self.counter = counter
+        self.meter = meter
+        self.width = width
+        self.fixed = fixed
+        self.info = _TableInfo(self)
+        self.attributes = {"MeterByteCountAdjust": 0}
+        self.clear()
+
+    def clear(self):
+        if self.kind == self.REGISTER:
+            self.values = [[0] * self.size for _ in range(self.device.num_pipes)]
+        elif self.kind == self.COUNTER:
+            self.pkts = [0] * self.size
+            self.bytes = [0] * self.size
+        elif not self.fixed:
+            # canonical key -> {"action": str, "params": dict, "pkts": int, "bytes": int}
+            self.entries = {}
+
+    @staticmethod
+    def canonical_field(name, match_type, size, kt):
+        full = (1 << size) - 1 if size else 0
+        if match_type == "Exact":
+            return _to_int(kt.value) if kt else 0
+        if match_type == "Ternary":
+            if not kt:
+                return (0, 0)
+            mask = _to_int(kt.mask) if kt.mask is not None else full
+            return (_to_int(kt.value) & mask, mask)
+        if match_type == "Range":
+            if not kt:
+                return (0, full)
+            return (_to_int(kt.low), _to_int(kt.high))
+        if match_type == "LPM":
+            if not kt:
+                return (0, 0)
+            prefix_len = kt.prefix_len if kt.prefix_len is not None else size
+            mask = (full >> (size - prefix_len)) << (size - prefix_len) if prefix_len else 0
+            return (_to_int(kt.value) & mask, prefix_len)
+        raise KeyError(f"Unknown match type {match_type}")
+
+    def key_dict(self, canonical):
+        d = {}
+        for (name, match_type, _), v in zip(self.keys, canonical):
+            if match_type == "Ternary":
+                d[name] = {"value": v[0], "mask": v[1]}
+            elif match_type == "Range":
+                d[name] = {"low": v[0], "high": v[1]}
+            elif match_type == "LPM":
+                d[name] = {"value": v[0], "prefix_len": v[1]}
+            else:
+                d[name] = {"value": v}
+        return d
+
+    def make_key(self, key_field_list_in):
+        fields = {}
+        names = [k[0] for k in self.keys]
+        for kt in key_field_list_in:
+            if kt.name not in names:
+                raise KeyError(f"Key field {kt.name} does not exist in {self.name}")
+            fields[kt.name] = kt
+        return _Key(self, fields)
+
+    def make_data(self, data_field_list_in, action_name=None, get=False):
+        if self.kind == self.MATCH and action_name not in self.actions:
+            raise KeyError(f"Action {action_name} does not exist in {self.name}")
+        return _Data(action_name, {d.name: _data_value(d) for d in data_field_list_in})
+
+    def _index(self, key):
+        field = "$REGISTER_INDEX" if self.kind == self.REGISTER else "$COUNTER_INDEX"
+        idx = _to_int(key.fields[field].value)
+        if idx >= self.size:
+            raise IndexError(f"Index {idx} out of range for {self.name}")
+        return idx
+
+    def _write(self, target, key_list, data_list, mod: bool):
+        self.device.rpc()
+        errors = []
+        with self.device.lock:
+            for i, (key, data) in enumerate(zip(key_list, data_list)):
+                try:
+                    self._write_one(key, data, mod)
+                except (KeyError, IndexError) as e:
+                    errors.append((i, e.args[0] if e.args else str(e)))
+        if errors:
+            raise BfruntimeReadWriteRpcException(f"{len(errors)} of {len(key_list)} updates on {self.name} failed: {errors[0][1]}", errors)
+
+    def _write_one(self, key, data, mod: bool):
+        if self.kind == self.REGISTER:
+            idx = self._index(key)
+            v = _to_int(next(iter(data.fields.values()), 0))
+            for p in self.values:
+                p[idx] = v
+            return
+        if self.kind == self.COUNTER:
+            idx = self._index(key)
+            self.pkts[idx] = _to_int(data.fields.get("$COUNTER_SPEC_PKTS", 0))
+            self.bytes[idx] = _to_int(data.fields.get("$COUNTER_SPEC_BYTES", 0))
+            return
+
+        k = key.canonical()
+        if self.fixed:
+            if k not in self.entries:
+                raise KeyError(f"Entry {k} does not exist in {self.name}")
+            self.entries[k]["params"].update(data.fields)
+            self.device.on_fixed_entry_update(self, k, self.entries[k])
+            return
+
+        if mod:
+            if k not in self.entries:
+                raise KeyError(f"Entry {k} does not exist in {self.name}")
+            e = self.entries[k]
+            e["action"] = data.action_name or e["action"]
+            e["params"] = dict(data.fields)
+        else:
+            if k in self.entries:
+                raise KeyError(f"Entry {k} already exists in {self.name}")
+            if len(self.entries) >= self.size:
+                raise KeyError(f"Table {self.name} is full")
+            self.entries[k] = {"action": data.action_name, "params": dict(data.fields), "pkts": 0, "bytes": 0}
+
+    def entry_add(self, target, key_list=None, data_list=None, p4_name=None):
+        self._write(target, key_list, data_list, mod=False)
+
+    def entry_mod(self, target, key_list=None, data_list=None, flags=None, p4_name=None):
+        self._write(target, key_list, data_list, mod=True)
+
+    def entry_del(self, target, key_list=None, p4_name=None):
+        self.device.rpc()
+        with self.device.lock:
+            if key_list is None:
+                if self.fixed:
+                    raise BfruntimeReadWriteRpcException(f"Entries of {self.name} can not be deleted")
+                self.clear()
+                return
+            errors = []
+            for i, key in enumerate(key_list):
+                if self.kind != self.MATCH:
+                    idx = self._index(key)
+                    if self.kind == self.REGISTER:
+                        for p in self.values:
+                            p[idx] = 0
+                    else:
+                        self.pkts[idx] = self.bytes[idx] = 0
+                    continue
+                k = key.canonical()
+                if k not in self.entries:
+                    errors.append((i, f"Entry {k} does not exist in {self.name}"))
+                    continue
+                del self.entries[k]
+        if errors:
+            raise BfruntimeReadWriteRpcException(f"{len(errors)} of {len(key_list)} deletes on {self.name} failed", errors)
+
+    def entry_get(self, target, key_list=None, flags=None, required_data=None, p4_name=None):
+        self.device.rpc()
+        with self.device.lock:
+            result = self._read(key_list)
+        return (r for r in result)
+
+    def _read(self, key_list):
+        short_name = self.name.split(".", 1)[1] if self.name.startswith("pipe.") else self.name
+
+        if self.kind == self.REGISTER:
+            indices = [self._index(k) for k in key_list] if key_list else range(self.size)
+            field = f"{short_name}.f1"
+            return [(_Data(None, {field: [p[idx] for p in self.values]}),
+                     _Key(self, {"$REGISTER_INDEX": KeyTuple("$REGISTER_INDEX", idx)})) for idx in indices]
+
+        if self.kind == self.COUNTER:
+            indices = [self._index(k) for k in key_list] if key_list else range(self.size)
+            result = []
+            for idx in indices:
+                d = {"$COUNTER_SPEC_PKTS": self.pkts[idx]}
+                if self.counter == schema.PACKETS_AND_BYTES:
+                    d["$COUNTER_SPEC_BYTES"] = self.bytes[idx]
+                result.append((_Data(None, d), _Key(self, {"$COUNTER_INDEX": KeyTuple("$COUNTER_INDEX", idx)})))
+            return result
+
+        if key_list:
+            keys = []
+            for key in key_list:
+                k = key.canonical()
+                if k not in self.entries:
+                    raise BfruntimeReadWriteRpcException(f"Entry {k} does not exist in {self.name}", [(0, "not found")])
+                keys.append(k)
+        else:
+            keys = list(self.entries.keys())
+
+        result = []
+        for k in keys:
+            e = self.entries[k]
+            d = dict(e["params"])
+            if self.counter:
+                d["$COUNTER_SPEC_PKTS"] = e["pkts"]
+                if self.counter == schema.PACKETS_AND_BYTES:
+                    d["$COUNTER_SPEC_BYTES"] = e["bytes"]
+            result.append((_Data(e["action"], d), _ShadowKey(self, k)))
+        return result
+
+    def operations_execute(self, target, table_op):
+        self.device.rpc()
+
+    def attribute_meter_bytecount_adjust_set(self, target, byte_count):
+        self.device.rpc()
+        self.attributes["MeterByteCountAdjust"] = byte_count
+
+    def attribute_get(self, target, attribute_name):
+        self.device.rpc()
+        return iter([{"byte_count_adjust": self.attributes["MeterByteCountAdjust"]}])
+
+    def default_entry_get(self, target, flags=None):
+        self.device.rpc()
+        return iter([])
+
+
+class _ShadowKey(_Key):
+    """
+    Key of a stored entry, represented by its canonical form.
+    """
+
+    def __init__(self, table, canonical):
+        self.table = table
+        self._canonical = canonical
+        self.fields = {}
+
+    def canonical(self):
+        return self._canonical
+
+
+class _Learn:
+    def __init__(self, name: str, digest_id: int, fields: list):
+        self.name = name
+        self.id = digest_id
+        self.fields = fields
+
+    def make_data_list(self, digest):
+        return [_Data(None, d) for d in digest.data]
+
+
+class _Digest:
+    def __init__(self, digest_id: int, data: list):
+        self.digest_id = digest_id
+        self.data = data
+
+
+class _BfRtInfo:
+    def __init__(self, device):
+        self.device = device
+        self.learn_dict = {}
+        for name, (digest_id, fields) in schema.DIGESTS.items():
+            learn = _Learn(name, digest_id, fields)
+            self.learn_dict[name] = learn
+            self.learn_dict[name.split(".")[-1]] = learn
+
+    def table_name_list_get(self):
+        return list(self.device.tables.keys())
+
+    def table_get(self, name: str):
+        return self.device.tables[self._resolve(name, self.device.tables)]
+
+    def learn_name_list_get(self):
+        return list(schema.DIGESTS.keys())
+
+    def learn_get(self, name: str):
+        return self.learn_dict[name]
+
+    @staticmethod
+    def _resolve(name, names):
+        if name in names:
+            return name
+        matches = [n for n in names if n.endswith("." + name)]
+        if len(matches) != 1:
+            raise KeyError(f"Table {name} not found or ambiguous")
+        return matches[0]
+
+
+class MockDevice:
+    """
+    State of the emulated switch: all tables of the program, the digest queue and the RPC statistics.
+
+    :param latency: Injected delay per RPC in seconds.
+    :param defines: Compile time options of the program, see schema.match_tables.
+    """
+
+    def __init__(self, latency: float = 0.0, num_pipes: int = 2, defines: dict = None):
+        self.latency = latency
+        self.num_pipes = num_pipes
+        self.rpc_count = 0
+        self.lock = threading.RLock()
+        self.digests = queue.Queue()
+        self.timer_apps = {}
+        self.tables = {}
+
+        for name, t in schema.match_tables(defines).items():
+            self.tables[name] = _Table(self, name, _Table.MATCH, t["keys"], t["actions"], t["size"],
+                                       counter=t.get("counter"), meter=t.get("meter", False),
+                                       fixed=t.get("fixed", False))
+        for name, (width, size) in schema.REGISTERS.items():
+            short_name = name.split(".", 1)[1]
+            self.tables[name] = _Table(self, name, _Table.REGISTER, [("$REGISTER_INDEX", "Exact", 32)],
+                                       {None: [(f"{short_name}.f1", width)]}, size, width=width)
+        for name, (counter_type, size) in schema.COUNTERS.items():
+            self.tables[name] = _Table(self, name, _Table.COUNTER, [("$COUNTER_INDEX", "Exact", 32)],
+                                       {None: [("$COUNTER_SPEC_PKTS", 64), ("$COUNTER_SPEC_BYTES", 64)]}, size,
+                                       counter=counter_type)
+
+        # Entries of the pktgen application table always exist
+        app_cfg = self.tables["tf1.pktgen.app_cfg"]
+        app_cfg.entries = {(a,): {"action": "trigger_timer_periodic", "params": {"app_enable": False, "timer_nanosec": 0},
+                               "pkts": 0, "bytes": 0} for a in range(app_cfg.size)}
+
+    def rpc(self):
+        """
+        Accounts for one RPC to the switch.
+        """
+        self.rpc_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def clear_all_tables(self):
+        with self.lock:
+            for t in self.tables.values():
+                t.clear()
+
+    def count(self, table: str, index: int, pkts: int = 1, pkt_bytes: int = 0):
+        """
+        Increments an indirect counter, used to emulate traffic.
+        Counters wrap like the 32-bit counters of the data plane.
+        """
+        with self.lock:
+            t = self.tables[_BfRtInfo._resolve(table, self.tables)]
+            t.pkts[index] = (t.pkts[index] + pkts) % (1 << 32)
+            t.bytes[index] = (t.bytes[index] + pkt_bytes) % (1 << 32)
+
+    def entry_count(self):
+        """
+        Returns the number of entries in all match action tables of the program, fixed tables excluded.
+        """
+        with self.lock:
+            return sum(len(t.entries) for t in self.tables.values() if t.kind == _Table.MATCH and not t.fixed)
+
+    def push_digest(self, learn_name: str, data: list):
+        """
+        Queues a digest with a list of learn data dicts as the data plane would send it.
+        """
+        digest_id = schema.DIGESTS[_BfRtInfo._resolve(learn_name, schema.DIGESTS)][0]
+        self.digests.put(_Digest(digest_id, data))
+
+    def on_fixed_entry_update(self, table, key, entry):
+        """
+        Starts or stops the emulated timer of a packet generator application.
+        """
+        if table.name != "tf1.pktgen.app_cfg":
+            return
+        params = entry["params"]
+        app = self.timer_apps.get(key)
+        if params.get("app_enable") and params.get("timer_nanosec"):
+            if app:
+                app.stop()
+            self.timer_apps[key] = TimerApp(self, key, params["timer_nanosec"])
+            self.timer_apps[key].start()
+        elif app:
+            app.stop()
+            del self.timer_apps[key]
+
+    def process_timer_pkt(self, pipe_idx: int, app_id: int, ingress_port: int):
+        """
+        Processes a generated packet like the ingress of the PSFP control block does:
+        updates the hyperperiod registers and sends a digest once the first hyperperiod is done.
+        """
+        psfp = f"pipe.{schema.PSFP}"
+        with self.lock:
+            timed_pkt = self.tables[f"{psfp}.timed_pkt"].entries.get((pipe_idx, app_id, 0, 0, ingress_port))
+            app_id_port = self.tables[f"{psfp}.app_id_port"].entries.get((app_id,))
+            if not timed_pkt or not app_id_port:
+                return
+            timed_pkt["pkts"] += 1
+            timed_pkt["bytes"] += 100
+
+            pkt_count_hyperperiod = timed_pkt["params"]["pkt_count_hyperperiod"]
+            port = app_id_port["params"]["port"]
+
+            pkt_count = self.tables[f"{psfp}.pkt_count"].values[pipe_idx]
+            count = pkt_count[port] + 1
+            pkt_count[port] = 0 if count == pkt_count_hyperperiod else count
+            if pkt_count[port] != 0:
+                return
+
+            ts = time.time_ns() & (2**48 - 1)
+            self.tables[f"{psfp}.lower_last_ts"].values[pipe_idx][port] = ts & (2**32 - 1)
+            self.tables[f"{psfp}.higher_last_ts"].values[pipe_idx][port] = ts >> 32
+            hyperperiod_done = self.tables[f"{psfp}.hyperperiod_done"].values[pipe_idx]
+            first = hyperperiod_done[port] == 0
+            hyperperiod_done[port] = 1
+            self.tables[f"{psfp}.period_count"].values[pipe_idx][port] += 1
+
+        if first:
+            self.push_digest("digest_hyperperiod", [{"ingress_port": port, "app_id": app_id, "pipe_id": pipe_idx,
+                                                     "ingress_ts": ts, "reason": 6}])
+
+    def shutdown(self):
+        for app in self.timer_apps.values():
+            app.stop()
+        self.timer_apps = {}
+
+
+class _Channel:
+    def __init__(self, device):
+        self.device = device
+
+    def close(self):
+        self.device.shutdown()
+
+
+class ClientInterface:
+    """
+    Mock of bfrt_grpc.client.ClientInterface.
+
+    :param latency: Injected delay per RPC in seconds.
+    :param defines: Compile time options of the program, see schema.match_tables.
+    """
+
+    def __init__(self, grpc_addr: str, client_id: int = 0, device_id: int = 0, latency: float = 0.0,
+                 defines: dict = None, **kwargs):
+        self.grpc_addr = grpc_addr
+        self.client_id = client_id
+        self.device_id = device_id
+        self.device = MockDevice(latency=latency, defines=defines)
+        self.channel = _Channel(self.device)
+        self.program = None
+        logging.info(f"Using mock backend for {grpc_addr} with {latency * 1000}ms RPC latency.")
+
+    def bind_pipeline_config(self, p4_name: str):
+        self.device.rpc()
+        if p4_name != "sdn-psfp":
+            raise ValueError(f"The mock backend only models the sdn-psfp program, not {p4_name}!")
+        self.program = p4_name
+
+    def clear_all_tables(self):
+        self.device.rpc()
+        self.device.clear_all_tables()
+
+    def bfrt_info_get(self, p4_name: str = None):
+        self.device.rpc()
+        return _BfRtInfo(self.device)
+
+    def digest_get(self, timeout: float = 1):
+        try:
+            return self.device.digests.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError("Digest list not received")
@@ -0,0 +1,40 @@
+class MockPal:
+    """
+    Stand-in for the pal thrift client used by the PortManager.
+    Calls are accounted as RPCs on the mock device.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.ports = {}
+
+    def pal_port_front_panel_port_to_dev_port_get(self, dev_id, port, channel):
+        self.device.rpc()
+        # 16 front panel ports per pipe, 4 channels each
+        pipe = (port - 1) // 16
+        return pipe * 128 + ((port - 1) % 16) * 4 + channel
+
+    def pal_port_del(self, dev_id, dev_port):
+        self.device.rpc()
+        self.ports.pop(dev_port, None)
+
+    def pal_port_add(self, dev_id, dev_port, speed, fec):
+        self.device.rpc()
+        self.ports[dev_port] = {"speed": speed, "fec": fec, "auto_neg": 0, "enabled": False, "loopback": 0}
+
+    def pal_port_an_set(self, dev_id, dev_port, auto_neg):
+        self.device.rpc()
+        self.ports[dev_port]["auto_neg"] = auto_neg
+
+    def pal_port_enable(self, dev_id, dev_port):
+        self.device.rpc()
+        self.ports[dev_port]["enabled"] = True
+
+    def pal_port_loopback_mode_set(self, dev_id, dev_port, mode):
+        self.device.rpc()
+        self.ports[dev_port]["loopback"] = mode
+
+
+class MockThriftConnection:
+    def end(self):
+        pass
@@ -0,0 +1,31 @@
+import threading
+import time
+
+
+class TimerApp(threading.Thread):
+    """
+    Emulates a periodic timer application of the packet generator.
+    Every timer_nanosec one packet per pipe is handed to the device, like the pktgen ports 68 and 196 would do.
+    """
+
+    PIPE_PORTS = [68, 196]
+
+    def __init__(self, device, key: tuple, timer_nanosec: int):
+        super().__init__(daemon=True, name=f"Mock-PktGen-{key[0]}")
+        self.device = device
+        self.app_id = key[0]
+        self.interval = timer_nanosec / 1e9
+        self.stopped = threading.Event()
+
+    def run(self):
+        next_ts = time.monotonic()
+        while not self.stopped.is_set():
+            # Drift free schedule of the next packet
+            next_ts += self.interval
+            if self.stopped.wait(max(0, next_ts - time.monotonic())):
+                return
+            for pipe_idx, port in enumerate(self.PIPE_PORTS):
+                self.device.process_timer_pkt(pipe_idx, self.app_id, port)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,242 @@
+"""
+bfrt_info schema of the sdn-psfp P4 program for the mock backend.
+Compiled with the defaults of headers.p4 (__STREAM_ID__ 3, __STREAM_ID_SIZE__ 2048, __STREAM_GATE_SIZE__ 2048),
+the tables of other compile time options are selected with match_tables(defines).
+
+Match tables:  name: {"keys": [(field, match_type, bits)], "actions": {action: [(param, bits)]}, "size": int, "counter": type or None, "meter": bool}
+Registers:     name: (bits, size)
+Counters:      name: (type, size)
+Digests:       name: (digest_id, [(field, bits)])
+"""
+
+STREAM_ID_SIZE = 2048
+STREAM_GATE_SIZE = 2048
+
+PACKETS = "PACKETS"
+PACKETS_AND_BYTES = "PACKETS_AND_BYTES"
+
+SF = "ingress.psfp_c.streamFilter_c"
+SG = "ingress.psfp_c.streamGate_c"
+FM = "ingress.psfp_c.flowMeter_c"
+PSFP = "ingress.psfp_c"
+TS_FIELD = "hdr.recirc_time.match_ts"
+
+METER_SPEC = [("$METER_SPEC_CIR_KBPS", 64), ("$METER_SPEC_PIR_KBPS", 64),
+              ("$METER_SPEC_CBS_KBITS", 64), ("$METER_SPEC_PBS_KBITS", 64)]
+
+MATCH_TABLES = {
+    f"pipe.{SF}.stream_id": {
+        "keys": [("hdr.ethernet.dst_addr", "Ternary", 48),
+                 ("hdr.eth_802_1q.vid", "Exact", 12),
+                 ("hdr.ethernet.src_addr", "Ternary", 48),
+                 ("hdr.ipv4.srcAddr", "Ternary", 32),
+                 ("hdr.ipv4.dstAddr", "Ternary", 32),
+                 ("hdr.ipv4.diffserv", "Ternary", 6),
+                 ("hdr.ipv4.protocol", "Ternary", 8),
+                 ("hdr.transport.srcPort", "Ternary", 16),
+                 ("hdr.transport.dstPort", "Ternary", 16),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {f"{SF}.assign_stream_handle": [("stream_handle", 16), ("active", 1),
+                                                   ("stream_blocked_due_to_oversize_frame_enable", 1)]},
+        "size": STREAM_ID_SIZE,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{SF}.stream_id_active": {
+        "keys": [("ig_md.stream_filter.stream_handle", "Exact", 16)],
+        "actions": {f"{SF}.overwrite_stream_active": [("eth_dst_addr", 48), ("vid", 12), ("pcp", 3)]},
+        "size": 256,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{SF}.stream_filter_instance": {
+        "keys": [("ig_md.stream_filter.stream_handle", "Exact", 16)],
+        "actions": {f"{SF}.assign_gate_and_meter": [("stream_gate_id", 12), ("flow_meter_instance_id", 16),
+                                                    ("gate_closed_due_to_invalid_rx_enable", 1),
+                                                    ("gate_closed_due_to_octets_exceeded_enable", 1)]},
+        "size": STREAM_ID_SIZE,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{SF}.max_sdu_filter": {
+        "keys": [("ig_md.stream_filter.stream_handle", "Exact", 16),
+                 ("hdr.eth_802_1q.pcp", "Ternary", 3),
+                 ("hdr.recirc.pkt_len", "Range", 16),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {f"{SF}.none": []},
+        "size": 512,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{SG}.stream_gate_instance": {
+        "keys": [("ig_md.stream_filter.stream_gate_id", "Exact", 12),
+                 (TS_FIELD, "Range", 20),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {f"{SG}.set_gate_and_ipv": [("gate_state", 1), ("ipv", 4), ("interval_identifier", 12),
+                                               ("max_octects_interval", 32)]},
+        "size": STREAM_GATE_SIZE,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{FM}.flow_meter_config": {
+        "keys": [("ig_md.stream_filter.flow_meter_instance_id", "Exact", 16)],
+        "actions": {f"{FM}.set_flow_meter_config": [("dropOnYellow", 1), ("markAllFramesRedEnable", 1),
+                                                    ("colorAware", 1)]},
+        "size": STREAM_ID_SIZE},
+    f"pipe.{FM}.flow_meter_instance": {
+        "keys": [("ig_md.stream_filter.flow_meter_instance_id", "Exact", 16)],
+        "actions": {f"{FM}.set_color_direct": METER_SPEC},
+        "size": STREAM_ID_SIZE,
+        "meter": True},
+    f"pipe.{PSFP}.timed_pkt": {
+        "keys": [("hdr.timer.pipe_id", "Exact", 2),
+                 ("hdr.timer.app_id", "Exact", 3),
+                 ("hdr.timer.batch_id", "Exact", 16),
+                 ("hdr.timer.packet_id", "Exact", 16),
+                 ("ig_intr_md.ingress_port", "Exact", 9)],
+        "actions": {f"{PSFP}.set_pkt_count": [("pkt_count_hyperperiod", 16)]},
+        "size": 16,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{PSFP}.mapping_ingress_recirculation_port": {
+        "keys": [("ig_intr_md.ingress_port", "Exact", 9)],
+        "actions": {f"{PSFP}.set_recirculation_port": [("recirc_port", 9)]},
+        "size": 16},
+    f"pipe.{PSFP}.app_id_port": {
+        "keys": [("hdr.timer.app_id", "Exact", 3)],
+        "actions": {f"{PSFP}.assign_app_id_port": [("port", 9)]},
+        "size": 8},
+    "pipe.ingress.ipv4_c.ipv4": {
+        "keys": [("hdr.ipv4.dstAddr", "LPM", 32)],
+        "actions": {"ingress.ipv4_c.ipv4_forward": [("eth_dst_addr", 48), ("port", 9)]},
+        "size": 1024,
+        "counter": PACKETS},
+    "pipe.ingress.push_802_1q_header": {
+        "keys": [("ig_intr_md.ingress_port", "Exact", 9)],
+        "actions": {"ingress.push_vlan_header": [("vid", 12)]},
+        "size": 8},
+    "pipe.egress.underflow_detection": {
+        "keys": [("hdr.bridge.diff_ts", "Ternary", 64),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {"egress.nop": [], "egress.reset_diff_ts": []},
+        "size": 8},
+    "pipe.egress.map_offset_shift_right": {
+        "keys": [("hdr.bridge.ingress_port", "Exact", 16)],
+        "actions": {"egress.add_rel_ts_and_offset": [("offset", 64), ("hyperperiod_duration", 64)]},
+        "size": 16},
+    "pipe.egress.offset_detection_shift_right": {
+        "keys": [("eg_md.new_rel_pos_with_offset", "Ternary", 64),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {"egress.nop": []},
+        "size": 8},
+    "pipe.egress.map_offset_shift_left": {
+        "keys": [("hdr.bridge.ingress_port", "Exact", 16)],
+        "actions": {"egress.assign_offset_hp_duration": [("offset", 64), ("hyperperiod_duration_offset", 64)]},
+        "size": 16,
+        "counter": PACKETS},
+    "pipe.egress.offset_detection_shift_left": {
+        "keys": [("eg_md.new_rel_pos_with_offset", "Ternary", 64),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {"egress.set_pos_shift_left": []},
+        "size": 8,
+        "counter": PACKETS},
+    "pipe.egress.decide_shift_dir": {
+        "keys": [("hdr.bridge.ingress_port", "Exact", 16)],
+        "actions": {"egress.nop": []},
+        "size": 8},
+
+    # Packet generator tables of the TNA fixed function
+    "tf1.pktgen.port_cfg": {
+        "keys": [("dev_port", "Exact", 9)],
+        "actions": {None: [("pktgen_enable", 1)]},
+        "size": 8},
+    "tf1.pktgen.pkt_buffer": {
+        "keys": [("pkt_buffer_offset", "Exact", 14), ("pkt_buffer_size", "Exact", 14)],
+        "actions": {None: [("buffer", 0)]},
+        "size": 1},
+    "tf1.pktgen.app_cfg": {
+        "keys": [("app_id", "Exact", 3)],
+        "actions": {"trigger_timer_periodic": [("timer_nanosec", 32), ("app_enable", 1), ("pkt_len", 14),
+                                               ("pkt_buffer_offset", 14), ("pipe_local_source_port", 7),
+                                               ("increment_source_port", 1), ("batch_count_cfg", 16),
+                                               ("packets_per_batch_cfg", 16), ("ibg", 32), ("ibg_jitter", 32),
+                                               ("ipg", 32), ("ipg_jitter", 32), ("batch_counter", 64),
+                                               ("pkt_counter", 64), ("trigger_counter", 64)]},
+        "size": 8,
+        "fixed": True},
+}
+
+# Tables that differ with __SHARED_SCHEDULES__ 1
+SHARED_SCHEDULE_TABLES = {
+    f"pipe.{SG}.stream_gate_instance": {
+        "keys": [("ig_md.stream_gate.schedule_id", "Exact", 12),
+                 (TS_FIELD, "Range", 20),
+                 ("$MATCH_PRIORITY", "Exact", 32)],
+        "actions": {f"{SG}.set_gate_and_ipv": [("gate_state", 1), ("ipv", 4), ("interval_identifier", 12),
+                                               ("max_octects_interval", 32)]},
+        "size": STREAM_GATE_SIZE,
+        "counter": PACKETS_AND_BYTES},
+    f"pipe.{SG}.stream_gate_schedule": {
+        "keys": [("ig_md.stream_filter.stream_gate_id", "Exact", 12)],
+        "actions": {f"{SG}.set_schedule_id": [("schedule_id", 12)]},
+        "size": STREAM_GATE_SIZE},
+}
+
+# Compile time options of headers.p4 that change the tables, with their defaults
+DEFINES = {"__SHARED_SCHEDULES__": 0, "__GATE_SLOTS__": 0, "__GATE_SLOT_SHIFT__": 0, "__GATE_SLOT_SIZE__": 16384,
+           "__TS_WIDTH__": 20}
+
+
+def match_tables(defines: dict = None):
+    """
+    Returns the match tables of the program compiled with defines, e.g. {"__SHARED_SCHEDULES__": 1}.
+    """
+    defines = {**DEFINES, **(defines or {})}
+    tables = dict(MATCH_TABLES)
+    gate_key = ("ig_md.stream_filter.stream_gate_id", "Exact", 12)
+    if defines["__SHARED_SCHEDULES__"] == 1:
+        tables.update(SHARED_SCHEDULE_TABLES)
+        gate_key = ("ig_md.stream_gate.schedule_id", "Exact", 12)
+    if defines["__GATE_SLOTS__"] == 1:
+        tables[f"pipe.{SG}.stream_gate_slot"] = {
+            "keys": [gate_key, ("ig_md.stream_gate.slot", "Exact", defines["__TS_WIDTH__"] - defines["__GATE_SLOT_SHIFT__"])],
+            "actions": {f"{SG}.set_gate_and_ipv_slot": [("gate_state", 1), ("ipv", 4), ("interval_identifier", 12),
+                                                        ("max_octects_interval", 32)]},
+            "size": defines["__GATE_SLOT_SIZE__"],
+            "counter": PACKETS_AND_BYTES}
+    if defines["__TS_WIDTH__"] != DEFINES["__TS_WIDTH__"]:
+        for name, t in tables.items():
+            if any(k[0] == TS_FIELD for k in t["keys"]):
+                tables[name] = {**t, "keys": [(f, m, defines["__TS_WIDTH__"] if f == TS_FIELD else b)
+                                              for f, m, b in t["keys"]]}
+    return tables
+
+
+REGISTERS = {
+    f"pipe.{PSFP}.pkt_count": (16, 256),
+    f"pipe.{PSFP}.lower_last_ts": (32, 256),
+    f"pipe.{PSFP}.higher_last_ts": (16, 256),
+    f"pipe.{PSFP}.hyperperiod_done": (1, 256),
+    f"pipe.{PSFP}.period_count": (32, 256),
+    f"pipe.{SF}.reg_filter_blocked": (1, STREAM_ID_SIZE),
+    f"pipe.{SG}.reg_gate_blocked": (1, 2048),
+    f"pipe.{SG}.state_reset_octets": (32, 2048),
+    f"pipe.{SG}.first_sdu_per_interval": (32, 2048),
+    f"pipe.{SG}.octets_per_interval": (32, 2048),
+    f"pipe.{FM}.reg_meter_blocked": (1, 2048),
+}
+
+COUNTERS = {
+    f"pipe.{SF}.missed_max_sdu_filter_counter": (PACKETS, 32),
+    f"pipe.{SF}.overall_counter": (PACKETS_AND_BYTES, 512),
+    f"pipe.{SG}.not_passed_gate_counter": (PACKETS, 32),
+    f"pipe.{SG}.missed_interval_counter": (PACKETS, 32),
+    f"pipe.{FM}.marked_red_counter": (PACKETS_AND_BYTES, 512),
+    f"pipe.{FM}.marked_yellow_counter": (PACKETS_AND_BYTES, 512),
+    f"pipe.{FM}.marked_green_counter": (PACKETS_AND_BYTES, 512),
+}
+
+DIGESTS = {
+    "pipe.SwitchIngressDeparser.digest_block_psfp": (2391291093, [("stream_handle", 16), ("stream_gate_id", 12),
+                                                                  ("drop_ctl", 3), ("PSFPGateEnabled", 1),
+                                                                  ("reason", 3), ("color", 2),
+                                                                  ("flow_meter_instance_id", 16)]),
+    "pipe.SwitchIngressDeparser.digest_pktgen": (2397224885, [("pipe_id", 2), ("app_id", 3), ("batch_id", 16),
+                                                              ("packet_id", 16), ("ingress_port", 9)]),
+    "pipe.SwitchIngressDeparser.digest_debug_gate": (2386104925, [("rel_pos", 20), ("stream_gate_id", 12),
+                                                                  ("diff_ts", 64), ("ingress_timestamp", 64),
+                                                                  ("hyperperiod_ts", 64), ("ingress_port", 9),
+                                                                  ("period_count", 32), ("pkt_len", 16)]),
+    "pipe.SwitchIngressDeparser.digest_hyperperiod": (2387156053, [("ingress_port", 9), ("app_id", 3),
+                                                                   ("pipe_id", 2), ("ingress_ts", 48),
+                                                                   ("reason", 3)]),
+}
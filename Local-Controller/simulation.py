@@ -1,25 +1,42 @@
 import time
 import threading
-import matplotlib.pyplot as plt
 import logging
-import json
 import csv
+import numpy as np
 
 from libs.Switch import Switch, TerminalColor
+from libs.Sampler import Sampler
+from libs.ResultWriter import ResultWriter
+from libs.BandwidthPlotter import BandwidthPlotter
+
+# Counters sampled per flow meter, the send rate is taken from the overall counter of the stream filter
+FLOW_METER_COUNTERS = {"green": "ingress.psfp_c.flowMeter_c.marked_green_counter",
+                       "yellow": "ingress.psfp_c.flowMeter_c.marked_yellow_counter",
+                       "red": "ingress.psfp_c.flowMeter_c.marked_red_counter",
+                       "send": "ingress.psfp_c.streamFilter_c.overall_counter"}
+
+STREAM_GATE_TABLE = "ingress.psfp_c.streamGate_c.stream_gate_instance"
+
+# Sampled interval of a stream gate, interval is the position in the schedule of the gate
+GATE_INTERVAL_DTYPE = np.dtype([("gate_id", np.uint32), ("interval", np.uint32), ("gate_state", np.uint8)])
 
 
 class Simulation(object):
     """
     This class starts a simulation which collects data from all flow meter externs and saves them to the provided location.
     The simulation and control plane is terminated after simulation_duration seconds.
+    flow_meter_id is either a single flow meter or a list of flow meters to monitor.
     """
 
-    def __init__(self, switch: Switch, json_file: str, csv_file: str, simulation_duration: int, flow_meter_id: int = None, stream_gate_id: int = None) -> None:
+    def __init__(self, switch: Switch, json_file: str, csv_file: str, simulation_duration: int, flow_meter_id=None, stream_gate_id=None,
+                 sampling_interval: float = 0.05, sampling_capacity: int = 10000) -> None:
         self.switch = switch
         self.exit_flag = False
         self.running = False
         self.flow_meter_id = flow_meter_id
+        self.flow_meter_ids = flow_meter_id if isinstance(flow_meter_id, list) else [flow_meter_id]
         self.stream_gate_id = stream_gate_id
+        self.stream_gate_ids = stream_gate_id if isinstance(stream_gate_id, list) else [stream_gate_id]
 
         # Files to save data to.
         self.json_file = json_file
@@ -28,21 +45,69 @@ class Simulation(object):
         self.simulation_duration = simulation_duration
         # Flag if simulation should be plotted in real time
         self.do_plot = False
+        self.plotter = None
         
         self.data_points = []
-        self.data_points_gate = []
+
+        # Counters are sampled at a fixed rate into ring buffers, only the latest sampling_capacity samples are kept
+        self.sampler = Sampler(switch)
+        self.sampling_interval = sampling_interval
+        samples = int(simulation_duration / sampling_interval) + 2
+        if samples > sampling_capacity:
+            logging.warning(f"{simulation_duration}s simulation takes {samples} samples at {sampling_interval}s, "
+                            f"only the last {sampling_capacity} samples ({sampling_capacity * sampling_interval:.2f}s) "
+                            f"are analyzed. Increase sampling_capacity or sampling_interval to analyze the whole run.")
+        self.sampling_capacity = min(samples, sampling_capacity)
+        self.start_ts = None
+
+        # Gate id, position in the schedule and gate state of every sampled interval, in the order of the sampled columns
+        self.gate_intervals = None
+        # First column of every monitored stream gate, intervals of a gate are adjacent
+        self.gate_offsets = None
 
     def start_sim(self):
         """
         Start the simulation. This function is called once the first hyperperiod is done.
         Monitoring flow meter and stream gate is an exclusive or.
         """
+        self.start_ts = time.time()
 
         if self.flow_meter_id:
+            # All counters are sampled together, so the rates of a sample belong to the same tick
+            self.sampler.add("flow_meter", list(FLOW_METER_COUNTERS.values()), self.flow_meter_ids,
+                             self.sampling_interval, self.sampling_capacity)
+            self.sampler.start()
+
             logging.info(f"Monitoring thread for {self.flow_meter_id=} started.")
             t1 = threading.Thread(target=self.monitor_flow_meter, args=(), daemon=True, name="Flow-Meter-Monitor")
             t1.start()
         elif self.stream_gate_id:
+            gates = {g.gate_id: g for g in self.switch.stream_gate_controller.gates}
+            missing = [i for i in self.stream_gate_ids if i not in gates]
+            if missing:
+                logging.error(f"Stream gates {missing} are not configured, nothing to monitor.")
+                return
+
+            # The intervals of the gates are sampled, their match fields are derived from the schedules.
+            # With shared schedules, the counters of an interval count the frames of all gates of the schedule.
+            gate_entries = [(i, e) for i in self.stream_gate_ids
+                            for e in self.switch.stream_gate_controller.gate_interval_entries(gates[i])]
+            entries = [e for _, e in gate_entries]
+            slot_gates = sorted({i for i, e in gate_entries if e["table"] != STREAM_GATE_TABLE})
+            if slot_gates:
+                logging.error(f"Schedules of stream gates {slot_gates} are installed in time slots, "
+                              f"only range match intervals can be monitored.")
+                return
+            self.gate_intervals = np.zeros(len(entries), dtype=GATE_INTERVAL_DTYPE)
+            self.gate_intervals["gate_id"] = [i for i, _ in gate_entries]
+            self.gate_intervals["gate_state"] = [e["action_params"]["gate_state"] for e in entries]
+            self.gate_offsets = np.flatnonzero(np.diff(self.gate_intervals["gate_id"], prepend=-1))
+            self.gate_intervals["interval"] = np.arange(len(entries)) - np.repeat(self.gate_offsets, np.diff(self.gate_offsets, append=len(entries)))
+
+            self.sampler.add("gate", STREAM_GATE_TABLE, [e["match_fields"] for e in entries],
+                             self.sampling_interval, self.sampling_capacity)
+            self.sampler.start()
+
             logging.info(f"Monitoring for {self.stream_gate_id} started.")
             t1 = threading.Thread(target=self.collect_stream_gate_data, args=(), daemon=True, name="Stream-Gate-Monitor")
             t1.start() 
@@ -50,42 +115,22 @@ class Simulation(object):
 
     def update_data(self, new_data):
         """
-        This function appends the collected new_data to the given file, or creates it if it doesnt exist.
+        This function appends the collected new_data as a new run to the given file, or creates it if it doesnt exist.
 
-        :param new_data: list of dicts with the data to be appended to the json file
+        :param new_data: list of dicts with the data to be appended to the result file
         """
-        try:
-            with open(self.json_file, 'r+') as file:
-                file_data = json.load(file)
-                file_data += [new_data]
-                print(f"Simulation {len(file_data)} complete!")
-                j = json.dumps(file_data)
-                file.seek(0)
-                file.write(j)
-        except (FileNotFoundError, json.decoder.JSONDecodeError):
-            file = open(self.json_file, "w")
-            file.write("[]")
-            file.close()
-            self.update_data(new_data)
+        with ResultWriter(self.json_file) as writer:
+            run = writer.write_run(new_data)
+        print(f"Simulation {run} complete!")
 
     def dump_schedule_counters(self, duration):
         """
         This function dumps the PKT counter externs of the stream gate instance at the end of a simulation run
         and appends them to a csv file.
         """
-        self.switch.sync_counters('ingress.psfp_c.streamGate_c.stream_gate_instance')
-
-        entries = self.switch.get_table_entries("ingress.psfp_c.streamGate_c.stream_gate_instance")
-        all_rows = []
-        for k, v in entries:
-            actions = k.to_dict()
-            matches = v.to_dict()
-            # Merge both dicts into one
-            row = {**matches, **actions}
-            all_rows.append(row)
-        # Filter out intervals of this gate id
-        gate_rows = list(filter(lambda r: r["ig_md.stream_filter.stream_gate_id"] == {'value': self.stream_gate_id}, all_rows))
-        pkt_counts = [duration] + [interval['$COUNTER_SPEC_PKTS'] for interval in gate_rows]
+        gate_table = self.sampler.tables["gate"]
+        rows = self.switch.get_direct_counters(STREAM_GATE_TABLE, gate_table.indices, max_staleness=0)
+        pkt_counts = [duration] + [interval['$COUNTER_SPEC_PKTS'] for interval in rows]
 
         with open(self.csv_file, 'a+', encoding='UTF8', newline='') as f:
             writer = csv.writer(f, delimiter=';')
@@ -93,58 +138,51 @@ class Simulation(object):
 
     def collect_stream_gate_data(self):
         """
-        This function synchronizes and reads the counter values from the stream gate instance table.
-        Reading the values takes ~150ms, thus this is the sampling rate.
-        Counter values are stored as generators, as evaluating those would take too long during runtime.
-        Analyze the generators with the analyze_stream_gate_data functions at the end of a simulation.
+        This function waits until simulation_duration is over while the sampler collects the counter values
+        of the monitored stream gate intervals.
+        Analyze the samples with the analyze_stream_gate_data functions at the end of a simulation.
         """
 
-        start_ts = time.time()
-
         while not self.exit_flag:
-            # Synchonize counters first
-            self.switch.sync_counters('ingress.psfp_c.streamGate_c.stream_gate_instance')
+            duration = time.time() - self.start_ts
 
-            entries = self.switch.get_table_entries("ingress.psfp_c.streamGate_c.stream_gate_instance")
-
-            ts = time.time()
-            duration = ts - start_ts
-            dp = {"ts": ts, "data": entries}
-            self.data_points_gate.append(dp)
-            
             if duration > self.simulation_duration:
+                self.sampler.stop()
                 print(f"{self.simulation_duration}s simulation done!")
                 if self.csv_file:
                     self.dump_schedule_counters(duration)
                 self.exit_flag = True
-            #time.sleep(0.05)
+            else:
+                time.sleep(min(0.1, self.simulation_duration - duration))
 
     def analyze_stream_gate_data(self):
         """
-        This function analyzes the data_points collected as generator objects in the 
-        self.data_points_gate variable collected by the collect_stream_gate_data function.
+        This function analyzes the samples of the monitored stream gates collected by the sampler.
+        The packet and byte counts of all intervals are summed up per gate, and per gate for the open intervals only.
         """
-        total_pkts = 0
-        forwarded_pkts = 0
+        if "gate" not in self.sampler.tables:
+            return
+
+        ts, pkts, pkt_bytes, _ = self.sampler.buffer("gate").snapshot()
+        is_open = self.gate_intervals["gate_state"] == 1
+
+        # samples x gates
+        total_pkts = np.add.reduceat(pkts, self.gate_offsets, axis=1)
+        forwarded_pkts = np.add.reduceat(pkts * is_open, self.gate_offsets, axis=1)
+        forwarded_bytes = np.add.reduceat(pkt_bytes * is_open, self.gate_offsets, axis=1)
+        gate_ids = self.gate_intervals["gate_id"][self.gate_offsets]
+
         data = []
-        for dp in self.data_points_gate:
-            entries = dp["data"]
-            pkts = []
-            for k, v in entries:
-                values = v.to_dict()
-                keys = k.to_dict()
-
-                if values['ig_md.stream_filter.stream_gate_id']['value'] == self.stream_gate_id:
-                    pkts.append([keys['$COUNTER_SPEC_PKTS'], keys['gate_state']])
-            
-            total_pkts = sum([x[0] for x in pkts])
-            forwarded_pkts = sum(x[0] for x in pkts if x[1] == 1)
-            data.append({"ts": dp['ts'], "sent_packets": total_pkts, "pkt_count_green": forwarded_pkts})
+        for i, t in enumerate(ts):
+            for j, gate_id in enumerate(gate_ids):
+                data_point = {"ts": float(t), "sent_packets": int(total_pkts[i, j]), "pkt_count_green": int(forwarded_pkts[i, j]),
+                              "byte_count_green": int(forwarded_bytes[i, j])}
+                if len(gate_ids) > 1:
+                    data_point["stream_gate_id"] = int(gate_id)
+                data.append(data_point)
         self.update_data(data)
 
     def dump_eval_p4tg_counters(self):
-        self.switch.sync_counters('ingress.psfp_c.flowMeter_c.evaluation_p4tg')
-
         entries = self.switch.get_table_entries("ingress.psfp_c.flowMeter_c.evaluation_p4tg")
         data = []
         for k, v in entries:
@@ -155,8 +193,6 @@ class Simulation(object):
         self.update_data(data)
 
     def dump_eval_p4tg_counters_meter(self):
-        self.switch.sync_counters('ingress.psfp_c.flowMeter_c.evaluation_p4tg')
-
         entries = self.switch.get_table_entries("ingress.psfp_c.flowMeter_c.evaluation_p4tg")
         data = []
         for k, v in entries:
@@ -167,95 +203,78 @@ class Simulation(object):
         self.update_data(data)
 
     def monitor_flow_meter(self):
-        last_green_bytes = 0
-        last_yellow_bytes = 0
-        last_red_bytes = 0
-        last_overall_bytes = 0
-        last_ts = 0
-        start_ts = time.time()
+        """
+        Waits for the samples of the flow meter counters and logs the current rates.
+        Once simulation_duration is over, the rates of all buffered samples are saved.
+        """
+        buffer = self.sampler.buffer("flow_meter")
+        seq = 0
+
+        if self.do_plot:
+            self.plotter = BandwidthPlotter(capacity=self.sampling_capacity)
+            self.plotter.start()
 
         while not self.exit_flag:
-            ts = time.time()
-
-            # TODO slow performance when reading counters with from_hw=true in SDE 9.9.0
-            green_counter = self.switch.get_counter_at_index("ingress.psfp_c.flowMeter_c.marked_green_counter", self.flow_meter_id)
-            yellow_counter = self.switch.get_counter_at_index("ingress.psfp_c.flowMeter_c.marked_yellow_counter", self.flow_meter_id)
-            red_counter = self.switch.get_counter_at_index("ingress.psfp_c.flowMeter_c.marked_red_counter", self.flow_meter_id)
-            overall_counter = self.switch.get_counter_at_index("ingress.psfp_c.streamFilter_c.overall_counter", self.flow_meter_id)
-
-            # Remove recirculation header size
-            green_bytes = green_counter["$COUNTER_SPEC_BYTES"] - green_counter["$COUNTER_SPEC_PKTS"] * 7  
-            yellow_bytes = yellow_counter["$COUNTER_SPEC_BYTES"] - yellow_counter["$COUNTER_SPEC_PKTS"] * 7
-            red_bytes = red_counter["$COUNTER_SPEC_BYTES"] - red_counter["$COUNTER_SPEC_PKTS"] * 7
-            overall_bytes = overall_counter["$COUNTER_SPEC_BYTES"] - overall_counter["$COUNTER_SPEC_PKTS"] * 7
-            #overall_bytes = green_bytes + red_bytes + yellow_bytes
-            time_delta = ts - last_ts
-            duration = ts - start_ts
-
-            # Calculate bandwidths
-            green_rate = round((green_bytes - last_green_bytes) * 8 / 1000000000 / time_delta, 2)
-            yellow_rate = round((yellow_bytes - last_yellow_bytes) * 8 / 1000000000 / time_delta, 2)
-            red_rate = round((red_bytes - last_red_bytes) * 8 / 1000000000 / time_delta, 2)
-
-            send_rate = round((overall_bytes - last_overall_bytes) * 8 / 1000000000 / time_delta, 2)
-            
-            logging.debug(f"{TerminalColor.GREEN.value}{green_rate=}kbps{TerminalColor.DEFAULT.value}, " 
-                    f"{TerminalColor.YELLOW.value}{yellow_rate=}kbps{TerminalColor.DEFAULT.value}, "
-                    f"{TerminalColor.RED.value}{red_rate=}kbps{TerminalColor.DEFAULT.value}, "
-                    f"{TerminalColor.BLUE.value}{send_rate=}kbps{TerminalColor.DEFAULT.value}")
-
-            last_overall_bytes = overall_bytes
-            last_green_bytes = green_bytes
-            last_yellow_bytes = yellow_bytes
-            last_red_bytes = red_bytes
-            last_ts = ts
-
-            data_point = {"seconds": duration, "green_rate": green_rate, "yellow_rate": yellow_rate, "red_rate": red_rate, "send_rate": send_rate}
-            self.data_points.append(data_point)
+            if not buffer.wait(seq, timeout=1):
+                continue
+            new_samples = buffer.count - seq
+            seq = buffer.count
+            duration = time.time() - self.start_ts
+
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                for data_point in self.flow_meter_data_points(last=2)[-len(self.flow_meter_ids):]:
+                    logging.debug(f"m={data_point.get('flow_meter_id', self.flow_meter_id)}: "
+                            f"{TerminalColor.GREEN.value}green_rate={data_point['green_rate']}kbps{TerminalColor.DEFAULT.value}, "
+                            f"{TerminalColor.YELLOW.value}yellow_rate={data_point['yellow_rate']}kbps{TerminalColor.DEFAULT.value}, "
+                            f"{TerminalColor.RED.value}red_rate={data_point['red_rate']}kbps{TerminalColor.DEFAULT.value}, "
+                            f"{TerminalColor.BLUE.value}send_rate={data_point['send_rate']}kbps{TerminalColor.DEFAULT.value}")
+
+            if self.do_plot:
+                # Rates of the new samples of the first flow meter, the previous sample is only needed for the rate
+                data_points = self.flow_meter_data_points(last=new_samples + 1)[len(self.flow_meter_ids)::len(self.flow_meter_ids)]
+                self.plotter.add(data_points)
 
             if duration > self.simulation_duration:
+                self.sampler.stop()
+                # The last frame is drawn before the simulation is reported as done and the process may exit
+                if self.do_plot:
+                    self.plotter.stop()
                 print(f"{self.simulation_duration}s simulation done!")
-                duration = str(duration).replace('.', ",")
+                self.data_points = self.flow_meter_data_points()
                 self.update_data(self.data_points)
                 self.exit_flag = True
 
-            if self.do_plot:
-                t = threading.Thread(target=self.plot_bandwidth, args=(self.data_points,), daemon=True, name="Plotter")
-                t.start()
-
-            #time.sleep(.25)
-    def plot_bandwidth(self, data_points: list):
-
-        #plt.clf()
-        plt.figure(figsize=(1920/100, 1440/100))
-        #plt.figure()
-        plt.rc('axes', titlesize=25)
-        plt.rc('axes', labelsize=25)
-        plt.rc('xtick', labelsize=22)
-        plt.rc('ytick', labelsize=22)
-        plt.rc('legend', fontsize=24)
-        plt.xlabel("Time in s")
-        plt.ylabel("Bandwidth in mbps")
-
-        #plt.title("Bandwidths")
-        #x_axis = [idx for idx, d in enumerate(data_points)]
-        x_axis = [d['seconds'] for d in data_points]
-
-        green_rate = [d['green_rate'] for d in data_points]
-        yellow_rate = [d['yellow_rate'] for d in data_points]
-        red_rate = [d['red_rate'] for d in data_points]
-        send_rate = [d['send_rate'] for d in data_points]
-        cir = [700 for _ in range(len(x_axis))]
-        eir = [100 for _ in range(len(x_axis))]
-
-
-        plt.plot(x_axis, green_rate, label="Green Rate", color="green", marker="o", linewidth=3)
-        plt.plot(x_axis, yellow_rate, label="Yellow Rate", color="orange", marker="o", linewidth=3)
-        plt.plot(x_axis, red_rate, label="Dropping Rate", color="red", marker="o", linewidth=3)
-        plt.plot(x_axis, send_rate, label="Sending Rate", color="blue", marker="o", linewidth=3)
-        plt.plot(x_axis, eir, label="Excess Information Rate (EIR)", color="orange", linestyle='dotted', linewidth=3)
-        plt.plot(x_axis, cir, label="Committed Information Rate (CIR)", color="green", linestyle='dotted', linewidth=3)
-
-        plt.legend()
-        plt.savefig("bandwidth.png")
-        plt.close()
\ No newline at end of file
+    def flow_meter_data_points(self, last: int = None):
+        """
+        Calculates the rates of all monitored flow meters from the buffered samples.
+        The rate of a sample is relative to the previous sample, the first one has a rate of 0.
+
+        :param last: Only use the last samples.
+
+        :returns data_points: list of dicts with seconds, green_rate, yellow_rate, red_rate and send_rate per sample and flow meter.
+        """
+        buffer = self.sampler.buffer("flow_meter")
+        ts, pkts, pkt_bytes, _ = buffer.latest(last) if last else buffer.snapshot()
+        n = len(ts)
+
+        # samples x counters x flow meters, see SampledTable for the order of the columns
+        shape = (n, len(FLOW_METER_COUNTERS), len(self.flow_meter_ids))
+        pkts, pkt_bytes = pkts.astype(np.int64).reshape(shape), pkt_bytes.astype(np.int64).reshape(shape)
+
+        # Remove recirculation header size
+        c_bytes = pkt_bytes - pkts * 7
+        rates = np.zeros(c_bytes.shape)
+        rates[1:] = np.diff(c_bytes, axis=0) * 8 / 1000000000 / np.diff(ts)[:, None, None]
+
+        seconds = ts - self.start_ts
+        data_points = []
+        for i in range(n):
+            for j, m in enumerate(self.flow_meter_ids):
+                data_point = {"seconds": float(seconds[i])}
+                for k, c in enumerate(FLOW_METER_COUNTERS):
+                    data_point[f"{c}_rate"] = round(float(rates[i, k, j]), 2)
+                if len(self.flow_meter_ids) > 1:
+                    data_point["flow_meter_id"] = m
+                data_points.append(data_point)
+
+        return data_points
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The controller imports its modules as libs.*, relative to Local-Controller
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+import pytest
+
+from libs.PktGen import PktGen
+
+
+@pytest.mark.parametrize("period, pkt_count, interval_length", [
+    (1, 1, 1),
+    (PktGen.MAX_TIMER, 1, PktGen.MAX_TIMER),
+    (2**32, 2, 2**31),
+    (6 * 10**9, 2, 3 * 10**9),
+    (10**10, 4, 25 * 10**8),
+    # 2^32 + 1 = 641 * 6700417, 641 is the smallest divisor with an interval within the timer
+    (2**32 + 1, 641, 6700417),
+    (PktGen.MAX_TIMER * PktGen.MAX_PKT_COUNT, PktGen.MAX_PKT_COUNT, PktGen.MAX_TIMER),
+])
+def test_calc_period_packets_exact(period, pkt_count, interval_length):
+    assert PktGen.calc_period_packets(period) == (pkt_count, interval_length)
+    assert PktGen.period_drift(period) == 0
+
+
+def test_calc_period_packets_drift():
+    # Prime, the closest generated hyperperiod is 2 x 4294967292 ns
+    period = 8589934583
+    pkt_count, interval_length = PktGen.calc_period_packets(period)
+    assert (pkt_count, interval_length) == (2, 4294967292)
+    assert PktGen.period_drift(period) == 1
+
+
+@pytest.mark.parametrize("period", [2**33 + 1, 3 * 10**12 + 117, 8589934583])
+def test_calc_period_packets_bounds(period):
+    pkt_count, interval_length = PktGen.calc_period_packets(period)
+    assert 1 <= pkt_count <= PktGen.MAX_PKT_COUNT
+    assert interval_length <= PktGen.MAX_TIMER
+    assert abs(pkt_count * interval_length - period) <= pkt_count // 2
+
+
+@pytest.mark.parametrize("period", [PktGen.MAX_TIMER * PktGen.MAX_PKT_COUNT + 1, 2**64])
+def test_calc_period_packets_too_large(period):
+    with pytest.raises(ValueError):
+        PktGen.calc_period_packets(period)
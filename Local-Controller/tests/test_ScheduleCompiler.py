@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import controller
+from libs import TimeQuantization
+from libs.ScheduleCompiler import ScheduleCompiler, range_expansion
+from libs.Switch import Switch, DigestType
+from libs.TableEncoder import TableEncoder
+from libs.configuration import Config
+from libs.controller.StreamGateController import StreamGateController
+
+BASE_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configuration.json")
+
+# Gate 1 is the only gate with schedule OPEN, which is the only schedule on its port
+GATE_ID = 1
+SCHEDULE = "OPEN"
+
+
+@pytest.fixture
+def install(tmp_path):
+    """
+    Installs a schedule for gate GATE_ID on a mock switch like the controller does once the first hyperperiod is done.
+
+    :returns install: function(intervals, period, defines=None, octets_enforced=False) returning the switch.
+    """
+    switches = []
+
+    def install(intervals: list, period: int, defines: dict = None, octets_enforced: bool = False):
+        with open(BASE_CONFIG) as file:
+            data = json.load(file)
+        schedule = next(s for s in data["gate_schedules"] if s["name"] == SCHEDULE)
+        schedule.update(period=period, intervals=intervals)
+        gate = next(g for g in data["stream_gates"] if g["stream_gate_id"] == GATE_ID)
+        gate["gate_closed_due_to_octets_exceeded_enable"] = octets_enforced
+        config_file = tmp_path / "configuration.json"
+        config_file.write_text(json.dumps(data))
+
+        switch = Switch(name="s1", program="sdn-psfp", clear=False, mock=True, mock_defines=defines)
+        switches.append(switch)
+        config = Config(str(config_file), validate=False)
+        controller.configure_time_quantization(switch, config)
+        config.validate_config()
+        controller.create_stream_filters(switch, config)
+        controller.create_stream_gates(switch, config)
+        controller.create_flow_meters(switch, config)
+        controller.configure_hyperperiods(switch, config)
+        for app_id, d in list(switch.pkt_gen.app_id_mapping.items()):
+            if d["port"]:
+                switch.handle_digest({"reason": DigestType.HYPERPERIOD.value, "pipe_id": 1, "app_id": app_id,
+                                      "ingress_ts": 0})
+        return switch
+
+    yield install
+    for switch in switches:
+        switch.shutdown()
+
+
+def installed_intervals(switch, table=StreamGateController.GATE_TABLE):
+    """
+    Reads the entries of gate GATE_ID from the mock, sorted by their key.
+
+    :returns entries: list of (match_ts, data dict) tuples.
+    """
+    entries = []
+    for data, key in switch.get_table_entries(table, counters=False):
+        key = TableEncoder.key_from_dict(key.to_dict())
+        if key[StreamGateController.GATE_ID_FIELD] == GATE_ID:
+            entries.append((key.get(StreamGateController.TS_FIELD, key.get(StreamGateController.SLOT_FIELD)),
+                            data.to_dict()))
+    return sorted(entries, key=lambda e: e[0])
+
+
+def prefix_cover(low: int, high: int, width: int):
+    """
+    Ternary (value, mask) entries that a TCAM needs for the range match [low, high], largest aligned blocks first.
+    """
+    prefixes = []
+    while low <= high:
+        size = low & -low if low else 1 << width
+        while low + size - 1 > high:
+            size >>= 1
+        prefixes.append((low, ((1 << width) - 1) ^ (size - 1)))
+        low += size
+    return prefixes
+
+
+def random_schedule(seed: int, period: int, n: int):
+    rng = np.random.default_rng(seed)
+    borders = [0] + sorted(set(rng.integers(1, period, n - 1).tolist())) + [period]
+    return [{"low": low, "high": high, "state": int(rng.integers(0, 2)), "ipv": int(rng.integers(0, 8)), "octets": 0}
+            for low, high in zip(borders, borders[1:])]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("octets_enforced", [False, True])
+def test_prefix_cover(install, seed, octets_enforced):
+    period = 400000000
+    intervals = random_schedule(seed, period, 200)
+    switch = install(intervals, period, octets_enforced=octets_enforced)
+
+    width = TimeQuantization.TS_WIDTH
+    end = TimeQuantization.quantize(period)
+    coverage = np.zeros(1 << width, dtype=np.int64)
+    state = np.full(1 << width, -1, dtype=np.int64)
+    ipv = np.full(1 << width, -1, dtype=np.int64)
+    tcam_entries = 0
+
+    entries = installed_intervals(switch)
+    assert entries
+    for (low, high), data in entries:
+        prefixes = prefix_cover(low, high, width)
+        assert len(prefixes) == range_expansion(low, high)[0]
+        tcam_entries += len(prefixes)
+        for value, mask in prefixes:
+            size = ((1 << width) - 1 ^ mask) + 1
+            assert size & (size - 1) == 0 and value & (size - 1) == 0
+            coverage[value:value + size] += 1
+            state[value:value + size] = data["gate_state"]
+            ipv[value:value + size] = data["ipv"]
+
+    # Every quantized timestamp of the period matches exactly one ternary entry, none after the period
+    assert (coverage[:end + 1] == 1).all()
+    assert (coverage[end + 1:] == 0).all()
+    assert tcam_entries == switch.stream_gate_controller.compile_stats[GATE_ID].tcam_after
+
+    # Slots within one interval keep its gate state, and its IPV if it is open. Only the border slots may differ.
+    unit = TimeQuantization.resolution()
+    for d in intervals:
+        inner = np.arange(-(-d["low"] // unit), d["high"] // unit)
+        assert (state[inner] == d["state"]).all()
+        if d["state"]:
+            assert (ipv[inner] == d["ipv"]).all()
+
+
+@pytest.mark.parametrize("octets_enforced, expected", [
+    # Frames in closed intervals are dropped independent of the IPV
+    (False, [(1, 1), (0, 2), (1, 1), (1, 4)]),
+    # The octets are accounted per interval, so they are kept
+    (True, [(1, 1), (0, 2), (0, 3), (1, 1), (1, 4)]),
+])
+def test_merge_closed_intervals(install, octets_enforced, expected):
+    intervals = [{"low": 0, "high": 100000, "state": 1, "ipv": 1, "octets": 0},
+                 {"low": 100000, "high": 200000, "state": 0, "ipv": 2, "octets": 0},
+                 {"low": 200000, "high": 300000, "state": 0, "ipv": 3, "octets": 0},
+                 {"low": 300000, "high": 400000, "state": 1, "ipv": 1, "octets": 0},
+                 {"low": 400000, "high": 800000, "state": 1, "ipv": 4, "octets": 0}]
+    switch = install(intervals, 800000, octets_enforced=octets_enforced)
+
+    entries = installed_intervals(switch)
+    assert [(d["gate_state"], d["ipv"]) for _, d in entries] == expected
+    # The merged entries are still adjacent and cover the whole period
+    ranges = [r for r, _ in entries]
+    assert ranges[0][0] == 0 and ranges[-1][1] == TimeQuantization.quantize(800000)
+    assert all(a[1] + 1 == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+# 100 intervals of 2 slots of 4096 ns, with alternating gate states they can not be merged
+SLOT_INTERVALS = [{"low": i * 8192, "high": (i + 1) * 8192, "state": i % 2, "ipv": i % 8, "octets": 0}
+                  for i in range(100)]
+SLOT_PERIOD = 819200
+# The last interval includes the first slot of the next period, see quantize_intervals
+SLOT_COUNT = SLOT_PERIOD // 4096 + 1
+
+
+@pytest.mark.parametrize("slot_size, mode", [(SLOT_COUNT, ScheduleCompiler.SLOT),
+                                             (SLOT_COUNT - 1, ScheduleCompiler.RANGE)])
+def test_mode_at_slot_capacity(install, slot_size, mode):
+    switch = install(SLOT_INTERVALS, SLOT_PERIOD, defines={"__GATE_SLOTS__": 1, "__GATE_SLOT_SIZE__": slot_size})
+    sgc = switch.stream_gate_controller
+
+    assert sgc.schedule_modes[GATE_ID] == (mode, SLOT_COUNT)
+    slots = installed_intervals(switch, StreamGateController.SLOT_TABLE)
+    ranges = installed_intervals(switch)
+    if mode == ScheduleCompiler.SLOT:
+        assert [i for i, _ in slots] == list(range(SLOT_COUNT))
+        assert not ranges
+        assert sgc.slots_in_use() == SLOT_COUNT
+    else:
+        assert not slots
+        assert len(ranges) == len(SLOT_INTERVALS)
+        assert sgc.slots_in_use() == 0
+
+
+def test_choose_mode_boundaries():
+    compiler = ScheduleCompiler()
+    # 40 slot entries take the same share of the SRAM as 3 ternary entries of the TCAM
+    assert 40 / ScheduleCompiler.SRAM_ENTRIES == 3 / ScheduleCompiler.TCAM_ENTRIES
+
+    assert compiler.choose_mode(3, None) == ScheduleCompiler.RANGE
+    assert compiler.choose_mode(3, 39) == ScheduleCompiler.SLOT
+    assert compiler.choose_mode(3, 40) == ScheduleCompiler.RANGE
+    assert compiler.choose_mode(3, 39, free_slots=39) == ScheduleCompiler.SLOT
+    assert compiler.choose_mode(3, 39, free_slots=38) == ScheduleCompiler.RANGE
+    assert compiler.choose_mode(3, 39, free_slots=0) == ScheduleCompiler.RANGE
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from libs import TimeQuantization
+
+
+# Quantization of the loaded P4 program, __TS_SHIFT__ and __TS_WIDTH__, the first one is the default
+CONFIGURATIONS = [(12, 20), (10, 22), (8, 24), (12, 16), (0, 31), (1, 31), (29, 3)]
+
+TIMESTAMPS = [0, 1, 4095, 4096, 4097, 1600000, 2000000, 3100000, 800000000, 2**31 - 1, 2**31, 2**32 - 1, 2**32,
+              2**32 + 4096, 2**40 + 12345, 2**48 - 1]
+
+
+def bin_mask(shift, width):
+    return int("1" * width + "0" * shift, 2)
+
+
+def bin_quantize(ts, shift, width):
+    """
+    The former truncation via bin() strings, e.g. int(bin(ts & 0b11111111111111111111000000000000)[2:].zfill(48), 2) >> 12.
+    """
+    return int(bin(ts & bin_mask(shift, width))[2:].zfill(48), 2) >> shift
+
+
+def bin_quantize_upper(ts, border, shift, width):
+    return (int(bin(ts & bin_mask(shift, width))[2:].zfill(48), 2) - border) >> shift
+
+
+def bin_underflow_mask(shift, width):
+    valid = shift + width + 1
+    return int("1" * (48 - valid) + "0" * valid, 2)
+
+
+@pytest.fixture(autouse=True)
+def default_quantization():
+    yield
+    TimeQuantization.configure(*CONFIGURATIONS[0])
+
+
+def test_defaults():
+    assert TimeQuantization.TS_MASK == 0b11111111111111111111000000000000
+    assert TimeQuantization.TS_MAX == 1048575
+    assert TimeQuantization.key_slice() == "31:12"
+    assert TimeQuantization.resolution() == 4096
+    assert TimeQuantization.max_duration() == 2**32
+    assert TimeQuantization.underflow_mask() == 0b111111111111111000000000000000000000000000000000
+
+
+@pytest.mark.parametrize("shift, width", CONFIGURATIONS)
+@pytest.mark.parametrize("ts", TIMESTAMPS)
+def test_quantize(shift, width, ts):
+    TimeQuantization.configure(shift, width)
+    assert TimeQuantization.quantize(ts) == bin_quantize(ts, shift, width)
+    for border in (0, 1):
+        assert TimeQuantization.quantize_upper(ts, border) == bin_quantize_upper(ts, border, shift, width)
+
+
+@pytest.mark.parametrize("shift, width", CONFIGURATIONS)
+@pytest.mark.parametrize("ts", TIMESTAMPS)
+def test_quantize_override(shift, width, ts):
+    # The configured default quantization is overridden per call
+    assert TimeQuantization.quantize(ts, shift, width) == bin_quantize(ts, shift, width)
+    assert TimeQuantization.quantize_upper(ts, 1, shift, width) == bin_quantize_upper(ts, 1, shift, width)
+
+
+@pytest.mark.parametrize("shift, width", CONFIGURATIONS)
+def test_underflow_mask(shift, width):
+    TimeQuantization.configure(shift, width)
+    assert TimeQuantization.underflow_mask() == bin_underflow_mask(shift, width)
+    assert TimeQuantization.key_slice() == f"{shift + width - 1}:{shift}"
+    assert TimeQuantization.TS_MASK == bin_mask(shift, width)
+
+
+@pytest.mark.parametrize("shift, width", CONFIGURATIONS)
+def test_quantize_numpy(shift, width):
+    TimeQuantization.configure(shift, width)
+    ts = np.array(TIMESTAMPS, dtype=np.int64)
+
+    quantized = TimeQuantization.quantize(ts)
+    upper = TimeQuantization.quantize_upper(ts)
+    assert quantized.dtype == np.int64
+    assert quantized.tolist() == [bin_quantize(t, shift, width) for t in TIMESTAMPS]
+    assert upper.tolist() == [bin_quantize_upper(t, 1, shift, width) for t in TIMESTAMPS]
+
+
+@pytest.mark.parametrize("shift, width", CONFIGURATIONS)
+@pytest.mark.parametrize("intervals", [
+    [(0, 800000)],
+    [(0, 200000), (200000, 300000), (300000, 800000)],
+    [(0, 4096), (4096, 8191), (8191, 2**20), (2**20, 2**31)],
+])
+def test_quantize_intervals(shift, width, intervals):
+    lows, highs = zip(*intervals)
+    # The former Schedule.truncate_schedule, the upper border of the last interval is not shifted
+    expected = [(bin_quantize(low, shift, width), bin_quantize_upper(high, 0 if i == len(intervals) - 1 else 1, shift, width))
+                for i, (low, high) in enumerate(intervals)]
+
+    q_lows, q_highs = TimeQuantization.quantize_intervals(lows, highs, shift, width)
+    assert list(zip(q_lows.tolist(), q_highs.tolist())) == expected
+
+    TimeQuantization.configure(shift, width)
+    q_lows, q_highs = TimeQuantization.quantize_intervals(np.array(lows), np.array(highs))
+    assert q_lows.dtype == q_highs.dtype == np.int64
+    assert list(zip(q_lows.tolist(), q_highs.tolist())) == expected
+
+
+@pytest.mark.parametrize("shift, width", [(12, 0), (0, 32), (-1, 20), (12, 21), (17, 31)])
+def test_configure_invalid(shift, width):
+    assert not TimeQuantization.valid(shift, width)
+    with pytest.raises(ValueError):
+        TimeQuantization.configure(shift, width)
+    assert (TimeQuantization.TS_SHIFT, TimeQuantization.TS_WIDTH) == CONFIGURATIONS[0]
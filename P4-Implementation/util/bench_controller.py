@@ -0,0 +1,194 @@
+"""
+Provisioning throughput benchmark of the local controller.
+
+Generates synthetic configurations of increasing size and runs the startup sequence of
+Local-Controller/controller.py against the in-memory mock switch (Switch(mock=True)).
+Every configuration runs in a fresh process, so the peak RSS of one run is not inherited by the next.
+For every phase the number of written entries, entries/s, RPCs, wall time and peak RSS are written to CSV.
+
+Usage:
+    python3 bench_controller.py --streams 16 64 256 512 --intervals 2 8 --latency 0.0001
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+CONTROLLER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../Local-Controller"))
+
+# Ports with a packet generator application, there are at most 8 hyperperiods
+SCHEDULE_PORTS = [180, 188, 40, 32]
+PERIOD = 400000000
+
+CSV_HEADER = ["streams", "gates", "meters", "intervals", "phase", "entries",
+              "entries_per_s", "rpcs", "wall_time_s", "peak_rss_kb"]
+
+
+def create_config(streams: int, gates: int, meters: int, intervals: int, schedules: int = len(SCHEDULE_PORTS)):
+    """
+    Creates a synthetic configuration in the format of configuration.json.
+
+    :param streams: Number of streams, every stream gets its own stream filter.
+    :param gates: Number of stream gates, assigned round robin to the schedules.
+    :param meters: Number of flow meters.
+    :param intervals: Number of intervals per schedule.
+    :param schedules: Number of schedules, each one on its own port.
+    """
+    schedules = min(schedules, gates, len(SCHEDULE_PORTS))
+    slot = PERIOD // intervals
+
+    gate_schedules = [{"name": f"S{s}",
+                       "period": PERIOD,
+                       "time_shift": 0,
+                       "intervals": [{"low": i * slot,
+                                      "high": PERIOD if i == intervals - 1 else (i + 1) * slot,
+                                      "state": (i + 1) % 2,
+                                      "ipv": i % 8,
+                                      "octets": 500000} for i in range(intervals)]}
+                      for s in range(schedules)]
+
+    return {"simulation": {"enabled": False, "duration": 0, "json_file": "", "csv_file": "",
+                           "monitor_flow_meter_id": None, "monitor_stream_gate_id": None},
+            "streams": [{"vid": 1 + i // 65536,
+                         "stream_handle": i + 1,
+                         "ipv4_src": f"10.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}",
+                         "dst_port": 1000 + i % 1000,
+                         "stream_block_enable": True} for i in range(streams)],
+            "stream_filters": [{"stream_handle": i + 1,
+                                "stream_gate_instance": i % gates + 1,
+                                "max_sdu": 1500,
+                                "pcp": "*",
+                                "flow_meter_instance": i % meters + 1} for i in range(streams)],
+            "schedule_to_port": [{"schedule": f"S{s}", "port": SCHEDULE_PORTS[s]} for s in range(schedules)],
+            "stream_gates": [{"stream_gate_id": g + 1,
+                              "ipv": 8,
+                              "schedule": f"S{g % schedules}",
+                              "gate_closed_due_to_invalid_rx_enable": False,
+                              "gate_closed_due_to_octets_exceeded_enable": False} for g in range(gates)],
+            "flow_meters": [{"flow_meter_id": m + 1,
+                             "cir_kbps": 100000,
+                             "pir_kbps": 200000,
+                             "cbs": 1000,
+                             "pbs": 2000,
+                             "drop_yellow": False,
+                             "mark_red": False,
+                             "color_aware": False} for m in range(meters)],
+            "gate_schedules": gate_schedules}
+
+
+def run_startup(config_file: str, latency: float):
+    """
+    Runs the startup sequence of controller.py against the mock switch and measures every phase.
+    Executed in a separate process.
+
+    :returns rows: list of (phase, entries, rpcs, wall time, peak RSS) tuples
+    """
+    sys.path.insert(0, CONTROLLER_DIR)
+    import controller
+    from libs.Switch import Switch, DigestType
+    from libs.PortManager import PortManager
+    from libs.configuration import Config
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rows = []
+    device = None
+
+    def measure(phase, func):
+        entries = device.entry_count() if device else 0
+        rpcs = device.rpc_count if device else 0
+        start = time.perf_counter()
+        result = func()
+        duration = time.perf_counter() - start
+        written = device.entry_count() - entries
+        rows.append((phase, written, device.rpc_count - rpcs, duration,
+                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        return result
+
+    def connect():
+        nonlocal device
+        switch = Switch(name="s1", program="sdn-psfp", clear=False, mock=True, mock_latency=latency)
+        device = switch.c.device
+        return switch
+
+    s1 = measure("connect", connect)
+    pm = PortManager(switch=s1)
+
+    measure("clear", s1.delete_all_table_data)
+    config = measure("config", lambda: Config(config_file))
+    measure("ports", lambda: controller.configure_hosts(s1, pm, controller.get_hosts(pm)))
+    measure("stream_filter", lambda: controller.create_stream_filters(s1, config))
+    measure("stream_gate", lambda: controller.create_stream_gates(s1, config))
+    measure("flow_meter", lambda: controller.create_flow_meters(s1, config))
+    measure("hyperperiods", lambda: controller.configure_hyperperiods(s1, config))
+
+    def write_schedules():
+        # Same path as the digest of the first finished hyperperiod of each port
+        for app_id, d in list(s1.pkt_gen.app_id_mapping.items()):
+            if not d["port"]:
+                continue
+            s1.handle_digest({"reason": DigestType.HYPERPERIOD.value, "pipe_id": 1, "app_id": app_id, "ingress_ts": 0})
+
+    measure("schedules", write_schedules)
+
+    s1.shutdown()
+    return rows
+
+
+def bench_controller(streams: list, intervals: list, latency: float, output: str):
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+
+    runs = [(n, k) for n in streams for k in intervals]
+    for n, k in tqdm(runs):
+        gates = max(1, n // 4)
+        meters = max(1, n // 4)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(create_config(n, gates, meters, k), f)
+
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                rows = executor.submit(run_startup, f.name, latency).result()
+        finally:
+            os.unlink(f.name)
+
+        for phase, entries, rpcs, duration, rss in rows:
+            results.append([n, gates, meters, k, phase, entries,
+                            round(entries / duration) if duration else 0,
+                            rpcs, f"{duration:.6f}", rss])
+        total = sum(r[3] for r in rows)
+        print(f"{n=} {gates=} {meters=} intervals={k}: {sum(r[1] for r in rows)} entries, "
+              f"{sum(r[2] for r in rows)} RPCs in {total:.3f}s")
+
+    write_results(results, output)
+
+
+def write_results(results, output):
+    with open(output, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=";")
+        writer.writerow(CSV_HEADER)
+        for row in results:
+            writer.writerow(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provisioning throughput benchmark of the local controller")
+    parser.add_argument('--streams', nargs='+', type=int, default=[16, 64, 256, 512],
+                        help="Numbers of streams to benchmark, a quarter of it is used for gates and flow meters.")
+    parser.add_argument('--intervals', nargs='+', type=int, default=[2, 8],
+                        help="Numbers of intervals per gate schedule.")
+    parser.add_argument('--latency', default=0.0, type=float, help="Injected latency per RPC in seconds.")
+    parser.add_argument('-o', '--output', default="bench_controller_results.csv", type=str, help="CSV file for the results.")
+    args = parser.parse_args()
+
+    bench_controller(args.streams, args.intervals, args.latency, args.output)
@@ -0,0 +1,109 @@
+"""
+Digest handling benchmark of the local controller.
+
+Replays a digest log, recorded with controller.py --record-digests or generated synthetically,
+into the digest pipeline of a controller provisioned against the in-memory mock switch (Switch(mock=True)).
+Reports the handled digests per second and the latency of the hyperperiod handling, i.e. the schedule writes,
+per digest type.
+
+Usage:
+    python3 bench_digests.py --log digests.bin --speed 0
+    python3 bench_digests.py --storm 100000 --batch 100 --speed 0
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from bench_controller import CONTROLLER_DIR, SCHEDULE_PORTS, create_config
+
+sys.path.insert(0, CONTROLLER_DIR)
+
+
+def create_log(path: str, storm: int, batch: int, hyperperiods: int):
+    """
+    Writes a synthetic digest log: a storm of MARKEDRED and MAXSDUEXCEEDED digests with the
+    digests of the first finished hyperperiod of every app id spread across it.
+    """
+    from libs.DigestLog import DigestRecorder
+    from libs.Switch import DigestType
+
+    recorder = DigestRecorder(path)
+    batches = max(1, storm // batch)
+    hyperperiod_every = max(1, batches // (hyperperiods + 1))
+
+    for b in range(batches):
+        reason = DigestType.MARKEDRED if b % 2 else DigestType.MAXSDUEXCEEDED
+        recorder.record("digest_block_psfp",
+                        [{"stream_handle": (b * batch + i) % 64, "stream_gate_id": 1, "drop_ctl": 1, "PSFPGateEnabled": 0,
+                          "reason": reason.value, "color": 3, "flow_meter_instance_id": 1} for i in range(batch)],
+                        ts=recorder.start + b * 0.001)
+
+        app_id = b // hyperperiod_every
+        if b % hyperperiod_every == 0 and app_id < hyperperiods:
+            recorder.record("digest_hyperperiod",
+                            [{"ingress_port": SCHEDULE_PORTS[app_id], "app_id": app_id, "pipe_id": 1,
+                              "ingress_ts": 0, "reason": DigestType.HYPERPERIOD.value}],
+                            ts=recorder.start + b * 0.001)
+    recorder.close()
+
+
+def bench_digests(log: str, speed: float, streams: int, intervals: int):
+    import controller
+    from libs.Switch import Switch
+    from libs.configuration import Config
+    from libs.DigestLog import DigestReplayer
+
+    # controller.py configures INFO logging on import
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(create_config(streams, max(1, streams // 4), max(1, streams // 4), intervals), f)
+
+    try:
+        s1 = Switch(name="s1", program="sdn-psfp", clear=False, mock=True)
+        config = Config(f.name)
+        controller.create_stream_filters(s1, config)
+        controller.create_stream_gates(s1, config)
+        controller.create_flow_meters(s1, config)
+        controller.configure_hyperperiods(s1, config)
+    finally:
+        os.unlink(f.name)
+
+    result = DigestReplayer(s1, log, speed).run()
+    print(f"{result['entries']} digests in {result['batches']} batches handled in {result['duration']:.3f}s, "
+          f"{result['entries_per_s']:.0f} digests/s")
+
+    for digest_type, stats in s1.digest_dispatcher.stats().items():
+        if not stats["received"]:
+            continue
+        print(f"{digest_type:>15}: {stats['handled']} handled, {stats['dropped']} dropped, "
+              f"latency avg={stats['latency_avg'] * 1000:.3f}ms max={stats['latency_max'] * 1000:.3f}ms, "
+              f"wait max={stats['wait_max'] * 1000:.3f}ms")
+
+    s1.digest_dispatcher.stop()
+    s1.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Digest handling benchmark of the local controller")
+    parser.add_argument('--log', default=None, type=str, help="Digest log to replay, a synthetic one is generated if not set.")
+    parser.add_argument('--storm', default=100000, type=int, help="Number of block digests of the synthetic log.")
+    parser.add_argument('--batch', default=100, type=int, help="Entries per digest batch of the synthetic log.")
+    parser.add_argument('--speed', default=0.0, type=float, help="Replay speed relative to the recording, 0 is as fast as possible.")
+    parser.add_argument('--streams', default=64, type=int, help="Number of streams of the provisioned configuration.")
+    parser.add_argument('--intervals', default=8, type=int, help="Number of intervals per gate schedule.")
+    args = parser.parse_args()
+
+    if args.log:
+        bench_digests(args.log, args.speed, args.streams, args.intervals)
+    else:
+        with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+            log = f.name
+        try:
+            create_log(log, args.storm, args.batch, len(SCHEDULE_PORTS))
+            bench_digests(log, args.speed, args.streams, args.intervals)
+        finally:
+            os.unlink(log)